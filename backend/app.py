@@ -1,10 +1,16 @@
 import logging
 from fastapi import FastAPI
-from routes import auth, closet
+from routes import auth, closet, images, metrics, profiling
 import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
 from config import env
-from middleware import LoggingStaticFiles  # Ensure this import is correct
+from middleware import ImageStaticFiles, RequestMetricsMiddleware, TracingMiddleware
+from modules.bulk_import import mark_interrupted_jobs
+from modules.auth import close_http_client
+from modules.image_gc import start_background_reclaimer
+from modules.classify import load_model
+from modules.closet import get_cloth_segmenter, segmenter_lock
+from modules.runtime import configure_torch_runtime
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -12,8 +18,13 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
-# Serve static files from the "data/images" directory at the "/static" path using the custom LoggingStaticFiles class
-app.mount("/static", LoggingStaticFiles(directory=env.IMAGES_DIR), name="static")
+# Serve images from the "data/images" directory at the "/static" path with caching, range support and sampled logging.
+# Requests are authorized by signed, expiring URLs rather than the bearer token.
+app.mount(
+    "/static",
+    ImageStaticFiles(directory=env.IMAGES_DIR, require_signature=env.IMAGE_URL_SIGNING),
+    name="static"
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -22,9 +33,40 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(TracingMiddleware)
+# Outermost, so the recorded latency includes every other middleware
+app.add_middleware(RequestMetricsMiddleware)
 
 app.include_router(auth.router)
 app.include_router(closet.router)
+app.include_router(images.router)
+app.include_router(metrics.router)
+app.include_router(profiling.router)
+
+@app.on_event("startup")
+def configure_runtime():
+    # Before the models load: thread pools are sized once per worker process
+    configure_torch_runtime()
+
+@app.on_event("startup")
+def load_models():
+    # Loaded here rather than at import, so scripts can import the modules cheaply
+    load_model()
+    with segmenter_lock:
+        get_cloth_segmenter()
+
+@app.on_event("startup")
+def flag_interrupted_imports():
+    # Imports that were mid-flight when the previous process died can be resumed
+    mark_interrupted_jobs()
+
+@app.on_event("startup")
+def start_image_gc():
+    start_background_reclaimer()
+
+@app.on_event("shutdown")
+async def close_oauth_client():
+    await close_http_client()
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,228 @@
+"""Latency and throughput of the closet read endpoints against synthetic closets.
+
+    python -m benchmarks.closet_load --sizes 10 1000 100000 --concurrency 1 8 32 --users 4
+    python -m benchmarks.closet_load --server uvicorn --image-stores local s3 --output closet_load.json
+
+Generates a closet of each size (garments with renditions, labels, palettes
+and attributes), gives every test user a copy, mints their JWTs with
+create_token and drives GET /api/user/closet, /closet-items and
+/closet-categories at each concurrency level. Requests go to the app
+in-process through httpx, or over HTTP to a uvicorn server started on a
+local port (``--server uvicorn``; model loading at startup is skipped).
+
+Each closet is written in one of two layouts: ``snapshot`` (everything in the
+CSV) or ``journal`` (the newest items still in the journal, as between
+compactions). Image stores are switched between runs: ``local`` signs every
+URL, ``local-unsigned`` doesn't, ``s3`` builds bucket URLs (needs boto3, no
+network). Everything is written under a temporary directory.
+
+Prints one line per point and, with ``--output``, saves every point as JSON
+so curves can be plotted or compared between commits.
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+
+ENDPOINTS = {
+    'closet': '/api/user/closet',
+    'closet-items': '/api/user/closet-items',
+    'closet-categories': '/api/user/closet-categories',
+}
+CATEGORIES = ['top', 'shirt', 'sweater', 'jacket', 'pants', 'jeans', 'skirt', 'shorts', 'dress']
+COLORS = ['black', 'white', 'gray', 'beige', 'blue', 'navy', 'red', 'green']
+SERVER_PORT = 8766
+
+
+def configure_environment(root: str) -> None:
+    # Must run before config is imported: it creates the data directories
+    for name, sub in [('CLOSETS_DIR', 'closets'), ('IMAGES_DIR', 'images'), ('IMPORTS_DIR', 'imports'),
+                      ('EMBEDDINGS_DIR', 'embeddings'), ('WEAR_LOGS_DIR', 'wear')]:
+        os.environ[name] = os.path.join(root, sub) + '/'
+    os.environ.setdefault("GOOGLE_CLIENT_ID", "test-client-id")
+    os.environ.setdefault("GOOGLE_CLIENT_SECRET", "test-client-secret")
+    os.environ.setdefault("GOOGLE_REDIRECT_URI", "http://localhost:3000")
+    os.environ.setdefault("JWT_SECRET", "benchmark-secret")
+    os.environ.setdefault("S3_ENDPOINT_URL", "http://127.0.0.1:9000")
+
+
+def synthetic_item(rng: np.random.Generator, user_id: str) -> dict:
+    from modules.cutouts import cutout_renditions
+
+    item_id = str(uuid.uuid4())
+    prefix = f"{user_id}/{item_id}"
+    names = ['masked_1', 'masked_2'] if rng.random() < 0.6 else ['masked_3']
+    renditions = {name: cutout_renditions(prefix, name) for name in names}
+    renditions['combined_masked'] = cutout_renditions(prefix, 'combined_masked')
+    digest = rng.bytes(8).hex()
+    renditions['original'] = {r: f"{prefix}/original.{r}.{digest}.webp" for r in ('thumb', 'medium', 'full')}
+    return {
+        'id': item_id,
+        'image_path': renditions['original']['full'],
+        'clothes_mask': f"{prefix}/labels.{digest}.rle",
+        'masked_images': {name: renditions[name]['full'] for name in names},
+        'combined_mask_image_path': renditions['combined_masked']['full'],
+        'classification_results': {
+            name: {'category': str(rng.choice(CATEGORIES)), 'color': str(rng.choice(COLORS))} for name in names
+        },
+        'image_hash': rng.bytes(8).hex(),
+        'renditions': renditions,
+        'color': str(rng.choice(COLORS)),
+        'colors': {name: [(f"#{rng.bytes(3).hex()}", 0.6), (f"#{rng.bytes(3).hex()}", 0.3)] for name in names},
+        'attributes': {name: {'category': str(rng.choice(CATEGORIES)), 'texture': ['solid']} for name in names},
+    }
+
+
+def write_closets(size: int, user_ids: list, layout: str, seed: int) -> None:
+    """Give every user the same synthetic closet of ``size`` items."""
+    import shutil
+    import pandas as pd
+    from config import env
+    from modules.closet import CLOSET_COLUMNS, Closet
+
+    rng = np.random.default_rng(seed)
+    owner = user_ids[0]
+    items = [synthetic_item(rng, owner) for _ in range(size)]
+    journaled = min(size // 2, env.CLOSET_JOURNAL_COMPACT_THRESHOLD - 1) if layout == 'journal' else 0
+
+    closet = Closet(owner)
+    closet.df = pd.DataFrame(items[:size - journaled], columns=CLOSET_COLUMNS)
+    closet._save_df()
+    if journaled:
+        closet.add_items(items[size - journaled:])
+    for user_id in user_ids[1:]:
+        for suffix in ('_closet.csv', '_closet.journal'):
+            source = os.path.join(env.CLOSETS_DIR, f"{owner}{suffix}")
+            if os.path.exists(source):
+                shutil.copyfile(source, os.path.join(env.CLOSETS_DIR, f"{user_id}{suffix}"))
+
+
+def use_image_store(name: str) -> bool:
+    from config import env
+    from modules import image_store
+
+    if name == 's3' and importlib.util.find_spec('boto3') is None:
+        print("Skipping image store s3: boto3 is not installed")
+        return False
+    env.IMAGE_STORE = 's3' if name == 's3' else 'local'
+    env.IMAGE_URL_SIGNING = name != 'local-unsigned'
+    image_store._image_store = None
+    return True
+
+
+def start_server(port: int) -> None:
+    import uvicorn
+    from app import app
+
+    # No lifespan: the startup hooks would load the ML models
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+
+async def drive(client, path: str, tokens: list, concurrency: int, requests: int, max_seconds: float) -> dict:
+    latencies = []
+    errors = 0
+    issued = 0
+    deadline = time.perf_counter() + max_seconds
+
+    async def worker(worker_id: int) -> None:
+        nonlocal errors, issued
+        headers = {'Authorization': f"Bearer {tokens[worker_id % len(tokens)]}"}
+        while issued < requests and time.perf_counter() < deadline:
+            issued += 1
+            started = time.perf_counter()
+            response = await client.get(path, headers=headers)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies_ms = np.array(latencies) * 1e3
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_per_s': round(len(latencies) / elapsed, 2),
+        'p50_ms': round(float(np.percentile(latencies_ms, 50)), 2),
+        'p95_ms': round(float(np.percentile(latencies_ms, 95)), 2),
+        'p99_ms': round(float(np.percentile(latencies_ms, 99)), 2),
+    }
+
+
+async def run(args) -> list:
+    import logging
+    import httpx
+    from modules.auth import User, create_token
+
+    user_ids = [f"load-user-{i}" for i in range(args.users)]
+    tokens = [create_token(User(id=user_id, email=f"{user_id}@example.com", name=user_id)) for user_id in user_ids]
+    if args.server == 'uvicorn':
+        start_server(args.port)
+        client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=None)
+    else:
+        from app import app
+        client = httpx.AsyncClient(app=app, base_url="http://app", timeout=None)
+    # app configures INFO logging, and the routes log every request
+    logging.getLogger().setLevel(logging.WARNING)
+
+    points = []
+    async with client:
+        for seed, size in enumerate(args.sizes):
+            for layout in args.layouts:
+                write_closets(size, user_ids, layout, seed)
+                for store in args.image_stores:
+                    if not use_image_store(store):
+                        continue
+                    for endpoint in args.endpoints:
+                        for concurrency in args.concurrency:
+                            # Warm the token cache and any per-process state first
+                            await client.get(ENDPOINTS[endpoint], headers={'Authorization': f"Bearer {tokens[0]}"})
+                            stats = await drive(client, ENDPOINTS[endpoint], tokens, concurrency,
+                                                args.requests, args.max_seconds)
+                            point = {'size': size, 'layout': layout, 'image_store': store, 'endpoint': endpoint,
+                                     'concurrency': concurrency, 'users': args.users, **stats}
+                            points.append(point)
+                            print(f"{size:>7} items {layout:<8} {store:<14} {endpoint:<17} c={concurrency:<4} "
+                                  f"{stats['throughput_per_s']:>8.1f}/s  p50={stats['p50_ms']:>9.1f}ms  "
+                                  f"p95={stats['p95_ms']:>9.1f}ms  p99={stats['p99_ms']:>9.1f}ms  "
+                                  f"errors={stats['errors']}")
+    return points
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--users", type=int, default=4, help="distinct users (and closets) the requests rotate over")
+    parser.add_argument("--endpoints", nargs="+", choices=list(ENDPOINTS), default=list(ENDPOINTS))
+    parser.add_argument("--layouts", nargs="+", choices=['snapshot', 'journal'], default=['snapshot'])
+    parser.add_argument("--image-stores", nargs="+", choices=['local', 'local-unsigned', 's3'], default=['local'])
+    parser.add_argument("--server", choices=['inprocess', 'uvicorn'], default='inprocess')
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--requests", type=int, default=100, help="requests per point")
+    parser.add_argument("--max-seconds", type=float, default=30.0, help="stop issuing requests for a point after this")
+    parser.add_argument("--output", help="write all points to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        configure_environment(root)
+        points = asyncio.run(run(args))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'points': points}, f, indent=2)
+        print(f"Saved {len(points)} points to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
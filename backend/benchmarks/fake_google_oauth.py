@@ -0,0 +1,70 @@
+"""Local stand-in for Google's OAuth token and certs endpoints.
+
+Signs ID tokens with a throwaway RSA key so the real verification path in
+modules.auth runs unchanged. Point the backend at it with:
+
+    GOOGLE_TOKEN_URL=http://127.0.0.1:8765/token
+    GOOGLE_CERTS_URL=http://127.0.0.1:8765/certs
+
+and run it with ``uvicorn benchmarks.fake_google_oauth:app --port 8765``.
+"""
+import datetime
+import os
+import time
+import uuid
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from fastapi import FastAPI, Form, Response
+from google.auth import crypt, jwt as google_jwt
+
+CLIENT_ID = os.environ.get("GOOGLE_CLIENT_ID", "test-client-id")
+KEY_ID = "stand-in-key"
+CERTS_MAX_AGE = 3600
+
+_private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+_private_pem = _private_key.private_bytes(
+    serialization.Encoding.PEM,
+    serialization.PrivateFormat.TraditionalOpenSSL,
+    serialization.NoEncryption(),
+)
+_subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "stand-in")])
+_now = datetime.datetime.utcnow()
+_certificate = (
+    x509.CertificateBuilder()
+    .subject_name(_subject)
+    .issuer_name(_subject)
+    .public_key(_private_key.public_key())
+    .serial_number(x509.random_serial_number())
+    .not_valid_before(_now - datetime.timedelta(days=1))
+    .not_valid_after(_now + datetime.timedelta(days=1))
+    .sign(_private_key, hashes.SHA256())
+)
+_certificate_pem = _certificate.public_bytes(serialization.Encoding.PEM).decode()
+_signer = crypt.RSASigner.from_string(_private_pem, key_id=KEY_ID)
+
+app = FastAPI()
+
+
+@app.post("/token")
+async def token(code: str = Form(...)):
+    now = int(time.time())
+    user_id = code if code.isdigit() else str(uuid.uuid5(uuid.NAMESPACE_OID, code).int)[:21]
+    id_token = google_jwt.encode(_signer, {
+        "iss": "https://accounts.google.com",
+        "aud": CLIENT_ID,
+        "sub": user_id,
+        "email": f"{user_id}@example.com",
+        "name": f"User {user_id}",
+        "iat": now,
+        "exp": now + 3600,
+    })
+    return {"access_token": "stand-in", "id_token": id_token.decode(), "token_type": "Bearer"}
+
+
+@app.get("/certs")
+async def certs(response: Response):
+    response.headers["Cache-Control"] = f"public, max-age={CERTS_MAX_AGE}"
+    return {KEY_ID: _certificate_pem}
@@ -0,0 +1,279 @@
+"""Per-stage timings of the upload pipeline, offline, on synthetic photos.
+
+    python -m benchmarks.ingest --megapixels 0.5 2 8 --iterations 20 --output ingest.json
+    python -m benchmarks.ingest --compare ingest.json
+
+Stages, in pipeline order: decode (decode_image on JPEG bytes), hash, segment
+(ClothSegmenter.segment), composite (RGBA cutouts) and encode (PNG per
+cutout), which is what /static does when a cutout is first requested,
+classify, and persist (save_results into the image store plus one closet
+journal append).
+
+U2NET uses data/models/cloth_segment.pth if it is already on disk and random
+weights otherwise; nothing is downloaded. Random weights predict meaningless
+masks, so a fixed synthetic label map (a top over a bottom) replaces them and
+the later stages do representative work. Classification uses fashionSigLIP
+if it loads offline (HF cache), else a random-init ResNet-18 FashionResnet of
+similar cost. Everything is written under a temporary directory.
+
+For each photo size and stage this reports throughput and p50/p95/p99.
+``--output`` saves the results as JSON, and ``--compare`` prints each
+stage's p50 against such a file, e.g. one saved on the previous commit.
+
+Torch thread counts and CPU pinning come from the same settings as the
+server (TORCH_INTRA_OP_THREADS, CPU_AFFINITY, ...), which is how
+benchmarks.tune_threads sweeps them. ``--barrier`` makes several copies
+started side by side begin measuring together.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+import numpy as np
+
+STAGES = ['decode', 'hash', 'segment', 'composite', 'encode', 'classify', 'persist']
+
+
+def configure_environment(root: str) -> None:
+    # Must run before config is imported: it creates the data directories
+    for name, sub in [('CLOSETS_DIR', 'closets'), ('IMAGES_DIR', 'images'), ('IMPORTS_DIR', 'imports'),
+                      ('EMBEDDINGS_DIR', 'embeddings'), ('WEAR_LOGS_DIR', 'wear')]:
+        os.environ[name] = os.path.join(root, sub) + '/'
+    os.environ.setdefault("GOOGLE_CLIENT_ID", "test-client-id")
+    os.environ.setdefault("GOOGLE_CLIENT_SECRET", "test-client-secret")
+    os.environ.setdefault("GOOGLE_REDIRECT_URI", "http://localhost:3000")
+    os.environ.setdefault("JWT_SECRET", "benchmark-secret")
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def summarize(samples: list) -> dict:
+    samples_ms = np.array(samples) * 1e3
+    return {
+        'n': len(samples),
+        'throughput_per_s': round(len(samples) / max(float(np.sum(samples)), 1e-9), 2),
+        'mean_ms': round(float(samples_ms.mean()), 3),
+        'p50_ms': round(float(np.percentile(samples_ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(samples_ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(samples_ms, 99)), 3),
+    }
+
+
+def make_classifier():
+    """(name, fn(pixels, masks)) for the classify stage."""
+    from modules.preprocess import ATTRIBUTE_SIZE, IMAGENET_TABLE, cutout_inputs
+    try:
+        from modules.classify import classify_and_embed_inputs, load_model
+        load_model()
+        return 'fashionSigLIP', lambda pixels, masks: classify_and_embed_inputs(cutout_inputs(pixels, masks))
+    except Exception as e:
+        print(f"fashionSigLIP unavailable offline ({type(e).__name__}), classifying with a random-init FashionResnet")
+
+    import torch
+    from modules.fashion_resnet import FashionResnet
+    model = FashionResnet(50, 1000, resnet_type='resnet18').eval()
+
+    def classify(pixels, masks):
+        with torch.inference_mode():
+            return model(cutout_inputs(pixels, masks, ATTRIBUTE_SIZE, IMAGENET_TABLE, background=255))
+    return 'fashion_resnet18 (random init)', classify
+
+
+def synthetic_labels(size: int):
+    """Instance map and names for a top over a bottom, as split_instances returns them."""
+    from modules.instances import split_instances
+    class_map = np.zeros((size, size), dtype=np.uint8)
+    class_map[size // 8:size // 2, size // 4:3 * size // 4] = 1
+    class_map[size // 2:7 * size // 8, size // 3:2 * size // 3] = 2
+    return split_instances(class_map)
+
+
+def wait_at_barrier(directory: str, parties: int, timeout: float = 600.0) -> None:
+    """Block until ``parties`` processes have reached this point."""
+    os.makedirs(directory, exist_ok=True)
+    open(os.path.join(directory, f"{os.getpid()}.ready"), 'w').close()
+    deadline = time.monotonic() + timeout
+    while len([name for name in os.listdir(directory) if name.endswith('.ready')]) < parties:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Only some of {parties} benchmark processes reached the barrier")
+        time.sleep(0.05)
+
+
+def run_size(megapixels: float, iterations: int, segmenter, classify, closet, seed: int,
+             labels=None) -> dict:
+    from benchmarks.preprocess import random_photo
+    from modules.image_io import decode_image
+    from modules.image_store import encode_image
+
+    buffer = io.BytesIO()
+    random_photo(megapixels, seed).save(buffer, 'JPEG', quality=90)
+    upload = buffer.getvalue()
+    samples = {stage: [] for stage in STAGES}
+    garments = []
+
+    for i in range(iterations + 1):
+        timings = {}
+        started = time.perf_counter()
+        image = decode_image(upload)
+        timings['decode'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        image_hash = closet._image_hash(image)
+        timings['hash'] = time.perf_counter() - started
+
+        item_id = str(uuid.uuid4())
+        started = time.perf_counter()
+        segmenter.segment(image, f"{closet.user_id}/{item_id}")
+        timings['segment'] = time.perf_counter() - started
+        if labels is not None:
+            segmenter.instance_arr, segmenter.instance_names = labels
+
+        started = time.perf_counter()
+        cutouts = segmenter.cutouts()
+        timings['composite'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for cutout in cutouts.values():
+            encode_image(cutout, 'png')
+        timings['encode'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        if cutouts:
+            classify(segmenter.model_input, segmenter.garment_masks())
+        timings['classify'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        segmenter.save_results()
+        closet.add_items([{
+            'id': item_id, 'image_path': segmenter.original_image_path, 'clothes_mask': segmenter.mask_path,
+            'masked_images': dict(segmenter.masked_images), 'renditions': dict(segmenter.renditions),
+            'combined_mask_image_path': segmenter.combined_mask_image_path,
+            'classification_results': {}, 'image_hash': f"{image_hash}-{i}",
+            'color': None, 'colors': {}, 'attributes': {},
+        }])
+        timings['persist'] = time.perf_counter() - started
+
+        if i == 0:
+            # Warm-up pass: first-call allocations and lazy imports
+            continue
+        garments.append(len(cutouts))
+        for stage, elapsed in timings.items():
+            samples[stage].append(elapsed)
+
+    result = {stage: summarize(values) for stage, values in samples.items()}
+    result['total'] = summarize([sum(values) for values in zip(*samples.values())])
+    return {'width': image.width, 'height': image.height, 'upload_bytes': len(upload),
+            'mean_garments': float(np.mean(garments)), 'stages': result}
+
+
+def print_results(results: dict) -> None:
+    for size, entry in results.items():
+        print(f"\n{size} MP upload -> {entry['width']}x{entry['height']} decoded, "
+              f"{entry['mean_garments']:.1f} garments on average")
+        print(f"  {'stage':<10} {'per s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for stage, stats in entry['stages'].items():
+            print(f"  {stage:<10} {stats['throughput_per_s']:>8.1f} {stats['p50_ms']:>9.1f} "
+                  f"{stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f}")
+
+
+def compare(results: dict, baseline_path: str, tolerance: float) -> bool:
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\np50 against {baseline_path} (commit {baseline['meta']['commit']}):")
+    regressed = False
+    for size, entry in results.items():
+        base_entry = baseline['results'].get(size)
+        if base_entry is None:
+            continue
+        for stage, stats in entry['stages'].items():
+            base = base_entry['stages'].get(stage)
+            if base is None or base['p50_ms'] == 0:
+                continue
+            ratio = stats['p50_ms'] / base['p50_ms']
+            flag = ''
+            if ratio > 1 + tolerance:
+                flag = '  SLOWER'
+                regressed = True
+            elif ratio < 1 - tolerance:
+                flag = '  faster'
+            print(f"  {size:>5} MP {stage:<10} {base['p50_ms']:9.1f} -> {stats['p50_ms']:9.1f} ms ({ratio:5.2f}x){flag}")
+    return not regressed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--megapixels", type=float, nargs="+", default=[0.5, 2, 8])
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare p50s against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="p50 change reported as a regression")
+    parser.add_argument("--barrier", help="directory to rendezvous in before measuring")
+    parser.add_argument("--barrier-parties", type=int, default=1, help="processes meeting at --barrier")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        configure_environment(root)
+        import torch
+        from modules.closet import Closet
+        from modules.segment import ClothSegmenter
+        from modules.segment_model import LOCAL_CHECKPOINT_PATH, initialize_model
+        from modules.runtime import configure_torch_runtime
+
+        from modules.preprocess import SEGMENT_SIZE
+
+        configure_torch_runtime()
+        torch.manual_seed(0)
+        has_checkpoint = os.path.exists(LOCAL_CHECKPOINT_PATH)
+        segmenter = ClothSegmenter(model=initialize_model(LOCAL_CHECKPOINT_PATH))
+        labels = None if has_checkpoint else synthetic_labels(SEGMENT_SIZE)
+        classifier_name, classify = make_classifier()
+        closet = Closet('benchmark')
+        if args.barrier:
+            wait_at_barrier(args.barrier, args.barrier_parties)
+
+        results = {}
+        for seed, megapixels in enumerate(args.megapixels):
+            results[f"{megapixels:g}"] = run_size(megapixels, args.iterations, segmenter, classify, closet,
+                                                  seed, labels)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'torch_threads': torch.get_num_threads(),
+            'torch_interop_threads': torch.get_num_interop_threads(),
+            'cpus': sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else None,
+            'cpu_count': os.cpu_count(),
+            'segmenter_checkpoint': has_checkpoint,
+            'classifier': classifier_name,
+            'iterations': args.iterations,
+        },
+        'results': results,
+    }
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved results to {args.output}")
+    if args.compare and not compare(results, args.compare, args.tolerance):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Drive concurrent Google logins through the app against the local stand-in.
+
+    python -m benchmarks.login --requests 500 --concurrency 50
+
+Starts benchmarks.fake_google_oauth on a local port, points the backend at it
+and prints the login latency histograms collected by modules.auth.
+"""
+import argparse
+import asyncio
+import os
+import threading
+import time
+
+STAND_IN_PORT = 8765
+
+
+def start_stand_in(port: int) -> None:
+    import uvicorn
+    from benchmarks.fake_google_oauth import app as stand_in_app
+
+    server = uvicorn.Server(uvicorn.Config(stand_in_app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+
+async def run(requests: int, concurrency: int) -> None:
+    import httpx
+    from app import app
+    from modules.auth import close_http_client
+    from modules.metrics import all_histograms
+
+    semaphore = asyncio.Semaphore(concurrency)
+    failures = 0
+
+    async with httpx.AsyncClient(app=app, base_url="http://app") as client:
+        async def login(i: int) -> None:
+            nonlocal failures
+            async with semaphore:
+                response = await client.post("/api/auth/google", json={"code": str(100000 + i % 50)})
+                if response.status_code != 200:
+                    failures += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(login(i) for i in range(requests)))
+        elapsed = time.perf_counter() - started
+    await close_http_client()
+
+    print(f"{requests} logins in {elapsed:.2f}s ({requests / elapsed:.1f}/s), {failures} failed")
+    for name, hist in sorted(all_histograms().items()):
+        if not name.startswith("auth_google"):
+            continue
+        snapshot = hist.snapshot()
+        mean_ms = 1000 * snapshot["sum"] / max(snapshot["count"], 1)
+        print(f"\n{name}: count={snapshot['count']} mean={mean_ms:.2f}ms")
+        for upper, cumulative in snapshot["buckets"]:
+            print(f"  <= {upper:>6}s  {cumulative}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--port", type=int, default=STAND_IN_PORT)
+    args = parser.parse_args()
+
+    os.environ.setdefault("GOOGLE_CLIENT_ID", "test-client-id")
+    os.environ.setdefault("GOOGLE_CLIENT_SECRET", "test-client-secret")
+    os.environ.setdefault("GOOGLE_REDIRECT_URI", "http://localhost:3000")
+    os.environ.setdefault("JWT_SECRET", "benchmark-secret")
+    os.environ["GOOGLE_TOKEN_URL"] = f"http://127.0.0.1:{args.port}/token"
+    os.environ["GOOGLE_CERTS_URL"] = f"http://127.0.0.1:{args.port}/certs"
+
+    start_stand_in(args.port)
+    asyncio.run(run(args.requests, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
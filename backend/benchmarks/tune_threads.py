@@ -0,0 +1,138 @@
+"""Sweep worker count, torch thread counts and CPU pinning with the ingest
+benchmark, and report the settings with the best throughput on this host.
+
+    python -m benchmarks.tune_threads
+    python -m benchmarks.tune_threads --workers 1 2 4 --threads 1 2 4 --affinity off auto --megapixels 2
+
+Each configuration runs ``--workers`` copies of benchmarks.ingest side by
+side (like that many uvicorn workers), each with TORCH_INTRA_OP_THREADS and
+TORCH_INTER_OP_THREADS set and, with ``--affinity auto``, pinned to its own
+slice of the CPUs. The copies start measuring together and their
+throughputs are summed; the p95 reported is the worst worker's. Thread
+counts default to every power of two up to the CPUs per worker, plus one
+oversubscribed run (all CPUs per worker) as the untuned baseline.
+
+Prints one line per configuration, then the best one as environment
+variables for the server. ``--output`` saves every run as JSON.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def available_cpus() -> list:
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def thread_candidates(cpus: int, workers: int) -> list:
+    per_worker = max(1, cpus // workers)
+    candidates = {per_worker}
+    threads = 1
+    while threads < per_worker:
+        candidates.add(threads)
+        threads *= 2
+    if workers > 1:
+        # What torch does by default in every worker
+        candidates.add(cpus)
+    return sorted(candidates)
+
+
+def run_config(workers: int, threads: int, inter_op: int, affinity: str, args, root: str) -> dict:
+    cpus = available_cpus()
+    per_worker = max(1, len(cpus) // workers)
+    run_dir = tempfile.mkdtemp(dir=root)
+    processes = []
+    for worker in range(workers):
+        env = dict(os.environ, WEB_CONCURRENCY=str(workers), TORCH_INTRA_OP_THREADS=str(threads),
+                   TORCH_INTER_OP_THREADS=str(inter_op), CPU_AFFINITY='')
+        if affinity == 'auto':
+            # Explicit slices: the workers don't share a data directory to claim them through
+            start = (worker * per_worker) % len(cpus)
+            env['CPU_AFFINITY'] = ','.join(str(cpu) for cpu in cpus[start:start + per_worker])
+        output = os.path.join(run_dir, f"worker-{worker}.json")
+        command = [sys.executable, '-m', 'benchmarks.ingest', '--megapixels', *map(str, args.megapixels),
+                   '--iterations', str(args.iterations), '--output', output,
+                   '--barrier', os.path.join(run_dir, 'barrier'), '--barrier-parties', str(workers)]
+        processes.append((subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL,
+                                           stderr=subprocess.PIPE, text=True), output))
+
+    started = time.perf_counter()
+    reports = []
+    for process, output in processes:
+        _, stderr = process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError(f"benchmarks.ingest failed:\n{stderr[-2000:]}")
+        with open(output) as f:
+            reports.append(json.load(f))
+
+    totals = [entry['stages']['total'] for report in reports for entry in report['results'].values()]
+    stages = {}
+    for report in reports:
+        for entry in report['results'].values():
+            for stage, stats in entry['stages'].items():
+                stages.setdefault(stage, []).append(stats['p50_ms'])
+    return {
+        'workers': workers,
+        'intra_op_threads': threads,
+        'inter_op_threads': inter_op,
+        'affinity': affinity,
+        'throughput_per_s': round(sum(t['throughput_per_s'] for t in totals) / len(args.megapixels), 3),
+        'p50_ms': round(max(t['p50_ms'] for t in totals), 1),
+        'p95_ms': round(max(t['p95_ms'] for t in totals), 1),
+        'stage_p50_ms': {stage: round(max(values), 1) for stage, values in stages.items()},
+        'elapsed_s': round(time.perf_counter() - started, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", help="worker counts to try (default: 1, 2, 4... up to the CPUs)")
+    parser.add_argument("--threads", type=int, nargs="+", help="intra-op thread counts to try (default: per worker count)")
+    parser.add_argument("--inter-op-threads", type=int, nargs="+", default=[1])
+    parser.add_argument("--affinity", nargs="+", choices=['off', 'auto'], default=['off', 'auto'])
+    parser.add_argument("--megapixels", type=float, nargs="+", default=[2])
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--output", help="write every run to this JSON file")
+    args = parser.parse_args()
+
+    cpus = len(available_cpus())
+    worker_counts = args.workers or [w for w in (1, 2, 4, 8, 16) if w <= cpus]
+    runs = []
+    with tempfile.TemporaryDirectory() as root:
+        for workers in worker_counts:
+            for threads in args.threads or thread_candidates(cpus, workers):
+                for inter_op in args.inter_op_threads:
+                    for affinity in args.affinity:
+                        if affinity == 'auto' and (workers == 1 or workers * threads > cpus):
+                            # Nothing to pin apart, or the slices would be oversubscribed anyway
+                            continue
+                        run = run_config(workers, threads, inter_op, affinity, args, root)
+                        runs.append(run)
+                        print(f"workers={workers:<3} intra={threads:<3} inter={inter_op:<2} affinity={affinity:<4} "
+                              f"{run['throughput_per_s']:>7.2f} photos/s  p50={run['p50_ms']:>8.1f}ms  "
+                              f"p95={run['p95_ms']:>8.1f}ms  segment p50={run['stage_p50_ms']['segment']:>8.1f}ms",
+                              flush=True)
+
+    best = max(runs, key=lambda run: run['throughput_per_s'])
+    print(f"\nBest on this host ({cpus} CPUs): {best['throughput_per_s']:.2f} photos/s, p95 {best['p95_ms']:.1f} ms")
+    print(f"  WEB_CONCURRENCY={best['workers']}")
+    print(f"  TORCH_INTRA_OP_THREADS={best['intra_op_threads']}")
+    print(f"  TORCH_INTER_OP_THREADS={best['inter_op_threads']}")
+    print(f"  CPU_AFFINITY={'auto' if best['affinity'] == 'auto' else ''}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'cpus': cpus, 'args': vars(args), 'runs': runs, 'best': best}, f, indent=2)
+        print(f"Saved {len(runs)} runs to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,10 +5,98 @@ class EnvVar(BaseSettings):
     CLOSETS_DIR: str = 'data/closets/'
     IMAGES_DIR: str = 'data/images/'
     DATA_DIR: str = 'data/'
+    IMPORTS_DIR: str = 'data/imports/'
+    IMPORT_WORKERS: int = 2
+    IMPORT_BATCH_SIZE: int = 16
+    MAX_UPLOAD_BYTES: int = 25 * 1024 * 1024
+    MAX_IMAGE_DIMENSION: int = 12000
+    DECODE_MAX_DIMENSION: int = 2048
+    IMAGE_STORE: str = 'local'
+    IMAGE_FORMAT: str = 'webp'
+    IMAGE_QUALITY: int = 80
+    IMAGE_BASE_URL: str = ''
+    S3_ENDPOINT_URL: str = ''
+    S3_BUCKET: str = 'pocket-fashion'
+    S3_ACCESS_KEY: str = ''
+    S3_SECRET_KEY: str = ''
+    CUTOUT_BASE_URL: str = ''
+    CUTOUT_CACHE_MAX_BYTES: int = 128 * 1024 * 1024
+    STATIC_MAX_AGE: int = 300
+    STATIC_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    STATIC_CACHE_MAX_ITEM_BYTES: int = 256 * 1024
+    STATIC_LOG_SAMPLE_RATE: float = 0.01
+    IMAGE_URL_SIGNING: bool = True
+    IMAGE_URL_TTL_SECONDS: int = 24 * 60 * 60
+    IMAGE_URL_BUCKET_SECONDS: int = 60 * 60
     GOOGLE_CLIENT_ID: str
     GOOGLE_CLIENT_SECRET: str
     GOOGLE_REDIRECT_URI: str
     JWT_SECRET: str
+    GOOGLE_TOKEN_URL: str = 'https://oauth2.googleapis.com/token'
+    GOOGLE_CERTS_URL: str = 'https://www.googleapis.com/oauth2/v1/certs'
+    OAUTH_HTTP_TIMEOUT: float = 10.0
+    OAUTH_HTTP_MAX_CONNECTIONS: int = 20
+    USER_LOGIN_FLUSH_SECONDS: float = 5.0
+    JWT_EXPIRE_MINUTES: int = 7 * 24 * 60
+    TOKEN_CACHE_MAX_ITEMS: int = 10000
+    TOKEN_CACHE_TTL_SECONDS: int = 300
+    CLOSET_JOURNAL_COMPACT_THRESHOLD: int = 200
+    IMAGE_GC_INTERVAL_SECONDS: int = 6 * 60 * 60
+    IMAGE_GC_GRACE_SECONDS: int = 60 * 60
+    IMAGE_GC_BATCH_SIZE: int = 200
+    IMAGE_GC_BATCH_PAUSE_SECONDS: float = 0.5
+    COLOR_PALETTE_SIZE: int = 5
+    COLOR_MAX_SAMPLES: int = 4096
+    COLOR_KMEANS_ITERATIONS: int = 8
+    COLOR_MERGE_DISTANCE: float = 12.0
+    COLOR_MIN_SHARE: float = 0.05
+    COLOR_INDEX_CACHE_MAX_ITEMS: int = 256
+    INSTANCE_MIN_AREA_FRACTION: float = 0.01
+    INSTANCE_JOIN_PIXELS: int = 8
+    INSTANCE_MAX_PER_CLASS: int = 16
+    EMBEDDINGS_DIR: str = 'data/embeddings/'
+    EMBEDDING_INDEX_CACHE_MAX_ITEMS: int = 256
+    EMBEDDINGS_COMPACT_THRESHOLD: int = 200
+    WEAR_LOGS_DIR: str = 'data/wear/'
+    WEAR_LOG_CACHE_MAX_ITEMS: int = 1024
+    WEAR_MATCH_MIN_SIMILARITY: float = 0.75
+    RECOMMEND_TOP_K: int = 20
+    RECOMMEND_LABEL_WEIGHT: float = 0.3
+    RECOMMEND_WEAR_WEIGHT: float = 0.15
+    RECOMMEND_NOVELTY_WEIGHT: float = 0.15
+    RECOMMEND_NOVELTY_DAYS: int = 14
+    RECOMMEND_FULL_BODY_COMPAT: float = 0.5
+    RECOMMEND_MAX_ITEM_REPEATS: int = 2
+    RECOMMEND_INDEX_CACHE_MAX_ITEMS: int = 64
+    CLOSET_CACHE_MAX_ITEMS: int = 256
+    FASHION_ATTRIBUTES_ENABLED: bool = False
+    FASHION_RESNET_CHECKPOINT: str = 'data/models/fashion_resnet18.pth'
+    FASHION_RESNET_TYPE: str = 'resnet18'
+    FASHION_CATEGORY_LIST: str = 'data/datasets/list_category_cloth.txt'
+    FASHION_ATTRIBUTE_LIST: str = 'data/datasets/list_attr_cloth.txt'
+    FASHION_ATTRIBUTE_THRESHOLD: float = 0.5
+    FASHION_ATTRIBUTE_BATCH_SIZE: int = 16
+    TRACING_ENABLED: bool = False
+    TRACE_SAMPLE_RATE: float = 0.01
+    TRACE_EXPORT_PATH: str = 'data/traces/traces.jsonl'
+    TRACE_COLLECTOR_URL: str = ''
+    TRACE_EXPORT_TIMEOUT: float = 5.0
+    TRACE_SERVICE_NAME: str = 'pocket-fashion'
+    PROFILE_TOKEN: str = ''
+    PROFILE_DIR: str = 'data/profiles/'
+    PROFILE_INTERVAL_SECONDS: float = 0.005
+    PROFILE_MAX_SECONDS: float = 60.0
+    PROFILE_TORCH: bool = True
+    INFERENCE_CONCURRENCY: int = 1
+    INFERENCE_QUEUE_LIMIT: int = 16
+    INFERENCE_USER_QUEUE_LIMIT: int = 4
+    WEB_CONCURRENCY: int = 1
+    TORCH_INTRA_OP_THREADS: int = 0
+    TORCH_INTER_OP_THREADS: int = 0
+    TORCH_SEGMENT_THREADS: int = 0
+    TORCH_CLASSIFY_THREADS: int = 0
+    TORCH_ATTRIBUTE_THREADS: int = 0
+    CPU_AFFINITY: str = ''
 
     class Config:
         env_file = ".env"
@@ -20,6 +108,9 @@ env = EnvVar()
 # Create directories
 os.makedirs(env.CLOSETS_DIR, exist_ok=True)
 os.makedirs(env.IMAGES_DIR, exist_ok=True)
+os.makedirs(env.IMPORTS_DIR, exist_ok=True)
+os.makedirs(env.EMBEDDINGS_DIR, exist_ok=True)
+os.makedirs(env.WEAR_LOGS_DIR, exist_ok=True)
 
 # You can access the variables like this:
 # CLOSETS_DIR = env.CLOSETS_DIR
@@ -1,12 +1,317 @@
+import hashlib
 import logging
+import mimetypes
+import os
+import random
+import re
+import time
+from email.utils import formatdate
+from functools import partial
+from typing import Callable, Optional, Tuple
+
+import anyio
 from fastapi.staticfiles import StaticFiles
-from starlette.requests import Request
+from starlette.datastructures import Headers, QueryParams
 from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config import env
+from modules.cache import ByteLRUCache
+from modules.cutouts import render_cutout
+from modules.image_store import CONTENT_TYPES, CUTOUT_SUFFIX, output_format
+from modules.metrics import histogram, register_cache
+from modules.profiler import StackSampler, profile_authorized
+from modules.tracing import new_trace_id, should_sample, start_trace
+from modules.signing import verify_image_signature
 
 logger = logging.getLogger(__name__)
+access_logger = logging.getLogger("static.access")
+
+# Image store keys end in .<16 hex digest>.<ext>, so their content never changes
+CONTENT_ADDRESSED_PATTERN = re.compile(r"\.([0-9a-f]{16})\.[a-z0-9]+$")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+CHUNK_SIZE = 64 * 1024
+
+request_latency = histogram("http_request_duration_seconds", "Time to the end of the response body, per route",
+                            labelnames=("method", "route", "status"))
+
+
+def parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single ``bytes=`` range into an inclusive (start, end) pair.
+
+    Returns None when the header should be ignored (multiple ranges or an
+    unknown unit, in which case the whole file is served) and raises
+    ValueError when the range can't be satisfied.
+    """
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    start_str, _, end_str = ranges.strip().partition("-")
+    if not start_str:
+        # Suffix range: the last N bytes
+        length = int(end_str)
+        if length <= 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(start_str)
+    end = int(end_str) if end_str else size - 1
+    if start >= size or end < start:
+        raise ValueError("Range not satisfiable")
+    return start, min(end, size - 1)
+
+
+class FileRangeResponse(Response):
+    """Streams a byte range of a file, handing it to the server's zero-copy
+    (sendfile) extension when the ASGI server offers one.
+
+    uvicorn doesn't offer it, so under uvicorn the range is read in chunks
+    off the event loop; for sendfile, let a reverse proxy serve IMAGES_DIR
+    itself (the auth_request setup in routes/images.py). ``on_read`` gets
+    the whole range once it has been read and sent, e.g. to cache it.
+    """
+
+    def __init__(self, path: str, start: int, end: int, status_code: int,
+                 headers: dict, media_type: str, method: str,
+                 on_read: Optional[Callable[[bytes], None]] = None):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.count = end - start + 1
+        self.send_body = method != "HEAD"
+        self.on_read = on_read
+        self.headers["content-length"] = str(self.count)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        if not self.send_body:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if self.on_read is None and "http.response.zerocopy" in scope.get("extensions", {}):
+            with open(self.path, "rb") as f:
+                await send({
+                    "type": "http.response.zerocopy",
+                    "file": f,
+                    "offset": self.start,
+                    "count": self.count,
+                    "more_body": False,
+                })
+            return
+
+        chunks = []
+        async with await anyio.open_file(self.path, mode="rb") as f:
+            await f.seek(self.start)
+            remaining = self.count
+            while remaining > 0:
+                chunk = await f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                if self.on_read is not None:
+                    chunks.append(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0 or not self.count:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        if remaining == 0 and self.on_read is not None:
+            self.on_read(b"".join(chunks))
+
+
+class RequestMetricsMiddleware:
+    """Records every HTTP request's latency under its route template.
+
+    The template (``/api/user/closet/{item_id}``, or the mount path for
+    /static) keeps the label set bounded however many ids are requested.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_latency.labels(scope["method"], route_template(scope), str(status)).observe(
+                time.perf_counter() - started)
+
+
+def route_template(scope: Scope) -> str:
+    # The router fills in the matched route on the request's scope
+    route = scope.get("route")
+    return getattr(route, "path", None) or scope.get("root_path") or "unmatched"
+
+
+class TracingMiddleware:
+    """Traces a sample of requests (TRACE_SAMPLE_RATE) and profiles requests that ask for it.
+
+    A request carrying ``X-Profile-Token: <PROFILE_TOKEN>`` is always traced,
+    and its threads are stack-sampled for its duration: the folded stacks
+    (and a torch.profiler trace per model pass) land in
+    PROFILE_DIR/<trace id>/. Traced responses carry ``X-Trace-Id``.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        profiled = bool(env.PROFILE_TOKEN) and profile_authorized(Headers(scope=scope).get("x-profile-token"))
+        if not profiled and not should_sample():
+            await self.app(scope, receive, send)
+            return
+
+        trace_id = new_trace_id()
+        profile = StackSampler(trace_id).start() if profiled else None
+
+        async def send_with_trace_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                root.attributes["http.status_code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-trace-id", trace_id.encode())]
+            await send(message)
+
+        with start_trace(f"{scope['method']} {scope['path']}", trace_id=trace_id, profile=profile,
+                         **{"http.method": scope["method"], "http.target": scope["path"]}) as root:
+            try:
+                await self.app(scope, receive, send_with_trace_id)
+            finally:
+                root.name = f"{scope['method']} {route_template(scope)}"
+                if profile is not None:
+                    profile.stop()
+                    root.attributes["profile.stacks"] = await anyio.to_thread.run_sync(profile.write)
+                    root.attributes["profile.samples"] = profile.samples
+
+
+class ImageStaticFiles(StaticFiles):
+    """Static image serving tuned for grid views.
+
+    Content-addressed files get immutable caching and their digest as ETag,
+    conditional and range requests are answered without reading more than
+    needed, small hot files (thumbnails) are kept in an in-memory LRU, and
+    access logging is sampled instead of one line per hit. With
+    ``require_signature`` every request must carry a valid signed-URL
+    ``exp``/``sig`` pair, which is checked without touching the auth stack.
+    """
+
+    def __init__(self, *args, require_signature: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.require_signature = require_signature
+        self.hot_cache = ByteLRUCache(env.STATIC_CACHE_MAX_BYTES, env.STATIC_CACHE_MAX_ITEM_BYTES)
+        register_cache("static", self.hot_cache)
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        started = time.perf_counter()
+        if self.require_signature:
+            params = QueryParams(scope["query_string"])
+            if not verify_image_signature(path, params.get("exp"), params.get("sig")):
+                response = Response(status_code=403)
+                self._log_access(scope, response, started)
+                return response
+        if path.endswith(CUTOUT_SUFFIX):
+            response = await self.cutout_response(path, scope)
+        else:
+            response = await super().get_response(path, scope)
+        self._log_access(scope, response, started)
+        return response
+
+    async def cutout_response(self, key: str, scope: Scope) -> Response:
+        # A cutout key always renders to the same pixels, so the key is the ETag
+        etag = f'"{hashlib.md5(key.encode()).hexdigest()}"'
+        headers = {"etag": etag, "cache-control": IMMUTABLE_CACHE_CONTROL}
+        if Headers(scope=scope).get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+        try:
+            content = await anyio.to_thread.run_sync(render_cutout, key)
+        except FileNotFoundError:
+            return Response(status_code=404)
+        if scope["method"] == "HEAD":
+            headers["content-length"] = str(len(content))
+            content = b""
+        return Response(content, headers=headers, media_type=CONTENT_TYPES[output_format()])
+
+    def _log_access(self, scope: Scope, response: Response, started: float) -> None:
+        if response.status_code < 500 and random.random() >= env.STATIC_LOG_SAMPLE_RATE:
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        access_logger.info(
+            "static %s %s %d %.2fms", scope["method"], scope["path"], response.status_code, elapsed_ms,
+            extra={
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": response.status_code,
+                "elapsed_ms": elapsed_ms,
+                "sample_rate": env.STATIC_LOG_SAMPLE_RATE,
+            },
+        )
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope,
+                      status_code: int = 200) -> Response:
+        method = scope["method"]
+        request_headers = Headers(scope=scope)
+        size = stat_result.st_size
+
+        content_addressed = CONTENT_ADDRESSED_PATTERN.search(str(full_path))
+        if content_addressed:
+            etag = f'"{content_addressed.group(1)}"'
+            cache_control = IMMUTABLE_CACHE_CONTROL
+        else:
+            etag_base = f"{stat_result.st_mtime}-{size}"
+            etag = f'"{hashlib.md5(etag_base.encode()).hexdigest()}"'
+            cache_control = f"public, max-age={env.STATIC_MAX_AGE}"
+
+        headers = {
+            "etag": etag,
+            "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+            "cache-control": cache_control,
+            "accept-ranges": "bytes",
+        }
+        media_type = mimetypes.guess_type(str(full_path))[0] or "application/octet-stream"
+
+        if self.is_not_modified(Headers(headers), request_headers):
+            return Response(status_code=304, headers=headers)
+
+        byte_range = None
+        range_header = request_headers.get("range")
+        if range_header and request_headers.get("if-range", etag) == etag:
+            try:
+                byte_range = parse_range(range_header, size)
+            except ValueError:
+                headers["content-range"] = f"bytes */{size}"
+                return Response(status_code=416, headers=headers)
+
+        if byte_range is not None:
+            start, end = byte_range
+            headers["content-range"] = f"bytes {start}-{end}/{size}"
+            return FileRangeResponse(str(full_path), start, end, 206, headers, media_type, method)
+
+        on_read = None
+        if size <= self.hot_cache.max_item_bytes:
+            cache_key = (str(full_path), stat_result.st_mtime_ns, size)
+            content = self.hot_cache.get(cache_key)
+            if content is not None:
+                if method == "HEAD":
+                    headers["content-length"] = str(size)
+                    content = b""
+                return Response(content, status_code=status_code, headers=headers, media_type=media_type)
+
+            # Missed: stream it like any other file, off the event loop, and keep it for next time
+            on_read = partial(self.hot_cache.put, cache_key)
 
-class LoggingStaticFiles(StaticFiles):
-    async def get_response(self, path: str, scope) -> Response:
-        request = Request(scope)
-        logger.info(f"Static file requested: {request.url.path}")
-        return await super().get_response(path, scope)
\ No newline at end of file
+        return FileRangeResponse(str(full_path), 0, size - 1, status_code, headers, media_type, method, on_read)
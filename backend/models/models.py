@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import json
 import ast
 
@@ -19,12 +19,24 @@ class Clothes(BaseModel):
     masked_images: Dict[str, str] = Field(default_factory=dict)
     image_hash: str
     classification_results: Dict[str, Dict[str, Any]] = Field(default_factory=dict)
+    renditions: Dict[str, Dict[str, str]] = Field(default_factory=dict)
+    # Dominant color name of the main garment, and per-garment [(hex, share)] palettes
+    color: Optional[str] = None
+    colors: Dict[str, List[Tuple[str, float]]] = Field(default_factory=dict)
+    # Per-garment FashionResnet predictions, e.g. {'category': 'Tee', 'texture': ['striped']}
+    attributes: Dict[str, Dict[str, Any]] = Field(default_factory=dict)
 
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'Clothes':
         # Ensure masked_images and classification_results are dictionaries
         data['masked_images'] = cls._ensure_dict(data.get('masked_images', {}))
         data['classification_results'] = cls._ensure_dict(data.get('classification_results', {}))
+        data['renditions'] = cls._ensure_dict(data.get('renditions', {}))
+        data['colors'] = cls._ensure_dict(data.get('colors', {}))
+        data['attributes'] = cls._ensure_dict(data.get('attributes', {}))
+        if not isinstance(data.get('color'), str):
+            # Empty CSV cells come back as NaN
+            data['color'] = None
         return cls(**data)
 
     @staticmethod
@@ -47,5 +59,9 @@ class Clothes(BaseModel):
             "combined_mask_image_path": self.combined_mask_image_path,
             "masked_images": self.masked_images,
             "image_hash": self.image_hash,
-            "classification_results": self.classification_results
+            "classification_results": self.classification_results,
+            "renditions": self.renditions,
+            "color": self.color,
+            "colors": self.colors,
+            "attributes": self.attributes
         }
@@ -0,0 +1,136 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from PIL import Image
+
+from config import env
+from modules.metrics import BATCH_SIZE_BUCKETS, histogram
+from modules.preprocess import ATTRIBUTE_SIZE, IMAGENET_TABLE, cutout_inputs, image_inputs
+from modules.runtime import model_threads
+from modules.tracing import model_span
+
+logger = logging.getLogger(__name__)
+
+# attribute_type column of DeepFashion's list_attr_cloth.txt
+ATTRIBUTE_TYPES = {1: 'texture', 2: 'fabric', 3: 'shape', 4: 'part', 5: 'style'}
+
+_model = None
+_categories: List[str] = []
+_attributes: List[Tuple[str, str]] = []
+_load_failed = False
+_model_lock = threading.Lock()
+batch_sizes = histogram("model_batch_size", "Inputs per model forward pass", BATCH_SIZE_BUCKETS, labelnames=("model",))
+
+
+def _read_label_list(path: str) -> List[Tuple[str, int]]:
+    """(name, type) rows of a DeepFashion list file: a count line, a header, then rows."""
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        lines = f.read().splitlines()[2:]
+    labels = []
+    for line in lines:
+        if not line.strip():
+            continue
+        # Names can contain spaces; the type is always the last column
+        name, label_type = line.rsplit(None, 1)
+        labels.append((name.strip(), int(label_type)))
+    return labels
+
+
+def _load_model():
+    global _model, _categories, _attributes
+    from modules.fashion_resnet import FashionResnet
+
+    state_dict = torch.load(env.FASHION_RESNET_CHECKPOINT, map_location=torch.device('cpu'), weights_only=True)
+    state_dict = OrderedDict(
+        (k[7:] if k.startswith('module.') else k, v) for k, v in state_dict.items()
+    )
+    # Head sizes come from the checkpoint, so any DeepFashion label split works
+    num_categories = state_dict['fc_cls.weight'].shape[0]
+    num_attrs = state_dict['fc_bin.weight'].shape[0]
+    model = FashionResnet(num_categories, num_attrs, resnet_type=env.FASHION_RESNET_TYPE)
+    model.load_state_dict(state_dict)
+    model.eval()
+
+    categories = [name for name, _ in _read_label_list(env.FASHION_CATEGORY_LIST)]
+    if len(categories) != num_categories:
+        categories = [f"category_{i}" for i in range(num_categories)]
+    attributes = [(name, ATTRIBUTE_TYPES.get(label_type, 'attribute'))
+                  for name, label_type in _read_label_list(env.FASHION_ATTRIBUTE_LIST)]
+    if len(attributes) != num_attrs:
+        attributes = [(f"attribute_{i}", 'attribute') for i in range(num_attrs)]
+
+    _model, _categories, _attributes = model, categories, attributes
+    logger.info(f"Loaded {env.FASHION_RESNET_TYPE} attribute model from {env.FASHION_RESNET_CHECKPOINT}: "
+                f"{num_categories} categories, {num_attrs} attributes")
+
+
+def get_model():
+    """The attribute model, loaded on first use; None when disabled or unavailable."""
+    global _load_failed
+    if not env.FASHION_ATTRIBUTES_ENABLED or _load_failed:
+        return None
+    with _model_lock:
+        if _model is None and not _load_failed:
+            try:
+                _load_model()
+            except Exception as e:
+                # Attributes are optional: keep ingesting without them
+                logger.error(f"Could not load attribute model {env.FASHION_RESNET_CHECKPOINT}: {e}")
+                _load_failed = True
+        return _model
+
+
+def _on_white(image: Image.Image) -> Image.Image:
+    if image.mode != 'RGBA':
+        return image
+    # Cutouts go on white, like the product shots the model was trained on
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def _predict(model, inputs: torch.Tensor) -> List[Dict[str, Any]]:
+    results = []
+    for start in range(0, len(inputs), env.FASHION_ATTRIBUTE_BATCH_SIZE):
+        batch = inputs[start:start + env.FASHION_ATTRIBUTE_BATCH_SIZE]
+        batch_sizes.labels("fashion_resnet").observe(len(batch))
+        with torch.inference_mode(), model_threads(env.TORCH_ATTRIBUTE_THREADS), \
+                model_span('fashion_resnet.forward', batch=len(batch)):
+            out_cls, out_bin, _ = model(batch)
+        categories = out_cls.argmax(dim=1).tolist()
+        attribute_hits = (torch.sigmoid(out_bin) >= env.FASHION_ATTRIBUTE_THRESHOLD).numpy()
+        for category, hits in zip(categories, attribute_hits):
+            result: Dict[str, Any] = {'category': _categories[category]}
+            for index in np.flatnonzero(hits):
+                name, attribute_type = _attributes[index]
+                result.setdefault(attribute_type, []).append(name)
+            results.append(result)
+    return results
+
+
+def predict_attributes(images: List[Image.Image]) -> Optional[List[Dict[str, Any]]]:
+    """Category and attributes per image, e.g. {'category': 'Tee', 'texture': ['striped']}.
+
+    Returns None when the attribute model is disabled or failed to load.
+    """
+    model = get_model()
+    if model is None:
+        return None
+    inputs = image_inputs([_on_white(image) for image in images], ATTRIBUTE_SIZE, IMAGENET_TABLE, name='attributes')
+    return _predict(model, inputs)
+
+
+def predict_garment_attributes(pixels: np.ndarray, masks: Dict[str, np.ndarray]) -> Optional[Dict[str, Dict[str, Any]]]:
+    """Like predict_attributes, for the garments of a segmented image, by garment name."""
+    model = get_model()
+    if model is None or not masks:
+        return None
+    inputs = cutout_inputs(pixels, masks, ATTRIBUTE_SIZE, IMAGENET_TABLE, background=255, name='attributes')
+    return dict(zip(masks, _predict(model, inputs)))
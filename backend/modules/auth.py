@@ -1,20 +1,38 @@
 import os
+import asyncio
+import hashlib
+import re
+import time
+from typing import Dict, Optional, Tuple
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
-import requests
+from starlette.concurrency import run_in_threadpool
+import httpx
 from jose import jwt
 from pydantic import BaseModel
 from config import env
-import pandas as pd
-from datetime import datetime
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
+from google.auth import jwt as google_jwt
+from modules.cache import TTLCache
+from modules.metrics import histogram, register_cache
+from modules.user_store import get_user_store
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 GOOGLE_CLIENT_ID = env.GOOGLE_CLIENT_ID
 GOOGLE_CLIENT_SECRET = env.GOOGLE_CLIENT_SECRET
 GOOGLE_REDIRECT_URI = env.GOOGLE_REDIRECT_URI
+GOOGLE_TOKEN_URL = env.GOOGLE_TOKEN_URL
+GOOGLE_CERTS_URL = env.GOOGLE_CERTS_URL
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
 JWT_SECRET = env.JWT_SECRET
+DEFAULT_CERTS_MAX_AGE = 300
+
+login_latency = histogram("auth_google_login_seconds", "End-to-end Google login latency")
+token_exchange_latency = histogram("auth_google_token_exchange_seconds", "Google token endpoint round trip")
+id_token_verify_latency = histogram("auth_google_id_token_verify_seconds", "Google ID token verification")
+
+# Verified bearer tokens, keyed by SHA-256 of the token so raw tokens aren't kept around
+verified_tokens = TTLCache(env.TOKEN_CACHE_MAX_ITEMS)
+register_cache("verified_tokens", verified_tokens)
 
 if not GOOGLE_CLIENT_ID or not GOOGLE_CLIENT_SECRET or not JWT_SECRET:
     raise ValueError("Missing required environment variables")
@@ -32,8 +50,71 @@ def login_google():
         "url": f"https://accounts.google.com/o/oauth2/auth?response_type=code&client_id={GOOGLE_CLIENT_ID}&redirect_uri={GOOGLE_REDIRECT_URI}&scope=openid%20profile%20email&access_type=offline"
     }
 
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    # One pooled client per process so token exchanges reuse TLS connections
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=env.OAUTH_HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=env.OAUTH_HTTP_MAX_CONNECTIONS,
+                                max_keepalive_connections=env.OAUTH_HTTP_MAX_CONNECTIONS),
+        )
+    return _http_client
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+class GoogleCertCache:
+    """Google's ID token signing certs, cached for as long as Google says."""
+
+    def __init__(self, certs_url: str):
+        self.certs_url = certs_url
+        self._certs: Optional[Dict[str, str]] = None
+        self._expires_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def get(self, client: httpx.AsyncClient) -> Dict[str, str]:
+        if self._certs is not None and time.monotonic() < self._expires_at:
+            return self._certs
+        async with self._lock:
+            # Another login may have refreshed the certs while we waited
+            if self._certs is not None and time.monotonic() < self._expires_at:
+                return self._certs
+            response = await client.get(self.certs_url)
+            response.raise_for_status()
+            self._certs = response.json()
+            self._expires_at = time.monotonic() + self._max_age(response.headers.get("cache-control", ""))
+            return self._certs
+
+    def invalidate(self):
+        self._expires_at = 0.0
+
+    @staticmethod
+    def _max_age(cache_control: str) -> int:
+        match = re.search(r"max-age=(\d+)", cache_control)
+        return int(match.group(1)) if match else DEFAULT_CERTS_MAX_AGE
+
+google_certs = GoogleCertCache(GOOGLE_CERTS_URL)
+
+async def verify_google_id_token(token: str, client: httpx.AsyncClient) -> Dict[str, str]:
+    certs = await google_certs.get(client)
+    if jwt.get_unverified_header(token).get("kid") not in certs:
+        # Google may have rotated its keys before our cached copy expired
+        google_certs.invalidate()
+        certs = await google_certs.get(client)
+    id_info = google_jwt.decode(token, certs=certs, audience=GOOGLE_CLIENT_ID)
+    if id_info.get("iss") not in GOOGLE_ISSUERS:
+        raise ValueError(f"Wrong issuer: {id_info.get('iss')}")
+    return id_info
+
 async def auth_google(google_token: GoogleToken):
-    token_url = "https://oauth2.googleapis.com/token"
+    started = time.perf_counter()
+    client = get_http_client()
     data = {
         "code": google_token.code,
         "client_id": GOOGLE_CLIENT_ID,
@@ -41,50 +122,57 @@ async def auth_google(google_token: GoogleToken):
         "redirect_uri": GOOGLE_REDIRECT_URI,
         "grant_type": "authorization_code",
     }
-    response = requests.post(token_url, data=data)
+    with token_exchange_latency.time():
+        response = await client.post(GOOGLE_TOKEN_URL, data=data)
     token_data = response.json()
     
     if "error" in token_data:
         raise HTTPException(status_code=400, detail=f"Google OAuth error: {token_data['error']}")
     
-    id_info = id_token.verify_oauth2_token(
-        token_data['id_token'], google_requests.Request(), GOOGLE_CLIENT_ID)
+    with id_token_verify_latency.time():
+        id_info = await verify_google_id_token(token_data['id_token'], client)
     
     user = User(id=id_info['sub'], email=id_info['email'], name=id_info['name'])
     
-    # Save user info to CSV
-    save_user_info(user)
+    # Save user info to the user store; SQLite (and the first open's migration) blocks
+    await run_in_threadpool(save_user_info, user)
     
+    login_latency.observe(time.perf_counter() - started)
     return user
 
 def save_user_info(user: User):
-    csv_file = f'{env.DATA_DIR}/users.csv'
-    
-    try:
-        df = pd.read_csv(csv_file)
-    except FileNotFoundError:
-        df = pd.DataFrame(columns=['id', 'email', 'name', 'last_login'])
-    
-    if user.id not in df['id'].values:
-        new_row = pd.DataFrame({
-            'id': [user.id],
-            'email': [user.email],
-            'name': [user.name],
-            'last_login': [datetime.now().strftime('%Y-%m-%d %H:%M:%S')]
-        })
-        df = pd.concat([df, new_row], ignore_index=True)
-    else:
-        df.loc[df['id'] == user.id, 'last_login'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    
-    df.to_csv(csv_file, index=False)
+    # Keyed upsert; repeat logins are coalesced and written in batches
+    get_user_store().record_login(user.id, user.email, user.name)
 
 def create_token(user: User):
-    token = jwt.encode({"sub": user.id, "email": user.email, "name": user.name}, JWT_SECRET, algorithm="HS256")
+    now = int(time.time())
+    token = jwt.encode({
+        "sub": user.id,
+        "email": user.email,
+        "name": user.name,
+        "iat": now,
+        "exp": now + env.JWT_EXPIRE_MINUTES * 60,
+    }, JWT_SECRET, algorithm="HS256")
     return token
 
+def decode_token(token: str) -> Tuple[User, Optional[int]]:
+    # Full HMAC verification; python-jose also rejects expired tokens here
+    payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+    user = User(id=payload["sub"], email=payload["email"], name=payload["name"])
+    return user, payload.get("exp")
+
 def get_current_user(token: str = Depends(oauth2_scheme)):
+    digest = hashlib.sha256(token.encode()).digest()
+    user = verified_tokens.get(digest)
+    if user is not None:
+        return user
     try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        return User(id=payload["sub"], email=payload["email"], name=payload["name"])
+        user, exp = decode_token(token)
     except jwt.JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
\ No newline at end of file
+        raise HTTPException(status_code=401, detail="Invalid token")
+    # Never cache past the token's own expiry
+    expires_at = time.time() + env.TOKEN_CACHE_TTL_SECONDS
+    if exp is not None:
+        expires_at = min(expires_at, float(exp))
+    verified_tokens.put(digest, user, expires_at)
+    return user
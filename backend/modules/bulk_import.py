@@ -0,0 +1,318 @@
+import fcntl
+import json
+import logging
+import os
+import re
+import shutil
+import tarfile
+import threading
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
+
+import imagehash
+
+from config import env
+from modules.closet import Closet
+from modules.image_io import ImageValidationError, decode_image
+from modules.metrics import gauge, register_collector
+from modules.scheduler import BULK
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif', '.tif', '.tiff'}
+COPY_CHUNK_SIZE = 1024 * 1024
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f-]{36}$')
+RESUMABLE_STATUSES = {'pending', 'running', 'interrupted', 'failed'}
+
+# Jobs currently running in this process. Across processes, a running job
+# holds an flock on its run.lock instead.
+_active_jobs: Dict[str, 'ImportJob'] = {}
+_active_jobs_lock = threading.Lock()
+items_in_flight = gauge("import_items_in_flight", "Import members submitted to the worker pools and not yet collected")
+register_collector("import_jobs_active", "gauge", "Bulk imports running in this process",
+                   lambda: [({}, len(_active_jobs))])
+
+
+class ImportJob:
+    """A resumable bulk import of archives and/or loose images into a closet.
+
+    Uploads are spooled once into ``IMPORTS_DIR/<user_id>/<job_id>/sources`` and
+    then streamed member by member: images are deduplicated by perceptual hash
+    before any model runs, segmented/classified by a bounded worker pool and
+    persisted to the closet in batches. Progress is checkpointed after every
+    batch so an interrupted job picks up where it left off.
+    """
+
+    def __init__(self, user_id: str, job_id: str, state: Optional[Dict[str, Any]] = None):
+        if not JOB_ID_PATTERN.match(job_id):
+            raise FileNotFoundError(f"Unknown import job: {job_id}")
+        self.user_id = user_id
+        self.job_id = job_id
+        self.job_dir = os.path.join(env.IMPORTS_DIR, user_id, job_id)
+        self.sources_dir = os.path.join(self.job_dir, 'sources')
+        self.state_path = os.path.join(self.job_dir, 'state.json')
+        self.lock_path = os.path.join(self.job_dir, 'run.lock')
+        self.state = state if state is not None else self._load_state()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, user_id: str, uploads: List[Tuple[str, BinaryIO]]) -> 'ImportJob':
+        """Spool uploaded (filename, file) pairs to disk and create a pending job."""
+        job_id = str(uuid.uuid4())
+        sources_dir = os.path.join(env.IMPORTS_DIR, user_id, job_id, 'sources')
+        os.makedirs(sources_dir, exist_ok=True)
+
+        for index, (filename, fileobj) in enumerate(uploads):
+            safe_name = os.path.basename(filename or 'upload') or 'upload'
+            with open(os.path.join(sources_dir, f"{index:04d}_{safe_name}"), 'wb') as buffer:
+                shutil.copyfileobj(fileobj, buffer, COPY_CHUNK_SIZE)
+
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        job = cls(user_id, job_id, state={
+            'job_id': job_id,
+            'status': 'pending',
+            'processed': 0,
+            'added': 0,
+            'duplicates': 0,
+            'failed': [],
+            'done': [],
+            'created_at': now,
+            'updated_at': now,
+        })
+        job._save_state()
+        return job
+
+    def _load_state(self) -> Dict[str, Any]:
+        with open(self.state_path) as f:
+            return json.load(f)
+
+    def _save_state(self) -> None:
+        self.state['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def progress(self) -> Dict[str, Any]:
+        return {
+            'job_id': self.job_id,
+            'status': self.state['status'],
+            'processed': self.state['processed'],
+            'added': self.state['added'],
+            'duplicates': self.state['duplicates'],
+            'failed': self.state['failed'],
+            'created_at': self.state['created_at'],
+            'updated_at': self.state['updated_at'],
+        }
+
+    def _try_lock(self) -> Optional[BinaryIO]:
+        """The job's run lock, or None while any process (this one included) holds it."""
+        f = open(self.lock_path, 'ab')
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return None
+        return f
+
+    def is_active(self) -> bool:
+        with _active_jobs_lock:
+            if self.job_id in _active_jobs:
+                return True
+        lock = self._try_lock()
+        if lock is None:
+            return True
+        lock.close()
+        return False
+
+    def can_resume(self) -> bool:
+        # A completed job with failed members can be resumed to retry them
+        retryable = self.state['status'] in RESUMABLE_STATUSES or (
+            self.state['status'] == 'completed' and self.state['failed'])
+        return bool(retryable) and not self.is_active()
+
+    def iter_members(self, skip: set) -> Iterator[Tuple[str, Union[bytes, ImageValidationError]]]:
+        """Lazily yield (key, raw bytes) for every image in the spooled sources.
+
+        Keys already in ``skip`` are not read at all, which keeps resumes cheap.
+        Members over MAX_UPLOAD_BYTES yield the ImageValidationError instead of
+        their bytes, and are never read past the limit whatever their header says.
+        """
+        for source in sorted(os.listdir(self.sources_dir)):
+            path = os.path.join(self.sources_dir, source)
+            if zipfile.is_zipfile(path):
+                with zipfile.ZipFile(path) as archive:
+                    for info in archive.infolist():
+                        key = f"{source}:{info.filename}"
+                        if info.is_dir() or not _is_image_name(info.filename) or key in skip:
+                            continue
+                        if info.file_size > env.MAX_UPLOAD_BYTES:
+                            yield key, _too_large(info.file_size)
+                            continue
+                        with archive.open(info) as member:
+                            yield key, _read_bounded(member)
+            elif tarfile.is_tarfile(path):
+                # Stream mode: members are read sequentially, never seeked.
+                with tarfile.open(path, 'r|*') as archive:
+                    for member in archive:
+                        key = f"{source}:{member.name}"
+                        if not member.isfile() or not _is_image_name(member.name) or key in skip:
+                            continue
+                        if member.size > env.MAX_UPLOAD_BYTES:
+                            yield key, _too_large(member.size)
+                            continue
+                        extracted = archive.extractfile(member)
+                        if extracted is not None:
+                            yield key, _read_bounded(extracted)
+            elif source not in skip:
+                with open(path, 'rb') as f:
+                    yield source, _read_bounded(f)
+
+    def _ingest(self, closet: Closet, known_hashes: set, key: str, data: bytes) -> Tuple[str, Optional[Dict[str, Any]]]:
+        image = decode_image(data)
+        image_hash = str(imagehash.average_hash(image))
+
+        # Dedup before spending any model time on the image.
+        with self._lock:
+            if image_hash in known_hashes:
+                return 'duplicate', None
+            known_hashes.add(image_hash)
+
+        try:
+            # Imports wait behind interactive uploads rather than being shed
+            return 'added', closet.process_item(image, str(uuid.uuid4()), image_hash=image_hash,
+                                                priority=BULK, shed=False)
+        except Exception:
+            with self._lock:
+                known_hashes.discard(image_hash)
+            raise
+
+    def run(self) -> None:
+        with _active_jobs_lock:
+            run_lock = None if self.job_id in _active_jobs else self._try_lock()
+            if run_lock is None:
+                logger.warning(f"Import job {self.job_id} is already running")
+                return
+            _active_jobs[self.job_id] = self
+
+        try:
+            self.state['status'] = 'running'
+            self._save_state()
+            self._run_pipeline()
+            self.state['status'] = 'completed'
+            logger.info(f"Import job {self.job_id} completed: {self.state['added']} added, "
+                        f"{self.state['duplicates']} duplicates, {len(self.state['failed'])} failed")
+        except Exception as e:
+            self.state['status'] = 'failed'
+            logger.error(f"Import job {self.job_id} failed: {str(e)}", exc_info=True)
+        finally:
+            self._save_state()
+            with _active_jobs_lock:
+                _active_jobs.pop(self.job_id, None)
+            run_lock.close()
+
+    def _run_pipeline(self) -> None:
+        closet = Closet(self.user_id)
+        known_hashes = closet.existing_hashes()
+        done = set(self.state['done'])
+        # Failed members are retried: only what succeeded (or was a duplicate) is skipped
+        self.state['failed'] = []
+        max_in_flight = env.IMPORT_WORKERS * 2
+
+        pending_items: List[Dict[str, Any]] = []
+        pending_keys: List[str] = []
+        in_flight = {}
+
+        def fail(key: str, error: Exception) -> None:
+            logger.error(f"Error importing {key}: {str(error)}")
+            self.state['failed'].append({'key': key, 'error': str(error)})
+
+        def collect(futures) -> None:
+            for future in futures:
+                key = in_flight.pop(future)
+                items_in_flight.dec()
+                try:
+                    outcome, item = future.result()
+                except Exception as e:
+                    fail(key, e)
+                    continue
+                if outcome == 'added':
+                    pending_items.append(item)
+                elif outcome == 'duplicate':
+                    self.state['duplicates'] += 1
+                pending_keys.append(key)
+
+            if len(pending_keys) >= env.IMPORT_BATCH_SIZE:
+                flush()
+
+        def flush() -> None:
+            added = closet.add_items(pending_items)
+            self.state['added'] += len(added)
+            self.state['duplicates'] += len(pending_items) - len(added)
+            self.state['done'].extend(pending_keys)
+            self.state['processed'] = len(self.state['done']) + len(self.state['failed'])
+            self._save_state()
+            pending_items.clear()
+            pending_keys.clear()
+
+        try:
+            with ThreadPoolExecutor(max_workers=env.IMPORT_WORKERS) as pool:
+                for key, data in self.iter_members(skip=done):
+                    if isinstance(data, ImageValidationError):
+                        fail(key, data)
+                        continue
+                    while len(in_flight) >= max_in_flight:
+                        finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        collect(finished)
+                    in_flight[pool.submit(self._ingest, closet, known_hashes, key, data)] = key
+                    items_in_flight.inc()
+
+                while in_flight:
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(finished)
+        finally:
+            # Whatever a failed job left uncollected is no longer in flight
+            items_in_flight.dec(len(in_flight))
+
+        flush()
+
+
+def _is_image_name(name: str) -> bool:
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def _too_large(size: int) -> ImageValidationError:
+    return ImageValidationError(f"Upload is {size} bytes, limit is {env.MAX_UPLOAD_BYTES}")
+
+
+def _read_bounded(fileobj: BinaryIO) -> Union[bytes, ImageValidationError]:
+    # One byte over the limit is enough to tell; a lying header can't make us read more
+    data = fileobj.read(env.MAX_UPLOAD_BYTES + 1)
+    if len(data) > env.MAX_UPLOAD_BYTES:
+        return _too_large(len(data))
+    return data
+
+
+def mark_interrupted_jobs() -> None:
+    """Flag jobs left 'running' by a dead process so they can be resumed.
+
+    Runs in every worker at startup; a job another live worker is running
+    still holds its run lock and is left alone.
+    """
+    if not os.path.isdir(env.IMPORTS_DIR):
+        return
+    for user_id in os.listdir(env.IMPORTS_DIR):
+        user_dir = os.path.join(env.IMPORTS_DIR, user_id)
+        if not os.path.isdir(user_dir):
+            continue
+        for job_id in os.listdir(user_dir):
+            try:
+                job = ImportJob(user_id, job_id)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            if job.state['status'] == 'running' and not job.is_active():
+                job.state['status'] = 'interrupted'
+                job._save_state()
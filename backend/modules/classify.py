@@ -1,21 +1,56 @@
+import threading
+
 import torch
-from transformers import AutoModel, AutoProcessor
+from transformers import AutoModel
 from PIL import Image
 import argparse
 import pandas as pd
 import numpy as np
 
+from config import env
+from modules.metrics import BATCH_SIZE_BUCKETS, histogram
+from modules.preprocess import image_inputs
+from modules.runtime import model_threads
+from modules.tracing import model_span
+
 
-model = AutoModel.from_pretrained('Marqo/marqo-fashionSigLIP', trust_remote_code=True)
-processor = AutoProcessor.from_pretrained('Marqo/marqo-fashionSigLIP', trust_remote_code=True)
-styles = pd.read_csv(f"data/datasets/all_styles_processed.csv")
-style_dict = {label_type: list(group['label_value'].unique()) \
-              for label_type, group in styles.groupby('label_type')}
 RELATIVE_THRESHOLD = 0.5
+MAX_BATCH_SIZE = 16
+batch_sizes = histogram("model_batch_size", "Inputs per model forward pass", BATCH_SIZE_BUCKETS, labelnames=("model",))
+STYLES_PATH = "data/datasets/all_styles_processed.csv"
 SAVED_EMBEDDINGS_PATH = "data/category_embeddings.npy"
+MODEL_NAME = 'Marqo/marqo-fashionSigLIP'
+
+# The model, label names and pre-computed text features are loaded on first
+# use, so importing this module (e.g. for the closet) stays cheap
+model = None
+style_dict = None
+text_features_dict = None
+_load_lock = threading.Lock()
+
+
+def load_labels():
+    """Label names and their text features; all that scoring stored embeddings needs."""
+    global style_dict, text_features_dict
+    with _load_lock:
+        if style_dict is None:
+            styles = pd.read_csv(STYLES_PATH)
+            text_features_dict = np.load(SAVED_EMBEDDINGS_PATH, allow_pickle=True).item()
+            style_dict = {label_type: list(group['label_value'].unique())
+                          for label_type, group in styles.groupby('label_type')}
+    return style_dict, text_features_dict
+
+
+def load_model():
+    global model
+    load_labels()
+    with _load_lock:
+        if model is None:
+            # Images are preprocessed by modules.preprocess (224x224 bicubic,
+            # mean/std 0.5, as fashionSigLIP's processor does), not by the HF processor
+            model = AutoModel.from_pretrained(MODEL_NAME, trust_remote_code=True)
+    return model
 
-# Load pre-computed text features
-text_features_dict = np.load(SAVED_EMBEDDINGS_PATH, allow_pickle=True).item()
 
 def apply_mask(image, mask_path=None):
     if mask_path is None:
@@ -28,31 +63,77 @@ def apply_mask(image, mask_path=None):
     return Image.fromarray(masked_image_array.astype('uint8'))
 
 
-def classify_image(image):
-    # Process the image
-    processed = processor(images=[image], padding='max_length', return_tensors="pt")
-    with torch.no_grad():
-        image_features = model.get_image_features(processed['pixel_values'], normalize=True)
-
+def classify_and_embed_inputs(pixel_values):
+    """Zero-shot labels and normalized SigLIP embeddings (N, D) for a preprocessed batch.
+
+    ``pixel_values`` is an (N, 3, 224, 224) tensor from modules.preprocess.
+    One forward pass per MAX_BATCH_SIZE images serves both.
+    """
+    load_model()
+    results = []
+    embeddings = []
+    for start in range(0, len(pixel_values), MAX_BATCH_SIZE):
+        batch = pixel_values[start:start + MAX_BATCH_SIZE]
+        batch_sizes.labels("siglip").observe(len(batch))
+        with torch.no_grad(), model_threads(env.TORCH_CLASSIFY_THREADS), \
+                model_span('siglip.forward', batch=len(batch)):
+            image_features = model.get_image_features(batch, normalize=True)
+        embeddings.append(image_features.cpu().numpy().astype(np.float32))
+        results.extend(score_embeddings(image_features))
+    if not embeddings:
+        return results, np.zeros((0, 0), dtype=np.float32)
+    return results, np.concatenate(embeddings)
+
+
+def score_embeddings(image_features) -> list:
+    """Zero-shot labels for normalized SigLIP embeddings (a tensor or array, N x D).
+
+    Works on stored embeddings too, so labels can be refreshed when the
+    label set or its text features change without running the vision model.
+    """
+    load_labels()
+    if isinstance(image_features, np.ndarray):
+        image_features = torch.from_numpy(np.ascontiguousarray(image_features, dtype=np.float32))
     text_probs = {}
     for label_type, text_features in text_features_dict.items():
         text_features = torch.from_numpy(text_features).to(image_features.device)
-        text_probs[label_type] = (100.0 * image_features @ text_features.T).softmax(dim=-1).squeeze(0)
-
-    results = {}
-    for label_type, probs in text_probs.items():
-        max_prob, max_index = torch.max(probs, dim=0)
-        max_prob_value = max_prob.item()
-        
-        results[label_type] = []
-        for i, (label_value, prob) in enumerate(zip(style_dict[label_type], probs)):
-            prob_value = prob.item()
-            if prob_value == max_prob_value or prob_value >= max_prob_value * RELATIVE_THRESHOLD:
-                results[label_type].append((label_value, prob_value))
-
+        text_probs[label_type] = (100.0 * image_features @ text_features.T).softmax(dim=-1)
+
+    results = []
+    for row in range(len(image_features)):
+        image_results = {}
+        for label_type, probs in text_probs.items():
+            row_probs = probs[row].tolist()
+            max_prob_value = max(row_probs)
+
+            image_results[label_type] = []
+            for label_value, prob_value in zip(style_dict[label_type], row_probs):
+                if prob_value == max_prob_value or prob_value >= max_prob_value * RELATIVE_THRESHOLD:
+                    image_results[label_type].append((label_value, prob_value))
+        results.append(image_results)
     return results
 
 
+def top_labels(classify_result) -> dict:
+    """The best label per label type, as stored in a closet row's classification_results."""
+    return {
+        label_type: results[0][0] if results else None
+        for label_type, results in classify_result.items()
+    }
+
+
+def classify_and_embed_images(images):
+    return classify_and_embed_inputs(image_inputs(images))
+
+
+def classify_images(images):
+    return classify_and_embed_images(images)[0]
+
+
+def classify_image(image):
+    return classify_images([image])[0]
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--image_path", type=str, required=True)
@@ -9,82 +9,397 @@ from config import env
 import logging
 from PIL import Image
 import imagehash
+import numpy as np
 import ast
-import shutil
+import threading
+import fcntl
+import functools
+import queue
+from contextlib import contextmanager
 
 from modules.segment import ClothSegmenter
-from modules.classify import classify_image
+from modules.image_store import get_image_store
+from modules.classify import classify_and_embed_inputs, top_labels
+from modules.attributes import predict_garment_attributes
+from modules.preprocess import cutout_inputs
+from modules.cutouts import class_mask
+from modules.colors import dominant_colors, get_color_index, palette_name
+from modules.embeddings import get_embedding_index
+from modules.metrics import gauge, histogram, register_collector
+from modules.scheduler import INTERACTIVE, SchedulerOverloaded, inference_slot
+from modules.tracing import span
 
 logger = logging.getLogger(__name__)
-cloth_segmenter = ClothSegmenter()
+# Created on first use. ClothSegmenter keeps per-image state on the instance,
+# so concurrent callers (e.g. bulk import workers) have to take turns on the
+# shared segmenter.
+cloth_segmenter: Optional[ClothSegmenter] = None
+segmenter_lock = threading.Lock()
 CLOSET_COLUMNS = ['id', 'image_path', 'clothes_mask', 'masked_images', 
-'combined_mask_image_path', 'classification_results', 'image_hash']
-
-def segment_image(image_path: str) -> Dict[str, any]:
-    cloth_segmenter.segment(image_path)
-    cloth_segmenter.save_results()
-    result = {
-        'image_path': cloth_segmenter.original_image_path,
-        'mask_path': cloth_segmenter.mask_path,
-        'masked_image_paths': cloth_segmenter.masked_image_paths,
-        'combined_mask_image_path': cloth_segmenter.combined_mask_image_path,
-    }
+'combined_mask_image_path', 'classification_results', 'image_hash', 'renditions',
+'color', 'colors', 'attributes']
+
+stage_latency = histogram("ingest_stage_seconds", "Time per stage of segment_and_categorize_image",
+                          labelnames=("stage",))
+operation_latency = histogram("closet_operation_seconds", "Time per Closet operation", labelnames=("operation",))
+segmenter_waiting = gauge("segmenter_waiting", "Callers queued for the shared segmenter")
+
+
+@contextmanager
+def ingest_stage(name: str):
+    """Time a pipeline stage into the stage histogram and, when traced, a span."""
+    with stage_latency.labels(name).time(), span(f"ingest.{name}"):
+        yield
+
+
+def closet_operation(name: str):
+    """Decorator timing a Closet method into the operation histogram and, when traced, a span."""
+    histogram_child = operation_latency.labels(name)
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with histogram_child.time(), span(f"closet.{name}"):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def get_cloth_segmenter() -> ClothSegmenter:
+    """The shared segmenter; callers must hold segmenter_lock."""
+    global cloth_segmenter
+    if cloth_segmenter is None:
+        cloth_segmenter = ClothSegmenter()
+    return cloth_segmenter
+
+
+@contextmanager
+def shared_segmenter():
+    """Hold segmenter_lock and yield the shared segmenter, counting the wait."""
+    with segmenter_waiting.track(), ingest_stage('segmenter_wait'):
+        segmenter_lock.acquire()
+    try:
+        yield get_cloth_segmenter()
+    finally:
+        segmenter_lock.release()
+
+
+def segment_image(image: Image.Image, save_name: str) -> Dict[str, any]:
+    with shared_segmenter() as cloth_segmenter:
+        with ingest_stage('segment'):
+            cloth_segmenter.segment(image, save_name)
+        with ingest_stage('store'):
+            cloth_segmenter.save_results()
+        result = {
+            'image_path': cloth_segmenter.original_image_path,
+            'mask_path': cloth_segmenter.mask_path,
+            'masked_images': dict(cloth_segmenter.masked_images),
+            'renditions': dict(cloth_segmenter.renditions),
+            'combined_mask_image_path': cloth_segmenter.combined_mask_image_path,
+        }
+        pixels = cloth_segmenter.model_input
+        labels = cloth_segmenter.instance_arr
+
+    # Palettes and classifier inputs come from the model-resolution input,
+    # outside the segmenter lock
+    with ingest_stage('colors'):
+        masks = {name: class_mask(labels, name) for name in result['masked_images']}
+        result['pixels'] = pixels
+        result['masks'] = masks
+        result['colors'] = {name: dominant_colors(pixels, mask) for name, mask in masks.items()}
+        result['color'] = None
+        if masks:
+            # Name the item after the largest garment's main color
+            largest = max(masks, key=lambda name: np.count_nonzero(masks[name]))
+            result['color'] = palette_name(result['colors'][largest])
     return result
 
 
-def segment_and_categorize_image(image_path: str) -> Dict[str, any]:
-    segment_result = segment_image(image_path)
+def segment_and_categorize_image(image: Image.Image, save_name: str) -> Dict[str, any]:
+    segment_result = segment_image(image, save_name)
     classification_results = {}
     masked_image_paths = {}
 
-    for masked_image_path in segment_result['masked_image_paths']:
-        logger.info(f"Classifying image: {masked_image_path}")
-        image = Image.open(masked_image_path)
-        classify_result = classify_image(image)
-        logger.info(f"Classify result: {classify_result}")
-        
-        key = os.path.splitext(os.path.basename(masked_image_path))[0]
-        
+    # Classifier inputs are cut straight from the segmentation input, all
+    # garments of the photo in one batch
+    masks = segment_result['masks']
+    keys = list(masks)
+    with ingest_stage('classify'):
+        classify_results, embeddings = classify_and_embed_inputs(cutout_inputs(segment_result['pixels'], masks))
+    # Optional FashionResnet pass over the same garments; None when disabled
+    with ingest_stage('attributes'):
+        attributes = predict_garment_attributes(segment_result['pixels'], masks)
+    for key, classify_result in zip(keys, classify_results):
+        logger.debug(f"Classify result for {key}: {classify_result}")
+
         # Take only the top classification per category
-        classification_results[key] = {
-            label_type: results[0][0] if results else None
-            for label_type, results in classify_result.items()
-        }
-        masked_image_paths[key] = masked_image_path
+        classification_results[key] = top_labels(classify_result)
+        masked_image_paths[key] = segment_result['renditions'][key]['full']
 
     result = {
         'image_path': segment_result['image_path'],
         'mask_path': segment_result['mask_path'],
         'masked_image_paths': masked_image_paths,
         'combined_mask_image_path': segment_result['combined_mask_image_path'],
-        'classification_results': classification_results
+        'renditions': segment_result['renditions'],
+        'classification_results': classification_results,
+        'color': segment_result['color'],
+        'colors': segment_result['colors'],
+        'attributes': attributes or {},
     }
-    logger.info(f"Segmentation and classification result: {result}")
+    # One line per upload; the full result (every rendition key) is too much for INFO
+    categories = {key: labels.get('category') for key, labels in classification_results.items()}
+    logger.info(f"Segmented {save_name}: {len(keys)} garments {categories}")
+    result['embeddings'] = dict(zip(keys, embeddings))
     return result
 
+
+def segment_garments(image: Image.Image) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """Model-resolution pixels and per-garment masks of an image, without storing anything."""
+    with shared_segmenter() as cloth_segmenter:
+        cloth_segmenter.segment(image, None)
+        return cloth_segmenter.model_input, cloth_segmenter.garment_masks()
+
+
+@contextmanager
+def file_lock(lock_path: str, exclusive: bool = True):
+    """Advisory lock shared by every thread and worker process touching a closet."""
+    with open(lock_path, 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def atomic_write(path: str, write) -> None:
+    """Write via a temp file, fsync and rename so readers never see a torn file."""
+    tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp_path, 'w', newline='') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+_compaction_queue: 'queue.Queue[str]' = queue.Queue()
+_compaction_pending = set()
+_compaction_lock = threading.Lock()
+_compaction_thread: Optional[threading.Thread] = None
+
+
+def _compaction_worker() -> None:
+    while True:
+        user_id = _compaction_queue.get()
+        with _compaction_lock:
+            _compaction_pending.discard(user_id)
+        try:
+            Closet(user_id).compact()
+        except Exception as e:
+            logger.error(f"Error compacting closet for user {user_id}: {str(e)}", exc_info=True)
+
+
+def schedule_compaction(user_id: str) -> None:
+    global _compaction_thread
+    with _compaction_lock:
+        if user_id in _compaction_pending:
+            return
+        _compaction_pending.add(user_id)
+        if _compaction_thread is None:
+            _compaction_thread = threading.Thread(target=_compaction_worker, daemon=True)
+            _compaction_thread.start()
+    _compaction_queue.put(user_id)
+
+
+register_collector("closet_compaction_queue_depth", "gauge", "Closets waiting for background compaction",
+                   lambda: [({}, _compaction_queue.qsize())])
+
+
+def store_key(path: str) -> str:
+    """Image store key for a path in a closet row.
+
+    Rows written before the image store hold paths under IMAGES_DIR.
+    """
+    path = os.path.normpath(path)
+    root = os.path.normpath(env.IMAGES_DIR)
+    if path.startswith(root + os.sep):
+        return os.path.relpath(path, root)
+    return path
+
+
+def list_closet_user_ids() -> List[str]:
+    user_ids = set()
+    for filename in os.listdir(env.CLOSETS_DIR):
+        for suffix in ('_closet.csv', '_closet.journal'):
+            if filename.endswith(suffix):
+                user_ids.add(filename[:-len(suffix)])
+    return sorted(user_ids)
+
+
+_closet_cache: Dict[str, 'Closet'] = {}
+_closet_cache_lock = threading.Lock()
+
+
+def cached_closet(user_id: str) -> 'Closet':
+    """A shared, up-to-date Closet for reads.
+
+    Only the journal entries written since the last call are replayed, instead
+    of parsing the whole CSV per request. Bounded like the color index cache.
+    """
+    with _closet_cache_lock:
+        closet = _closet_cache.pop(user_id, None)
+        if closet is not None:
+            _closet_cache[user_id] = closet
+    if closet is not None:
+        return closet.refresh()
+    closet = Closet(user_id)
+    with _closet_cache_lock:
+        _closet_cache[user_id] = closet
+        while len(_closet_cache) > env.CLOSET_CACHE_MAX_ITEMS:
+            _closet_cache.pop(next(iter(_closet_cache)))
+    return closet
+
+
 class Closet:
+    """A user's closet: a CSV snapshot plus an append-only journal.
+
+    Adds and deletes are appended to ``<user_id>_closet.journal`` as JSON lines
+    under a per-user file lock, so a write is O(1) and concurrent writers
+    (threads or uvicorn workers) never overwrite each other. Once the journal
+    grows past CLOSET_JOURNAL_COMPACT_THRESHOLD entries it is folded back into
+    the CSV in the background with an atomic rename.
+    """
+
     def __init__(self, user_id: str):
         self.user_id = user_id
-        self.csv_path = f"data/closets/{user_id}_closet.csv"
-        self.image_dir = f"data/images/{user_id}"
-        self.df = self._load_or_create_df()
+        self.csv_path = os.path.join(env.CLOSETS_DIR, f"{user_id}_closet.csv")
+        self.journal_path = os.path.join(env.CLOSETS_DIR, f"{user_id}_closet.journal")
+        self.lock_path = os.path.join(env.CLOSETS_DIR, f"{user_id}_closet.lock")
+        self.image_dir = os.path.join(env.IMAGES_DIR, user_id)
+        self._snapshot_id = None
+        self._journal_offset = 0
+        self._journal_entries = 0
+        self._journal_updates = 0
+        self._refresh_lock = threading.Lock()
+        with operation_latency.labels('load').time(), span('closet.load'), file_lock(self.lock_path, exclusive=False):
+            self.df = self._load_or_create_df()
+            self._replay_journal()
+
+    def _snapshot_stat(self):
+        try:
+            stat = os.stat(self.csv_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
 
     def _load_or_create_df(self) -> pd.DataFrame:
+        self._snapshot_id = self._snapshot_stat()
+        self._journal_offset = 0
+        self._journal_entries = 0
+        self._journal_updates = 0
         if os.path.exists(self.csv_path):
             df = pd.read_csv(self.csv_path)
             if 'image_hash' not in df.columns:
                 df['image_hash'] = ''
             if 'combined_mask_image_path' not in df.columns:
                 df['combined_mask_image_path'] = ''
+            if 'renditions' not in df.columns:
+                df['renditions'] = [{} for _ in range(len(df))]
+            if 'color' not in df.columns:
+                df['color'] = None
+            if 'colors' not in df.columns:
+                df['colors'] = [{} for _ in range(len(df))]
+            if 'attributes' not in df.columns:
+                df['attributes'] = [{} for _ in range(len(df))]
             
-            # Parse masked_images and classification_results as dictionaries
+            # Parse masked_images, classification_results and renditions as dictionaries
             df['masked_images'] = df['masked_images'].apply(self._parse_dict)
             df['classification_results'] = df['classification_results'].apply(self._parse_dict)
+            df['renditions'] = df['renditions'].apply(self._parse_dict)
+            df['colors'] = df['colors'].apply(self._parse_dict)
+            df['attributes'] = df['attributes'].apply(self._parse_dict)
             return df
         else:
-            df = pd.DataFrame(columns=CLOSET_COLUMNS)
-            df.to_csv(self.csv_path, index=False)
-            return df
+            return pd.DataFrame(columns=CLOSET_COLUMNS)
+
+    def _replay_journal(self) -> None:
+        """Apply journal entries written since we last looked (by anyone)."""
+        if self._snapshot_stat() != self._snapshot_id:
+            # Compacted by someone else since we loaded: start from the new snapshot
+            self.df = self._load_or_create_df()
+        if not os.path.exists(self.journal_path):
+            return
+
+        with open(self.journal_path, 'rb') as f:
+            f.seek(self._journal_offset)
+            data = f.read()
+        # Ignore a trailing partial line left by a crash mid-append
+        complete = data[:data.rfind(b'\n') + 1]
+        self._journal_offset += len(complete)
+
+        added = {}
+        deleted = set()
+        for line in complete.splitlines():
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping corrupt journal entry in {self.journal_path}")
+                continue
+            self._journal_entries += 1
+            if entry['op'] == 'update':
+                self._journal_updates += 1
+            if entry['op'] in ('add', 'update'):
+                item = entry['item']
+                added[item['id']] = item
+                deleted.discard(item['id'])
+            elif entry['op'] == 'delete':
+                added.pop(entry['id'], None)
+                deleted.add(entry['id'])
+
+        if not added and not deleted:
+            return
+        df = self.df[~self.df['id'].isin(deleted | set(added))]
+        if added:
+            df = pd.concat([df, pd.DataFrame(list(added.values()))], ignore_index=True)
+        self.df = df.reset_index(drop=True)
+
+    def refresh(self) -> 'Closet':
+        """Catch up with writes made since, by this or any other process."""
+        with self._refresh_lock, file_lock(self.lock_path, exclusive=False):
+            self._replay_journal()
+        return self
+
+    def labels_version(self):
+        """Changes whenever existing rows may have been rewritten, e.g. re-classified."""
+        return (self._snapshot_id, self._journal_updates)
+
+    @closet_operation('append_journal')
+    def _append_journal(self, entries: List[Dict[str, Any]]) -> None:
+        # Caller must hold the exclusive lock
+        payload = ''.join(json.dumps(entry, default=str) + '\n' for entry in entries)
+        with open(self.journal_path, 'ab') as f:
+            if f.tell() > self._journal_offset:
+                # Drop a torn entry from a crashed writer so ours starts on a fresh line
+                f.truncate(self._journal_offset)
+            f.write(payload.encode())
+            f.flush()
+            os.fsync(f.fileno())
+        self._replay_journal()
+        if self._journal_entries >= env.CLOSET_JOURNAL_COMPACT_THRESHOLD:
+            schedule_compaction(self.user_id)
+
+    @closet_operation('compact')
+    def compact(self) -> None:
+        """Fold the journal into a fresh CSV snapshot and truncate the journal.
+
+        Also drops the dead rows of the closet's embeddings file once there
+        are EMBEDDINGS_COMPACT_THRESHOLD of them.
+        """
+        with file_lock(self.lock_path):
+            self._replay_journal()
+            self._write_snapshot()
+        embedding_index = get_embedding_index(self.user_id)
+        if embedding_index.dead_rows() >= env.EMBEDDINGS_COMPACT_THRESHOLD:
+            embedding_index.compact()
 
     def _parse_dict(self, x):
         if isinstance(x, str):
@@ -97,98 +412,176 @@ class Closet:
                     return {}
         return x if isinstance(x, dict) else {}
 
-    def _image_hash(self, image_path: str) -> str:
-        return str(imagehash.average_hash(Image.open(image_path)))
+    def _image_hash(self, image: Image.Image) -> str:
+        with ingest_stage('hash'):
+            return str(imagehash.average_hash(image))
 
-    def item_exists(self, image_path: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
-        new_hash = self._image_hash(image_path)
-        existing_item = self.df[self.df['image_hash'] == new_hash]
+    def item_exists(self, image_hash: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        existing_item = self.df[self.df['image_hash'] == image_hash]
         if not existing_item.empty:
             return True, existing_item.iloc[0].to_dict()
         return False, None
 
-    def add_item(self, image_path: str, item_id: str) -> Dict[str, Any]:
-        exists, existing_item = self.item_exists(image_path)
+    def existing_hashes(self) -> set:
+        return set(self.df['image_hash'].dropna().astype(str))
+
+    @closet_operation('add_item')
+    def add_item(self, image: Image.Image, item_id: str, priority: str = INTERACTIVE,
+                 shed: bool = True) -> Dict[str, Any]:
+        image_hash = self._image_hash(image)
+        exists, existing_item = self.item_exists(image_hash)
         if exists:
-            logger.info(f"Item already exists in the closet: {image_path}")
+            logger.info(f"Item already exists in the closet: {existing_item['id']}")
             return existing_item
 
         try:
-            result = segment_and_categorize_image(image_path)
-
-            relative_image_path = os.path.relpath(result['image_path'], env.IMAGES_DIR)
-            relative_mask_path = os.path.relpath(result['mask_path'], env.IMAGES_DIR)
-            relative_combined_mask_path = os.path.relpath(result['combined_mask_image_path'], env.IMAGES_DIR)
-
-            # Create a new dictionary with relative paths, keeping the same keys
-            relative_masked_paths = {
-                key: os.path.relpath(path, env.IMAGES_DIR)
-                for key, path in result['masked_image_paths'].items()
-            }
-
-            image_hash = self._image_hash(image_path)
-
-            clothes = Clothes(
-                id=item_id,
-                image_path=relative_image_path,
-                clothes_mask=relative_mask_path,
-                masked_images=relative_masked_paths,
-                combined_mask_image_path=relative_combined_mask_path,
-                image_hash=image_hash,
-                classification_results=result['classification_results']
-            )
-
-            new_item = clothes.to_dict()
-            self.df = pd.concat([self.df, pd.DataFrame([new_item])], ignore_index=True)
-            self._save_df()
+            new_item = self.process_item(image, item_id, image_hash, priority=priority, shed=shed)
+            if not self.add_items([new_item]):
+                # Another request added the same image while we were processing
+                return self.item_exists(image_hash)[1]
             return new_item
 
+        except SchedulerOverloaded:
+            raise
         except Exception as e:
             logger.error(f"Error in add_item: {str(e)}", exc_info=True)
             raise
 
+    @closet_operation('process_item')
+    def process_item(self, image: Image.Image, item_id: str, image_hash: Optional[str] = None,
+                     priority: str = INTERACTIVE, shed: bool = True) -> Dict[str, Any]:
+        """Segment and classify an image without touching the closet file.
+
+        The models run in an inference slot of ``priority`` (modules.scheduler);
+        with ``shed``, SchedulerOverloaded is raised instead of queueing behind
+        a full queue.
+        """
+        # Derived images live under <user_id>/<item_id>/ in the image store and
+        # are referenced by store keys, which are relative to IMAGES_DIR locally
+        prefix = f"{self.user_id}/{item_id}"
+        try:
+            with inference_slot(self.user_id, priority, shed):
+                result = segment_and_categorize_image(image, prefix)
+        except Exception:
+            # Don't leave a half-written item directory behind
+            get_image_store().delete_prefix(prefix)
+            raise
+
+        if image_hash is None:
+            image_hash = self._image_hash(image)
+
+        clothes = Clothes(
+            id=item_id,
+            image_path=result['image_path'],
+            clothes_mask=result['mask_path'],
+            masked_images=result['masked_image_paths'],
+            combined_mask_image_path=result['combined_mask_image_path'],
+            image_hash=image_hash,
+            classification_results=result['classification_results'],
+            renditions=result['renditions'],
+            color=result['color'],
+            colors=result['colors'],
+            attributes=result['attributes']
+        )
+        # Written ahead of the closet row; lookups only consider live items
+        with ingest_stage('embeddings'):
+            get_embedding_index(self.user_id).append(item_id, result['embeddings'])
+        return clothes.to_dict()
+
+    @closet_operation('add_items')
+    def add_items(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Journal already-processed items in one append.
+
+        Items whose image hash was added by another writer in the meantime are
+        dropped; the items actually persisted are returned.
+        """
+        if not items:
+            return []
+        with file_lock(self.lock_path):
+            self._replay_journal()
+            known_hashes = self.existing_hashes()
+            new_items = []
+            for item in items:
+                if item['image_hash'] in known_hashes:
+                    logger.info(f"Skipping item {item['id']}: image already added concurrently")
+                    self._delete_derived_images(item)
+                    continue
+                known_hashes.add(item['image_hash'])
+                new_items.append(item)
+            if new_items:
+                self._append_journal([{'op': 'add', 'item': item} for item in new_items])
+        return new_items
+
+    @closet_operation('update_items')
+    def update_items(self, items: List[Dict[str, Any]]) -> int:
+        """Replace existing rows by id in a single journal append."""
+        with file_lock(self.lock_path):
+            self._replay_journal()
+            existing_ids = set(self.df['id'])
+            updates = [{'op': 'update', 'item': item} for item in items if item['id'] in existing_ids]
+            if updates:
+                self._append_journal(updates)
+        return len(updates)
+
+    @closet_operation('delete_item')
     def delete_item(self, item_id: str) -> bool:
         try:
-            # Find the item
-            item = self.df[self.df['id'] == item_id]
-            if item.empty:
-                logger.warning(f"Item with id {item_id} not found")
-                return False  # Item not found
-            
-            # Get the item folder path
-            item_folder = os.path.join(self.image_dir, item_id)
-            
-            # Remove the item from the DataFrame
-            self.df = self.df[self.df['id'] != item_id]
-            
-            # Save the updated DataFrame back to CSV
-            self._save_df()
-            
-            # Delete the item folder
-            if os.path.exists(item_folder):
-                shutil.rmtree(item_folder)
-                logger.info(f"Successfully deleted item folder: {item_folder}")
-            else:
-                logger.warning(f"Item folder not found: {item_folder}")
-            
-            logger.info(f"Successfully deleted item with id {item_id}")
+            with file_lock(self.lock_path):
+                self._replay_journal()
+
+                # Find the item
+                item = self.df[self.df['id'] == item_id]
+                if item.empty:
+                    logger.warning(f"Item with id {item_id} not found")
+                    return False  # Item not found
+
+                # Journal the delete; replaying it removes the row from self.df
+                self._append_journal([{'op': 'delete', 'id': item_id}])
+
+            embedding_index = get_embedding_index(self.user_id)
+            embedding_index.delete(item_id)
+            if embedding_index.dead_rows() >= env.EMBEDDINGS_COMPACT_THRESHOLD:
+                schedule_compaction(self.user_id)
+
+            # Remove every derived file, whichever layout the item was written with
+            reclaimed = self._delete_derived_images(item.iloc[0].to_dict())
+            logger.info(f"Successfully deleted item with id {item_id} ({reclaimed} bytes reclaimed)")
             return True
         except Exception as e:
             logger.error(f"Error deleting item {item_id}: {str(e)}")
             logger.exception("Detailed traceback:")
             return False
 
-    def _delete_file(self, file_path: str):
-        full_path = os.path.join("/data/images", file_path)
-        if os.path.exists(full_path):
-            try:
-                os.remove(full_path)
-                logger.info(f"Deleted file: {full_path}")
-            except Exception as e:
-                logger.error(f"Error deleting file {full_path}: {str(e)}")
-        else:
-            logger.warning(f"File not found: {full_path}")
-
+    @staticmethod
+    def referenced_keys(item: Dict[str, Any]) -> set:
+        """Every image store key a closet row points at."""
+        keys = set()
+        for column in ('image_path', 'clothes_mask', 'combined_mask_image_path'):
+            value = item.get(column)
+            if isinstance(value, str) and value:
+                keys.add(store_key(value))
+        masked_images = item.get('masked_images')
+        if isinstance(masked_images, dict):
+            keys.update(store_key(path) for path in masked_images.values() if path)
+        renditions = item.get('renditions')
+        if isinstance(renditions, dict):
+            for rendition_keys in renditions.values():
+                keys.update(store_key(key) for key in rendition_keys.values() if key)
+        return keys
+
+    def _delete_derived_images(self, item: Dict[str, Any]) -> int:
+        # New items live under <user_id>/<item_id>/, older ones under <item_id>/;
+        # removing every directory the row references covers both.
+        store = get_image_store()
+        prefixes = {os.path.dirname(key) for key in self.referenced_keys(item)}
+        prefixes.add(f"{self.user_id}/{item['id']}")
+        reclaimed = 0
+        for prefix in prefixes:
+            if prefix:
+                reclaimed += store.delete_prefix(prefix)
+        return reclaimed
+
+    @closet_operation('search_items')
     def search_items(self, **kwargs) -> List[Clothes]:
         result_df = self.df.copy()
         
@@ -203,10 +596,28 @@ class Closet:
         
         return [Clothes.from_dict(row) for _, row in result_df.iterrows()]
 
-    def _check_attribute(self, attributes_json: str, key: str, value: Any) -> bool:
-        attributes = json.loads(attributes_json)
-        return key in attributes and attributes[key].get('type') == value
-
+    def color_index(self):
+        """Palette index of this closet, shared until the closet changes."""
+        version = (self._snapshot_id, self._journal_offset)
+        return get_color_index(self.user_id, version, lambda: {
+            row['id']: self._parse_dict(row['colors'])
+            for _, row in self.df.iterrows()
+        })
+
+    @closet_operation('search_by_color')
+    def search_by_color(self, hex_color: str, max_distance: float = 20.0, limit: int = 50) -> List[Dict[str, Any]]:
+        """Items with a garment color close to ``hex_color``, closest first."""
+        return self.color_index().query(hex_color, max_distance=max_distance, limit=limit)
+
+    def _check_attribute(self, attributes: Dict[str, Dict[str, Any]], key: str, value: Any) -> bool:
+        # True if any garment of the item has the attribute, e.g. ('texture', 'striped')
+        for garment_attributes in self._parse_dict(attributes).values():
+            found = garment_attributes.get(key)
+            if found == value or (isinstance(found, list) and value in found):
+                return True
+        return False
+
+    @closet_operation('get_all_items')
     def get_all_items(self) -> List[Clothes]:
         items = []
         for _, row in self.df.iterrows():
@@ -214,6 +625,9 @@ class Closet:
                 item_dict = row.to_dict()
                 item_dict['masked_images'] = self._parse_dict(item_dict['masked_images'])
                 item_dict['classification_results'] = self._parse_dict(item_dict['classification_results'])
+                item_dict['renditions'] = self._parse_dict(item_dict.get('renditions', {}))
+                item_dict['colors'] = self._parse_dict(item_dict.get('colors', {}))
+                item_dict['attributes'] = self._parse_dict(item_dict.get('attributes', {}))
                 item = Clothes.from_dict(item_dict)
                 items.append(item)
             except Exception as e:
@@ -221,13 +635,27 @@ class Closet:
                 logger.error(f"Problematic row: {row.to_dict()}")
         return items
 
-    def _save_df(self) -> None:
+    @closet_operation('write_snapshot')
+    def _write_snapshot(self) -> None:
+        # Caller must hold the exclusive lock
         # Convert masked_images and classification_results to string representation of dictionaries before saving
         df_to_save = self.df.copy()
         df_to_save['masked_images'] = df_to_save['masked_images'].apply(str)
         df_to_save['classification_results'] = df_to_save['classification_results'].apply(str)
-        df_to_save.to_csv(self.csv_path, index=False)
+        df_to_save['renditions'] = df_to_save['renditions'].apply(str)
+        df_to_save['colors'] = df_to_save['colors'].apply(str)
+        df_to_save['attributes'] = df_to_save['attributes'].apply(str)
+        atomic_write(self.csv_path, lambda f: df_to_save.to_csv(f, index=False))
+        atomic_write(self.journal_path, lambda f: None)
+        self._snapshot_id = self._snapshot_stat()
+        self._journal_offset = 0
+        self._journal_entries = 0
+
+    def _save_df(self) -> None:
+        with file_lock(self.lock_path):
+            self._write_snapshot()
 
+    @closet_operation('get_closet_stats')
     def get_closet_stats(self, include_distribution: bool = False) -> Dict[str, Any]:
         stats = {
             'categories': [],
@@ -253,10 +681,13 @@ class Closet:
         all_attributes = set()
         attribute_types = Counter()
         for attrs in self.df['attributes']:
-            attr_dict = json.loads(attrs)
-            for attr, details in attr_dict.items():
-                all_attributes.add(attr)
-                attribute_types[f"{attr}:{details['type']}"] += 1
+            for garment_attributes in self._parse_dict(attrs).values():
+                for attr_type, names in garment_attributes.items():
+                    if attr_type == 'category':
+                        continue
+                    for name in names:
+                        all_attributes.add(name)
+                        attribute_types[f"{name}:{attr_type}"] += 1
 
         stats['categories'] = categories
         stats['subcategories'] = subcategories
@@ -291,7 +722,7 @@ if __name__ == "__main__":
     closet = Closet.create("user123")
     
     # Add an item
-    closet.add_item("/path/to/uploaded/image.jpg")
+    closet.add_item(Image.open("/path/to/uploaded/image.jpg").convert('RGB'), str(uuid.uuid4()))
     
     # Search for items
     blue_tops = closet.search_items(category="top", color="blue")
@@ -0,0 +1,218 @@
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from config import env
+
+# sRGB (D65) -> XYZ, and the D65 reference white
+RGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+], dtype=np.float32)
+XYZ_TO_RGB = np.linalg.inv(RGB_TO_XYZ).astype(np.float32)
+WHITE_D65 = np.array([0.95047, 1.0, 1.08883], dtype=np.float32)
+LAB_EPSILON = 216 / 24389
+LAB_KAPPA = 24389 / 27
+
+# Gamma-decoding every channel value once is cheaper than pow() per pixel
+_SRGB_TO_LINEAR = np.array([
+    c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4
+    for c in np.arange(256) / 255.0
+], dtype=np.float32)
+
+# Coarse names for the `color` column, matched by nearest Lab distance
+NAMED_COLORS = {
+    'black': (20, 20, 20),
+    'white': (245, 245, 245),
+    'gray': (128, 128, 128),
+    'beige': (220, 200, 160),
+    'brown': (110, 70, 40),
+    'red': (200, 30, 40),
+    'burgundy': (110, 20, 40),
+    'orange': (240, 130, 30),
+    'yellow': (240, 210, 50),
+    'olive': (110, 110, 40),
+    'green': (40, 140, 60),
+    'teal': (0, 128, 128),
+    'light blue': (140, 180, 230),
+    'blue': (40, 80, 190),
+    'navy': (25, 35, 75),
+    'purple': (110, 50, 150),
+    'pink': (240, 150, 180),
+}
+
+
+def rgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """Convert (..., 3) uint8 sRGB to float32 CIELAB."""
+    linear = _SRGB_TO_LINEAR[np.asarray(rgb, dtype=np.uint8)]
+    xyz = (linear @ RGB_TO_XYZ.T) / WHITE_D65
+    f = np.where(xyz > LAB_EPSILON, np.cbrt(xyz), (LAB_KAPPA * xyz + 16) / 116)
+    lab = np.empty_like(f)
+    lab[..., 0] = 116 * f[..., 1] - 16
+    lab[..., 1] = 500 * (f[..., 0] - f[..., 1])
+    lab[..., 2] = 200 * (f[..., 1] - f[..., 2])
+    return lab
+
+
+def lab_to_rgb(lab: np.ndarray) -> np.ndarray:
+    """Convert (..., 3) CIELAB back to uint8 sRGB, clipping out-of-gamut values."""
+    lab = np.asarray(lab, dtype=np.float32)
+    fy = (lab[..., 0] + 16) / 116
+    f = np.stack([fy + lab[..., 1] / 500, fy, fy - lab[..., 2] / 200], axis=-1)
+    xyz = np.where(f ** 3 > LAB_EPSILON, f ** 3, (116 * f - 16) / LAB_KAPPA) * WHITE_D65
+    linear = np.clip(xyz @ XYZ_TO_RGB.T, 0, 1)
+    srgb = np.where(linear <= 0.0031308, 12.92 * linear, 1.055 * linear ** (1 / 2.4) - 0.055)
+    return np.round(np.clip(srgb, 0, 1) * 255).astype(np.uint8)
+
+
+def hex_to_rgb(value: str) -> Tuple[int, int, int]:
+    value = value.lstrip('#')
+    if len(value) != 6:
+        raise ValueError(f"Invalid hex color: {value}")
+    return tuple(int(value[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def rgb_to_hex(rgb: Iterable[int]) -> str:
+    return '#' + ''.join(f"{int(c):02x}" for c in rgb)
+
+
+_NAMES = list(NAMED_COLORS)
+_NAMED_LAB = rgb_to_lab(np.array(list(NAMED_COLORS.values()), dtype=np.uint8))
+
+
+def color_name(lab: np.ndarray) -> str:
+    return _NAMES[int(np.argmin(((_NAMED_LAB - lab) ** 2).sum(axis=1)))]
+
+
+def _kmeans(points: np.ndarray, k: int, iterations: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Deterministic init: seeds spread over the lightness range
+    order = np.argsort(points[:, 0], kind='stable')
+    centers = points[order[np.linspace(0, len(points) - 1, k).astype(int)]]
+    for _ in range(iterations):
+        distances = (points * points).sum(1)[:, None] - 2 * points @ centers.T + (centers * centers).sum(1)
+        labels = distances.argmin(axis=1)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.stack([np.bincount(labels, weights=points[:, d], minlength=k) for d in range(3)], axis=1)
+        updated = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centers)
+        if np.allclose(updated, centers, atol=0.5):
+            centers = updated
+            break
+        centers = updated.astype(np.float32)
+    return centers, counts
+
+
+def dominant_colors(pixels: np.ndarray, mask: np.ndarray, k: Optional[int] = None) -> List[Tuple[str, float]]:
+    """Palette of the masked pixels as [(hex, share of garment), ...], largest first.
+
+    ``pixels`` is an (H, W, 3) uint8 array aligned with the boolean ``mask``.
+    Only up to COLOR_MAX_SAMPLES masked pixels are clustered, in Lab space so
+    distances roughly match perceived color differences.
+    """
+    k = k or env.COLOR_PALETTE_SIZE
+    count = np.count_nonzero(mask)
+    if count == 0:
+        return []
+    if count > env.COLOR_MAX_SAMPLES:
+        # Subsample on a regular grid before gathering, so large garments cost
+        # about the same as small ones
+        stride = int(np.ceil(np.sqrt(count / env.COLOR_MAX_SAMPLES)))
+        pixels, mask = pixels[::stride, ::stride], mask[::stride, ::stride]
+    lab = rgb_to_lab(pixels[mask])
+
+    centers, counts = _kmeans(lab, min(k, len(lab)), env.COLOR_KMEANS_ITERATIONS)
+
+    # Seeds can split one flat color into several clusters; fold near-duplicates
+    palette: List[List[Any]] = []
+    for i in np.argsort(-counts):
+        if counts[i] == 0:
+            continue
+        for entry in palette:
+            if np.linalg.norm(entry[0] - centers[i]) < env.COLOR_MERGE_DISTANCE:
+                total = entry[1] + counts[i]
+                entry[0] = (entry[0] * entry[1] + centers[i] * counts[i]) / total
+                entry[1] = total
+                break
+        else:
+            palette.append([centers[i], counts[i]])
+
+    total = float(counts.sum())
+    palette = [(center, count / total) for center, count in palette if count / total >= env.COLOR_MIN_SHARE]
+    palette.sort(key=lambda entry: -entry[1])
+    rgb = lab_to_rgb(np.array([center for center, _ in palette]))
+    return [(rgb_to_hex(color), round(float(share), 3)) for color, (_, share) in zip(rgb, palette)]
+
+
+def palette_name(palette: List[Tuple[str, float]]) -> Optional[str]:
+    if not palette:
+        return None
+    return color_name(rgb_to_lab(np.array(hex_to_rgb(palette[0][0]), dtype=np.uint8)))
+
+
+class ColorIndex:
+    """Every palette entry of a closet stacked into one Lab matrix.
+
+    A query is a single vectorized distance computation over all entries
+    instead of a scan over parsed rows.
+    """
+
+    def __init__(self, item_palettes: Dict[str, Dict[str, List[Tuple[str, float]]]]):
+        item_ids, garments, colors, shares = [], [], [], []
+        for item_id, palettes in item_palettes.items():
+            for garment, palette in palettes.items():
+                for hex_color, share in palette:
+                    item_ids.append(item_id)
+                    garments.append(garment)
+                    colors.append(hex_to_rgb(hex_color))
+                    shares.append(share)
+        self.item_ids = np.array(item_ids, dtype=object)
+        self.garments = np.array(garments, dtype=object)
+        self.shares = np.array(shares, dtype=np.float32)
+        self.lab = rgb_to_lab(np.array(colors, dtype=np.uint8).reshape(-1, 3))
+
+    def __len__(self) -> int:
+        return len(self.item_ids)
+
+    def query(self, hex_color: str, max_distance: float = 20.0, min_share: float = 0.1,
+              limit: int = 50) -> List[Dict[str, Any]]:
+        """Items with a palette color within ``max_distance`` (CIE76 delta E), closest first."""
+        if not len(self):
+            return []
+        target = rgb_to_lab(np.array(hex_to_rgb(hex_color), dtype=np.uint8))
+        distances = np.linalg.norm(self.lab - target, axis=1)
+        candidates = np.flatnonzero((distances <= max_distance) & (self.shares >= min_share))
+        matches: Dict[str, Dict[str, Any]] = {}
+        for i in candidates[np.argsort(distances[candidates], kind='stable')]:
+            if self.item_ids[i] not in matches:
+                matches[self.item_ids[i]] = {
+                    'id': self.item_ids[i],
+                    'garment': self.garments[i],
+                    'distance': round(float(distances[i]), 2),
+                    'share': round(float(self.shares[i]), 3),
+                }
+                if len(matches) >= limit:
+                    break
+        return list(matches.values())
+
+
+_index_cache: Dict[str, Tuple[Any, ColorIndex]] = {}
+_index_lock = threading.Lock()
+
+
+def get_color_index(user_id: str, version: Any, item_palettes) -> ColorIndex:
+    """Color index for a closet, rebuilt only when the closet ``version`` changes.
+
+    ``item_palettes`` is called to get {item_id: palettes} on a rebuild.
+    """
+    with _index_lock:
+        cached = _index_cache.get(user_id)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+    index = ColorIndex(item_palettes())
+    with _index_lock:
+        _index_cache.pop(user_id, None)
+        _index_cache[user_id] = (version, index)
+        while len(_index_cache) > env.COLOR_INDEX_CACHE_MAX_ITEMS:
+            _index_cache.pop(next(iter(_index_cache)))
+    return index
@@ -0,0 +1,138 @@
+import io
+import re
+import struct
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from config import env
+from modules.cache import ByteLRUCache
+from modules.image_store import (CUTOUT_SUFFIX, RENDITIONS, ImageStore, output_format,
+                                 encode_image, get_image_store)
+from modules.metrics import register_cache
+
+RLE_MAGIC = b'PFRL'
+RLE_VERSION = 1
+RLE_HEADER = struct.Struct('<4sBHHI')
+# <prefix>/<name>.<rendition>.cutout, e.g. user/item/masked_1.thumb.cutout
+CUTOUT_KEY_PATTERN = re.compile(r'^(?P<prefix>.+)/(?P<name>[a-z_0-9]+)\.(?P<rendition>[a-z]+)\.cutout$')
+
+# Background plus the segmenter's upper body, lower body and full body classes
+NUM_CLASSES = 4
+
+cutout_cache = ByteLRUCache(env.CUTOUT_CACHE_MAX_BYTES)
+register_cache('cutouts', cutout_cache)
+
+
+def rle_encode(labels: np.ndarray) -> bytes:
+    """Run-length encode a 2D uint8 label map (row-major)."""
+    height, width = labels.shape
+    flat = labels.ravel()
+    starts = np.concatenate(([0], np.flatnonzero(flat[1:] != flat[:-1]) + 1))
+    lengths = np.diff(np.append(starts, flat.size))
+    header = RLE_HEADER.pack(RLE_MAGIC, RLE_VERSION, height, width, len(starts))
+    return header + flat[starts].astype(np.uint8).tobytes() + lengths.astype(np.uint32).tobytes()
+
+
+def rle_decode(data: bytes) -> np.ndarray:
+    magic, version, height, width, runs = RLE_HEADER.unpack_from(data)
+    if magic != RLE_MAGIC or version != RLE_VERSION:
+        raise ValueError("Not a label map")
+    offset = RLE_HEADER.size
+    values = np.frombuffer(data, dtype=np.uint8, count=runs, offset=offset)
+    lengths = np.frombuffer(data, dtype=np.uint32, count=runs, offset=offset + runs)
+    return np.repeat(values, lengths).reshape(height, width)
+
+
+def instance_label(cls: int, instance: int) -> int:
+    """Label map value of the ``instance``-th (1-based) garment of class ``cls``.
+
+    The first instance is the class id itself, so a map without split
+    garments is a plain class map.
+    """
+    return cls + NUM_CLASSES * (instance - 1)
+
+
+def cutout_key(prefix: str, name: str, rendition: str) -> str:
+    return f"{prefix}/{name}.{rendition}{CUTOUT_SUFFIX}"
+
+
+def cutout_renditions(prefix: str, name: str) -> Dict[str, str]:
+    return {rendition: cutout_key(prefix, name, rendition) for rendition in RENDITIONS}
+
+
+def garment_class(name: str) -> int:
+    """Segmentation class of a ``masked_<cls>[_<n>]`` cutout name."""
+    match = re.match(r'^masked_(\d+)(?:_\d+)?$', name)
+    if not match:
+        raise KeyError(name)
+    return int(match.group(1))
+
+
+def class_mask(labels: np.ndarray, name: str) -> np.ndarray:
+    """Boolean mask for a cutout name.
+
+    ``masked_<cls>`` is every garment of a class, ``masked_<cls>_<n>`` its n-th
+    instance and ``combined_masked`` all garments.
+    """
+    if name == 'combined_masked':
+        return labels > 0
+    match = re.match(r'^masked_(\d+)(?:_(\d+))?$', name)
+    if not match:
+        raise KeyError(name)
+    cls = int(match.group(1))
+    if match.group(2) is None:
+        return (labels > 0) & (labels % NUM_CLASSES == cls)
+    return labels == instance_label(cls, int(match.group(2)))
+
+
+def compose_cutout(image: Image.Image, mask: np.ndarray) -> Image.Image:
+    """Paste ``image`` through a model-resolution mask scaled to the image size."""
+    alpha = Image.fromarray(mask.astype(np.uint8) * 255, mode='L').resize(image.size, Image.BICUBIC)
+    cutout = Image.new('RGBA', image.size, (0, 0, 0, 0))
+    cutout.paste(image if image.mode == 'RGBA' else image.convert('RGBA'), (0, 0), alpha)
+    return cutout
+
+
+def _find(keys, stem: str) -> Optional[str]:
+    for key in keys:
+        if key.rsplit('/', 1)[-1].startswith(stem):
+            return key
+    return None
+
+
+def load_sources(prefix: str, store: Optional[ImageStore] = None) -> Tuple[Image.Image, np.ndarray]:
+    """Original image and label map of an item, found by listing its prefix."""
+    store = store or get_image_store()
+    keys = store.list_prefix(prefix)
+    original_key = _find(keys, 'original.full.')
+    labels_key = _find(keys, 'labels.')
+    if original_key is None or labels_key is None:
+        raise FileNotFoundError(prefix)
+    original = Image.open(io.BytesIO(store.get(original_key))).convert('RGB')
+    return original, rle_decode(store.get(labels_key))
+
+
+def render_cutout(key: str, store: Optional[ImageStore] = None) -> bytes:
+    """Encoded cutout for a cutout key, rendered on first use and cached."""
+    cached = cutout_cache.get(key)
+    if cached is not None:
+        return cached
+
+    match = CUTOUT_KEY_PATTERN.match(key)
+    if not match or match.group('rendition') not in RENDITIONS:
+        raise FileNotFoundError(key)
+    original, labels = load_sources(match.group('prefix'), store)
+    try:
+        mask = class_mask(labels, match.group('name'))
+    except KeyError:
+        raise FileNotFoundError(key)
+
+    cutout = compose_cutout(original, mask)
+    max_side = RENDITIONS[match.group('rendition')]
+    if max_side is not None and max(cutout.size) > max_side:
+        cutout.thumbnail((max_side, max_side), Image.BICUBIC)
+    data = encode_image(cutout, output_format())
+    cutout_cache.put(key, data)
+    return data
@@ -0,0 +1,361 @@
+import fcntl
+import logging
+import os
+import struct
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from config import env
+from modules.cutouts import garment_class
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS_MAGIC = b'PFEM'
+EMBEDDINGS_VERSION = 1
+HEADER = struct.Struct('<4sBxxxI')
+# Garment class of a tombstone row, which matches no query
+NO_CLASS = -1
+
+
+def _record_dtype(dim: int) -> np.dtype:
+    # Fixed-size records so the file can be read with one np.fromfile call
+    return np.dtype([('item_id', 'S36'), ('garment', 'S16'), ('vector', '<f2', (dim,))])
+
+
+def _records(item_id: str, embeddings: Dict[str, np.ndarray]) -> np.ndarray:
+    vectors = np.stack([np.asarray(v, dtype=np.float32) for v in embeddings.values()])
+    records = np.zeros(len(embeddings), dtype=_record_dtype(vectors.shape[1]))
+    records['item_id'] = item_id.encode()
+    records['garment'] = [name.encode() for name in embeddings]
+    records['vector'] = vectors
+    return records
+
+
+def _read_dim(f) -> Optional[int]:
+    """Vector size from the header of an open embeddings file; None if it is empty."""
+    header = f.read(HEADER.size)
+    if not header:
+        return None
+    magic, version, dim = HEADER.unpack(header)
+    if magic != EMBEDDINGS_MAGIC or version != EMBEDDINGS_VERSION:
+        raise ValueError(f"Not an embeddings file: {f.name}")
+    return dim
+
+
+def _write_records(path: str, records: np.ndarray) -> None:
+    """Append records, refusing any whose vector size differs from the file's."""
+    dim = records.dtype['vector'].shape[0]
+    with open(path, 'a+b') as f:
+        f.seek(0)
+        file_dim = _read_dim(f)
+        if file_dim is None:
+            f.write(HEADER.pack(EMBEDDINGS_MAGIC, EMBEDDINGS_VERSION, dim))
+        elif file_dim != dim:
+            raise ValueError(f"{path} holds {file_dim}-d embeddings, not {dim}-d")
+        f.write(records.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _replace_file(path: str, dim: int, records: np.ndarray) -> None:
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(EMBEDDINGS_MAGIC, EMBEDDINGS_VERSION, dim))
+        f.write(records.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_records(path: str) -> Tuple[Optional[int], np.ndarray]:
+    with open(path, 'rb') as f:
+        dim = _read_dim(f)
+        if dim is None:
+            return None, np.zeros(0, dtype=_record_dtype(0))
+        return dim, np.fromfile(f, dtype=_record_dtype(dim))
+
+
+class EmbeddingIndex:
+    """Garment embeddings of one closet, for nearest-item lookups.
+
+    Embeddings are appended to ``EMBEDDINGS_DIR/<user_id>.emb`` as fixed-size
+    float16 records; a later record for the same (item, garment) replaces an
+    earlier one, and a record with an empty garment name (a tombstone) drops
+    every garment of a deleted item. The index keeps the vectors of all records
+    it has read in one normalized matrix and only reads what was appended
+    since, so a lookup is a single matrix-vector product however large the
+    closet is. compact() rewrites the file without the dead rows, and an
+    EmbeddingRebuild replaces it; every index on the file notices the new
+    file and reads it from the start.
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.path = os.path.join(env.EMBEDDINGS_DIR, f"{user_id}.emb")
+        self.lock_path = f"{self.path}.lock"
+        self.rebuild_path = f"{self.path}.rebuild"
+        # Bumped whenever the file was replaced and row numbers start over
+        self.generation = 0
+        self._inode = None
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self) -> None:
+        self.dim: Optional[int] = None
+        self._offset = 0
+        self._rows: Dict[Tuple[str, str], int] = {}
+        self._item_rows: Dict[str, List[int]] = {}
+        self._item_ids: List[str] = []
+        self._garments: List[str] = []
+        self._classes: List[int] = []
+        self._active: List[bool] = []
+        self._chunks: List[np.ndarray] = []
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+
+    @contextmanager
+    def file_lock(self):
+        """Held by every writer of the file, so a rewrite never loses an append."""
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def append(self, item_id: str, embeddings: Dict[str, np.ndarray]) -> None:
+        """Persist one embedding per garment of ``item_id``."""
+        if not embeddings:
+            return
+        records = _records(item_id, embeddings)
+        with self.file_lock():
+            _write_records(self.path, records)
+
+    def delete(self, item_id: str) -> None:
+        """Drop every garment of a deleted item; the rows go at the next compact()."""
+        with self.file_lock():
+            try:
+                with open(self.path, 'rb') as f:
+                    dim = _read_dim(f)
+            except FileNotFoundError:
+                return
+            if dim is None:
+                return
+            tombstone = np.zeros(1, dtype=_record_dtype(dim))
+            tombstone['item_id'] = item_id.encode()
+            _write_records(self.path, tombstone)
+
+    def refresh(self) -> None:
+        """Read records appended since the last refresh, by any process."""
+        with self._lock:
+            try:
+                f = open(self.path, 'rb')
+            except FileNotFoundError:
+                return
+            with f:
+                stat = os.fstat(f.fileno())
+                if stat.st_ino != self._inode:
+                    if self._inode is not None:
+                        # Compacted or rebuilt by someone: read the new file from the start
+                        self._clear()
+                        self.generation += 1
+                    self._inode = stat.st_ino
+                size = stat.st_size
+                if size <= max(self._offset, HEADER.size - 1):
+                    return
+                if self.dim is None:
+                    self.dim = _read_dim(f)
+                    self._offset = HEADER.size
+                dtype = _record_dtype(self.dim)
+                # A partially written trailing record is left for the next refresh
+                count = (size - self._offset) // dtype.itemsize
+                if count == 0:
+                    return
+                f.seek(self._offset)
+                records = np.fromfile(f, dtype=dtype, count=count)
+            self._offset += count * dtype.itemsize
+
+            vectors = records['vector'].astype(np.float32)
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            for record in records:
+                item_id, garment = record['item_id'].decode(), record['garment'].decode()
+                row = len(self._item_ids)
+                if garment:
+                    previous = self._rows.get((item_id, garment))
+                    if previous is not None:
+                        # Re-embedded (e.g. reprocessed) garment: the new row wins
+                        self._active[previous] = False
+                    self._rows[(item_id, garment)] = row
+                    self._item_rows.setdefault(item_id, []).append(row)
+                else:
+                    # Tombstone: the item was deleted
+                    for previous in self._item_rows.pop(item_id, []):
+                        self._active[previous] = False
+                        self._rows.pop((item_id, self._garments[previous]), None)
+                self._item_ids.append(item_id)
+                self._garments.append(garment)
+                self._classes.append(garment_class(garment) if garment else NO_CLASS)
+                self._active.append(bool(garment))
+            self._chunks.append(vectors)
+
+    def _consolidate(self) -> None:
+        if self._chunks:
+            parts = [self._matrix] if len(self._matrix) else []
+            self._matrix = np.concatenate(parts + self._chunks)
+            self._chunks = []
+
+    def __len__(self) -> int:
+        return sum(self._active)
+
+    def dead_rows(self) -> int:
+        """Rows of superseded embeddings, deleted items and tombstones."""
+        self.refresh()
+        with self._lock:
+            return len(self._active) - sum(self._active)
+
+    def compact(self) -> int:
+        """Rewrite the file with only the live rows; returns how many were dropped."""
+        with self.file_lock():
+            self.refresh()
+            with self._lock:
+                keep = np.flatnonzero(self._active)
+                dropped = len(self._active) - len(keep)
+                dim, count = self.dim, len(self._active)
+            if not dropped:
+                return 0
+            # No writer can append while the lock is held, so the file is exactly what was read
+            with open(self.path, 'rb') as f:
+                f.seek(HEADER.size)
+                records = np.fromfile(f, dtype=_record_dtype(dim), count=count)
+            _replace_file(self.path, dim, records[keep])
+        self.refresh()
+        logger.info(f"Compacted embeddings of user {self.user_id}: {dropped} dead rows dropped")
+        return dropped
+
+    def rows_since(self, start: int, active_only: bool = False) -> Tuple[List[Tuple[str, str]], np.ndarray, int]:
+        """(item_id, garment) keys and normalized vectors of rows from ``start`` on.
+
+        Also returns the row count, to pass as ``start`` next time (row numbers
+        start over when ``generation`` changes). Tombstones are never returned.
+        """
+        self.refresh()
+        with self._lock:
+            self._consolidate()
+            end = len(self._item_ids)
+            rows = [row for row in range(start, end)
+                    if self._active[row] or (not active_only and self._garments[row])]
+            keys = [(self._item_ids[row], self._garments[row]) for row in rows]
+            vectors = self._matrix[rows] if rows else np.zeros((0, self.dim or 0), dtype=np.float32)
+        return keys, vectors, end
+
+    def match(self, queries: np.ndarray, classes: Iterable[int],
+              live_item_ids: Optional[set] = None) -> List[Optional[Tuple[str, str, float]]]:
+        """Closest (item_id, garment, cosine similarity) per query among garments of the same class."""
+        self.refresh()
+        classes = list(classes)
+        with self._lock:
+            self._consolidate()
+            if not self._item_ids:
+                return [None] * len(classes)
+            queries = np.asarray(queries, dtype=np.float32)
+            queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+            similarities = self._matrix @ queries.T
+            item_ids = np.array(self._item_ids, dtype=object)
+            garments = list(self._garments)
+            row_classes = np.array(self._classes)
+            valid = np.array(self._active, dtype=bool)
+            if live_item_ids is not None:
+                valid &= np.fromiter((item_id in live_item_ids for item_id in item_ids), bool, len(item_ids))
+
+        matches = []
+        for column, cls in enumerate(classes):
+            candidates = valid & (row_classes == cls)
+            if not candidates.any():
+                matches.append(None)
+                continue
+            scores = np.where(candidates, similarities[:, column], -np.inf)
+            best = int(np.argmax(scores))
+            matches.append((item_ids[best], garments[best], float(scores[best])))
+        return matches
+
+
+class EmbeddingRebuild:
+    """A replacement embeddings file for a closet, written next to the live one.
+
+    For re-embedding every garment, e.g. with a new model whose vectors may
+    have another size: records go to ``<user_id>.emb.rebuild`` and commit()
+    swaps that in atomically, so the live file never mixes vector sizes. The
+    file outlives an interrupted run, so a resumed run keeps appending to
+    it; discard() starts over.
+    """
+
+    def __init__(self, index: EmbeddingIndex):
+        self.index = index
+        self.path = index.rebuild_path
+
+    def append(self, item_id: str, embeddings: Dict[str, np.ndarray]) -> None:
+        if embeddings:
+            _write_records(self.path, _records(item_id, embeddings))
+
+    def discard(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def commit(self) -> None:
+        """Replace the live file, keeping its rows of items the rebuild lacks.
+
+        Those are items added while the rebuild ran and items it could not
+        embed; with a different vector size their rows can't be kept, and
+        they are left to be embedded again. Items deleted while it ran stay
+        deleted.
+        """
+        with self.index.file_lock():
+            if not os.path.exists(self.path):
+                return
+            dim, rebuilt = _read_records(self.path)
+            try:
+                live_dim, live = _read_records(self.index.path)
+            except FileNotFoundError:
+                live_dim, live = None, np.zeros(0, dtype=_record_dtype(0))
+            if dim is None:
+                self.discard()
+                return
+            # Item ids are never reused, so a tombstoned item is gone for good
+            deleted = set(live['item_id'][live['garment'] == b''].tolist())
+            rebuilt_ids = set(rebuilt['item_id'].tolist())
+            keep = np.fromiter((item_id not in rebuilt_ids and item_id not in deleted
+                                for item_id in live['item_id'].tolist()), bool, len(live))
+            carried = np.zeros(0, dtype=_record_dtype(dim))
+            if keep.any() and live_dim != dim:
+                logger.warning(f"Dropping {int(keep.sum())} {live_dim}-d embeddings of user "
+                               f"{self.index.user_id} that the {dim}-d rebuild lacks")
+            elif keep.any():
+                carried = live[keep]
+            tombstones = np.zeros(len(deleted & rebuilt_ids), dtype=_record_dtype(dim))
+            tombstones['item_id'] = sorted(deleted & rebuilt_ids)
+            extra = np.concatenate([carried, tombstones])
+            if len(extra):
+                _write_records(self.path, extra)
+            os.replace(self.path, self.index.path)
+        self.index.refresh()
+        logger.info(f"Replaced embeddings of user {self.index.user_id} with a {dim}-d rebuild")
+
+
+# Most recently used last; bounded like the color index cache
+_indexes: Dict[str, EmbeddingIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_embedding_index(user_id: str) -> EmbeddingIndex:
+    with _indexes_lock:
+        index = _indexes.pop(user_id, None)
+        if index is None:
+            index = EmbeddingIndex(user_id)
+        _indexes[user_id] = index
+        while len(_indexes) > env.EMBEDDING_INDEX_CACHE_MAX_ITEMS:
+            _indexes.pop(next(iter(_indexes)))
+        return index
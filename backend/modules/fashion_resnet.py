@@ -6,7 +6,7 @@ import torch
 from torch import nn
 from torchvision.models import resnet
 import numpy as np
-from roi_pooling import (gated_roi_pooling,
+from modules.roi_pooling import (gated_roi_pooling,
                           adaptive_max_pool)
 
 class FashionResnet(nn.Module):
@@ -54,9 +54,7 @@ class FashionResnet(nn.Module):
         #bbox[:, 2] = bbox[:, 2] + bbox[:, 0]
         #bbox[:, 3] = bbox[:, 3] + bbox[:, 1]
     
-        batch_ids = torch.arange(0, bs).view(-1, bs).t().float()
-        if x.is_cuda:
-            batch_ids = batch_ids.cuda()
+        batch_ids = torch.arange(bs, device=x.device, dtype=bbox.dtype).unsqueeze(1)
         bbox_new = torch.cat((batch_ids, bbox), dim=1)
         bbox_new[:, 1:] = bbox_new[:, 1:] * (self.SPATIAL_DIM-1)
 
@@ -0,0 +1,113 @@
+import argparse
+import fcntl
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Set
+
+from config import env
+from modules.closet import Closet, list_closet_user_ids
+from modules.image_store import ImageStore, get_image_store
+
+logger = logging.getLogger(__name__)
+
+def referenced_keys() -> Set[str]:
+    keys = set()
+    for user_id in list_closet_user_ids():
+        closet = Closet(user_id)
+        for _, row in closet.df.iterrows():
+            keys |= Closet.referenced_keys(row.to_dict())
+    return keys
+
+
+class ImageReclaimer:
+    """Deletes derived images that no closet item references any more.
+
+    Files younger than IMAGE_GC_GRACE_SECONDS are never touched, since an
+    upload or bulk import may have written them but not yet recorded the item.
+    Deletes go out in batches of IMAGE_GC_BATCH_SIZE with a pause in between
+    so a large cleanup doesn't saturate the disk or the object store.
+    """
+
+    def __init__(self, store: Optional[ImageStore] = None):
+        self.store = store or get_image_store()
+
+    def run_once(self, dry_run: bool = False) -> Dict[str, int]:
+        started = time.time()
+        keys = referenced_keys()
+        cutoff = started - env.IMAGE_GC_GRACE_SECONDS
+
+        report = {'scanned_files': 0, 'orphaned_files': 0, 'deleted_files': 0, 'reclaimed_bytes': 0}
+        batch = []
+
+        for key, size, mtime in self.store.iter_objects():
+            report['scanned_files'] += 1
+            if os.path.normpath(key) in keys or mtime > cutoff:
+                continue
+            report['orphaned_files'] += 1
+            if dry_run:
+                report['reclaimed_bytes'] += size
+                continue
+            batch.append(key)
+            if len(batch) >= env.IMAGE_GC_BATCH_SIZE:
+                report['reclaimed_bytes'] += self.store.delete(batch)
+                report['deleted_files'] += len(batch)
+                batch = []
+                time.sleep(env.IMAGE_GC_BATCH_PAUSE_SECONDS)
+
+        if batch:
+            report['reclaimed_bytes'] += self.store.delete(batch)
+            report['deleted_files'] += len(batch)
+
+        logger.info(
+            f"Image GC {'dry run ' if dry_run else ''}finished in {time.time() - started:.1f}s: "
+            f"{report['orphaned_files']} orphaned of {report['scanned_files']} files, "
+            f"{report['reclaimed_bytes']} bytes {'reclaimable' if dry_run else 'reclaimed'}")
+        return report
+
+
+def _run_exclusively(reclaimer: ImageReclaimer) -> Optional[Dict[str, int]]:
+    # Only one worker process collects at a time
+    lock_path = os.path.join(env.DATA_DIR, 'image_gc.lock')
+    with open(lock_path, 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        try:
+            return reclaimer.run_once()
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def start_background_reclaimer() -> Optional[threading.Thread]:
+    if env.IMAGE_GC_INTERVAL_SECONDS <= 0:
+        return None
+
+    def loop():
+        reclaimer = ImageReclaimer()
+        while True:
+            time.sleep(env.IMAGE_GC_INTERVAL_SECONDS)
+            try:
+                _run_exclusively(reclaimer)
+            except Exception as e:
+                logger.error(f"Image GC failed: {str(e)}", exc_info=True)
+
+    thread = threading.Thread(target=loop, name='image-gc', daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reclaim derived images no closet item references")
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    report = ImageReclaimer().run_once(dry_run=args.dry_run)
+    print(report)
+
+
+if __name__ == '__main__':
+    main()
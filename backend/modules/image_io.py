@@ -0,0 +1,65 @@
+import io
+from typing import BinaryIO, Union
+
+from PIL import Image, UnidentifiedImageError
+
+from config import env
+
+ALLOWED_IMAGE_FORMATS = {'JPEG', 'PNG', 'WEBP', 'BMP', 'GIF', 'TIFF', 'MPO'}
+
+
+class ImageValidationError(ValueError):
+    pass
+
+
+def _buffer_size(buffer: BinaryIO) -> int:
+    buffer.seek(0, io.SEEK_END)
+    size = buffer.tell()
+    buffer.seek(0)
+    return size
+
+
+def decode_image(source: Union[bytes, BinaryIO]) -> Image.Image:
+    """Validate and decode an uploaded image exactly once.
+
+    Works straight off the (spooled) upload buffer, so nothing is copied to a
+    temp file. Byte size, format and dimensions are checked from the header
+    before any pixel data is decoded. Large JPEGs are downscaled by the decoder
+    itself (draft mode), everything else is capped after decoding, so the
+    returned RGB image is never larger than ``DECODE_MAX_DIMENSION``.
+    """
+    buffer = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+
+    size = _buffer_size(buffer)
+    if size == 0:
+        raise ImageValidationError("Empty upload")
+    if size > env.MAX_UPLOAD_BYTES:
+        raise ImageValidationError(f"Upload is {size} bytes, limit is {env.MAX_UPLOAD_BYTES}")
+
+    try:
+        # Image.open only parses the header; pixels are decoded on load()
+        image = Image.open(buffer)
+    except UnidentifiedImageError:
+        raise ImageValidationError("Unrecognized image format")
+
+    if image.format not in ALLOWED_IMAGE_FORMATS:
+        raise ImageValidationError(f"Unsupported image format: {image.format}")
+
+    width, height = image.size
+    if max(width, height) > env.MAX_IMAGE_DIMENSION:
+        raise ImageValidationError(
+            f"Image is {width}x{height}, limit is {env.MAX_IMAGE_DIMENSION} per side")
+
+    target = (env.DECODE_MAX_DIMENSION, env.DECODE_MAX_DIMENSION)
+    if image.format in ('JPEG', 'MPO'):
+        # Let libjpeg decode at 1/2, 1/4 or 1/8 scale instead of full size
+        image.draft('RGB', target)
+
+    try:
+        image = image.convert('RGB')
+    except (OSError, SyntaxError) as e:
+        raise ImageValidationError(f"Corrupt image data: {str(e)}")
+
+    if max(image.size) > env.DECODE_MAX_DIMENSION:
+        image.thumbnail(target, Image.BICUBIC)
+    return image
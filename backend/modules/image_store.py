@@ -0,0 +1,289 @@
+import hashlib
+import io
+import logging
+import os
+import shutil
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from PIL import Image, features
+
+from config import env
+from modules.signing import sign_image_key
+
+logger = logging.getLogger(__name__)
+
+# Longest side in pixels per rendition; None keeps the decoded size.
+RENDITIONS = {
+    'thumb': 256,
+    'medium': 768,
+    'full': None,
+}
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+CONTENT_TYPES = {
+    'webp': 'image/webp',
+    'avif': 'image/avif',
+    'png': 'image/png',
+    'rle': 'application/octet-stream',
+}
+# Cutout keys name images rendered on request from the original and label map;
+# nothing is stored under them.
+CUTOUT_SUFFIX = '.cutout'
+
+
+def output_format() -> str:
+    fmt = env.IMAGE_FORMAT.lower()
+    if fmt == 'avif' and not features.check('avif'):
+        logger.warning("AVIF encoding not available in this Pillow build, falling back to WebP")
+        return 'webp'
+    return fmt
+
+
+def encode_image(image: Image.Image, fmt: str) -> bytes:
+    buffer = io.BytesIO()
+    if fmt == 'png':
+        image.save(buffer, 'PNG', optimize=True)
+    elif fmt == 'avif':
+        image.save(buffer, 'AVIF', quality=env.IMAGE_QUALITY)
+    else:
+        # WebP keeps the alpha channel of RGBA cutouts
+        image.save(buffer, 'WEBP', quality=env.IMAGE_QUALITY, method=4)
+    return buffer.getvalue()
+
+
+class ImageStore:
+    """Write-once storage for derived images.
+
+    Keys look like ``<prefix>/<name>.<rendition>.<digest>.<ext>``. The digest is
+    taken from the encoded bytes, so a key never changes content and can be
+    cached forever by browsers and CDNs.
+    """
+
+    def put(self, key: str, data: bytes, content_type: str) -> None:
+        raise NotImplementedError
+
+    def get(self, key: str) -> bytes:
+        raise NotImplementedError
+
+    def delete_prefix(self, prefix: str) -> int:
+        """Delete every object under ``prefix`` and return the bytes reclaimed."""
+        raise NotImplementedError
+
+    def delete(self, keys: List[str]) -> int:
+        """Delete the given objects and return the bytes reclaimed."""
+        raise NotImplementedError
+
+    def iter_objects(self) -> Iterator[Tuple[str, int, float]]:
+        """Yield (key, size in bytes, modification time) for every stored object."""
+        raise NotImplementedError
+
+    def list_prefix(self, prefix: str) -> List[str]:
+        """Keys stored directly under ``prefix``."""
+        raise NotImplementedError
+
+    def url(self, key: str) -> str:
+        return f"{env.IMAGE_BASE_URL}{key}"
+
+    def save_bytes(self, prefix: str, stem: str, data: bytes, ext: str) -> str:
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        key = f"{prefix}/{stem}.{digest}.{ext}"
+        self.put(key, data, CONTENT_TYPES[ext])
+        return key
+
+    def save_image(self, prefix: str, name: str, image: Image.Image,
+                   fmt: Optional[str] = None, label: Optional[str] = None) -> str:
+        fmt = fmt or output_format()
+        stem = f"{name}.{label}" if label else name
+        return self.save_bytes(prefix, stem, encode_image(image, fmt), fmt)
+
+    def save_renditions(self, prefix: str, name: str, image: Image.Image) -> Dict[str, str]:
+        """Encode ``image`` once per rendition and return {rendition: key}."""
+        keys = {}
+        for rendition, max_side in RENDITIONS.items():
+            resized = image
+            if max_side is not None and max(image.size) > max_side:
+                resized = image.copy()
+                resized.thumbnail((max_side, max_side), Image.BICUBIC)
+            keys[rendition] = self.save_image(prefix, name, resized, label=rendition)
+        return keys
+
+
+class LocalImageStore(ImageStore):
+    def __init__(self, root: str = None):
+        self.root = root or env.IMAGES_DIR
+
+    def _path(self, key: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"Invalid image key: {key}")
+        return path
+
+    def put(self, key: str, data: bytes, content_type: str) -> None:
+        path = self._path(key)
+        if os.path.exists(path):
+            # Content-addressed: same key means same bytes
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, key: str) -> bytes:
+        with open(self._path(key), 'rb') as f:
+            return f.read()
+
+    def list_prefix(self, prefix: str) -> List[str]:
+        path = self._path(prefix)
+        if not os.path.isdir(path):
+            return []
+        return [f"{prefix}/{name}" for name in os.listdir(path)
+                if os.path.isfile(os.path.join(path, name))]
+
+    def url(self, key: str) -> str:
+        # Served by /static (or a reverse proxy in front of it), which only
+        # needs the signature to authorize the request
+        if env.IMAGE_URL_SIGNING:
+            return f"{env.IMAGE_BASE_URL}{sign_image_key(key)}"
+        return f"{env.IMAGE_BASE_URL}{key}"
+
+    def delete_prefix(self, prefix: str) -> int:
+        path = self._path(prefix)
+        if not os.path.isdir(path):
+            return 0
+        reclaimed = 0
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames:
+                try:
+                    reclaimed += os.path.getsize(os.path.join(dirpath, filename))
+                except OSError:
+                    pass
+        shutil.rmtree(path, ignore_errors=True)
+        return reclaimed
+
+    def delete(self, keys: List[str]) -> int:
+        reclaimed = 0
+        for key in keys:
+            path = self._path(key)
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                reclaimed += size
+            except FileNotFoundError:
+                continue
+            # Drop directories left empty, up to the store root
+            parent = os.path.dirname(path)
+            while parent != os.path.normpath(self.root):
+                try:
+                    os.rmdir(parent)
+                except OSError:
+                    break
+                parent = os.path.dirname(parent)
+        return reclaimed
+
+    def iter_objects(self) -> Iterator[Tuple[str, int, float]]:
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield os.path.relpath(path, self.root), stat.st_size, stat.st_mtime
+
+
+class S3ImageStore(ImageStore):
+    """S3-compatible object storage, e.g. a local MinIO container in development."""
+
+    def __init__(self):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("IMAGE_STORE=s3 requires boto3 to be installed")
+        self.bucket = env.S3_BUCKET
+        self.client = boto3.client(
+            's3',
+            endpoint_url=env.S3_ENDPOINT_URL or None,
+            aws_access_key_id=env.S3_ACCESS_KEY or None,
+            aws_secret_access_key=env.S3_SECRET_KEY or None,
+        )
+
+    def put(self, key: str, data: bytes, content_type: str) -> None:
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=key,
+            Body=data,
+            ContentType=content_type,
+            CacheControl=IMMUTABLE_CACHE_CONTROL,
+        )
+
+    def get(self, key: str) -> bytes:
+        return self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+
+    def delete_prefix(self, prefix: str) -> int:
+        reclaimed = 0
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{prefix}/"):
+            objects = page.get('Contents', [])
+            if not objects:
+                continue
+            reclaimed += sum(obj['Size'] for obj in objects)
+            self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={'Objects': [{'Key': obj['Key']} for obj in objects]},
+            )
+        return reclaimed
+
+    def delete(self, keys: List[str]) -> int:
+        reclaimed = 0
+        # DeleteObjects takes at most 1000 keys per call
+        for start in range(0, len(keys), 1000):
+            batch = keys[start:start + 1000]
+            for key in batch:
+                try:
+                    reclaimed += self.client.head_object(Bucket=self.bucket, Key=key)['ContentLength']
+                except self.client.exceptions.ClientError:
+                    continue
+            self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={'Objects': [{'Key': key} for key in batch]},
+            )
+        return reclaimed
+
+    def iter_objects(self) -> Iterator[Tuple[str, int, float]]:
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket):
+            for obj in page.get('Contents', []):
+                yield obj['Key'], obj['Size'], obj['LastModified'].timestamp()
+
+    def list_prefix(self, prefix: str) -> List[str]:
+        response = self.client.list_objects_v2(Bucket=self.bucket, Prefix=f"{prefix}/", Delimiter='/')
+        return [obj['Key'] for obj in response.get('Contents', [])]
+
+    def url(self, key: str) -> str:
+        if key.endswith(CUTOUT_SUFFIX):
+            # Rendered by the app's /static, not stored in the bucket
+            return f"{env.CUTOUT_BASE_URL}{sign_image_key(key)}"
+        if env.IMAGE_BASE_URL:
+            return f"{env.IMAGE_BASE_URL}{key}"
+        return f"{env.S3_ENDPOINT_URL.rstrip('/')}/{self.bucket}/{key}"
+
+
+_image_store: Optional[ImageStore] = None
+
+
+def get_image_store() -> ImageStore:
+    global _image_store
+    if _image_store is None:
+        if env.IMAGE_STORE == 's3':
+            _image_store = S3ImageStore()
+        else:
+            _image_store = LocalImageStore()
+    return _image_store
+
+
+def rendition_urls(renditions: Dict[str, Dict[str, str]]) -> Dict[str, Dict[str, str]]:
+    store = get_image_store()
+    return {
+        name: {rendition: store.url(key) for rendition, key in keys.items()}
+        for name, keys in renditions.items()
+    }
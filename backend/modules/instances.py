@@ -0,0 +1,61 @@
+from typing import List, Tuple
+
+import numpy as np
+from scipy import ndimage
+
+from config import env
+from modules.cutouts import NUM_CLASSES, instance_label
+
+# Instance labels have to fit the uint8 label map
+MAX_INSTANCES = (255 - (NUM_CLASSES - 1)) // NUM_CLASSES + 1
+EIGHT_CONNECTED = np.ones((3, 3), dtype=bool)
+GRID_FACTOR = 4
+
+
+def split_instances(class_map: np.ndarray) -> Tuple[np.ndarray, List[str]]:
+    """Split each class of a label map into separate garments.
+
+    Returns the instance label map (see ``instance_label``) and the cutout
+    names of the garments found, largest first within a class. A class with a
+    single garment keeps its plain ``masked_<cls>`` name. Components smaller
+    than INSTANCE_MIN_AREA_FRACTION of the image are treated as noise and
+    dropped; components within INSTANCE_JOIN_PIXELS of each other count as
+    one garment, so a sleeve cut off by an arm stays with its shirt.
+    """
+    min_area = env.INSTANCE_MIN_AREA_FRACTION * class_map.size
+    max_instances = min(env.INSTANCE_MAX_PER_CLASS, MAX_INSTANCES)
+    height, width = class_map.shape
+    # Components are found on every GRID_FACTOR-th pixel, ~16x less work for
+    # label() and the joining filter; the join distance also bridges the grid
+    join_cells = max(1, -(-env.INSTANCE_JOIN_PIXELS // GRID_FACTOR))
+    grid = class_map[::GRID_FACTOR, ::GRID_FACTOR]
+    instance_map = np.zeros(class_map.shape, dtype=np.uint8)
+    names = []
+
+    for cls in range(1, NUM_CLASSES):
+        sampled = grid == cls
+        if not sampled.any():
+            continue
+        cells = ndimage.maximum_filter(sampled, size=2 * join_cells + 1)
+        components, count = ndimage.label(cells, structure=EIGHT_CONNECTED)
+
+        areas = np.bincount(components[sampled], minlength=count + 1) * GRID_FACTOR ** 2
+        areas[0] = 0
+        keep = np.flatnonzero(areas >= min_area)
+        keep = keep[np.argsort(-areas[keep], kind='stable')][:max_instances]
+        if keep.size == 0:
+            continue
+
+        # One lookup maps every component id to its instance label (0 = dropped)
+        lookup = np.zeros(count + 1, dtype=np.uint8)
+        lookup[keep] = [instance_label(cls, n) for n in range(1, keep.size + 1)]
+        cell_labels = lookup[components]
+        pixel_labels = np.repeat(np.repeat(cell_labels, GRID_FACTOR, axis=0), GRID_FACTOR, axis=1)
+        instance_map += pixel_labels[:height, :width] * (class_map == cls)
+
+        if keep.size == 1:
+            names.append(f'masked_{cls}')
+        else:
+            names.extend(f'masked_{cls}_{n}' for n in range(1, keep.size + 1))
+
+    return instance_map, names
@@ -0,0 +1,242 @@
+import bisect
+import functools
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+# (labels, value) pairs a collector reports for one metric
+Samples = List[Tuple[Dict[str, str], float]]
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram, cheap enough for hot paths.
+
+    With ``labelnames``, observe through ``labels(...)``: every label
+    combination gets its own child histogram, created on first use.
+    """
+
+    def __init__(self, name: str, description: str, buckets: Sequence[float] = DEFAULT_BUCKETS,
+                 labelnames: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._children: Dict[Tuple[str, ...], 'Histogram'] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str) -> 'Histogram':
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(values, Histogram(self.name, self.description, self.buckets))
+        return child
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.bucket_counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def timed(self, fn: Callable) -> Callable:
+        """Decorator form of ``time()``."""
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.time():
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            cumulative = []
+            running = 0
+            for upper, count in zip(self.buckets + (float('inf'),), self.bucket_counts):
+                running += count
+                cumulative.append((upper, running))
+            return {'buckets': cumulative, 'sum': self.sum, 'count': self.count}
+
+    def children(self) -> Dict[Tuple[str, ...], 'Histogram']:
+        with self._lock:
+            return dict(self._children)
+
+
+class Gauge:
+    """A value that goes up and down, e.g. callers waiting on a lock."""
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.inc(-amount)
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    @contextmanager
+    def track(self):
+        """Count the caller in for the duration of the block."""
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+
+_histograms: Dict[str, Histogram] = {}
+_gauges: Dict[str, Gauge] = {}
+# name -> (type, description, fn returning the samples at scrape time)
+_collectors: Dict[str, Tuple[str, str, Callable[[], Samples]]] = {}
+_registry_lock = threading.Lock()
+
+
+def histogram(name: str, description: str, buckets: Sequence[float] = DEFAULT_BUCKETS,
+              labelnames: Sequence[str] = ()) -> Histogram:
+    """Get or create the process-wide histogram called ``name``."""
+    with _registry_lock:
+        if name not in _histograms:
+            _histograms[name] = Histogram(name, description, buckets, labelnames)
+        return _histograms[name]
+
+
+def all_histograms() -> Dict[str, Histogram]:
+    with _registry_lock:
+        return dict(_histograms)
+
+
+def gauge(name: str, description: str) -> Gauge:
+    """Get or create the process-wide gauge called ``name``."""
+    with _registry_lock:
+        if name not in _gauges:
+            _gauges[name] = Gauge(name, description)
+        return _gauges[name]
+
+
+def register_collector(name: str, metric_type: str, description: str, collect: Callable[[], Samples]) -> None:
+    """Report ``name`` by calling ``collect`` on every scrape rather than on every event.
+
+    For values that already exist somewhere (a queue's size, a cache's hit
+    counter), so the hot path pays nothing.
+    """
+    with _registry_lock:
+        _collectors[name] = (metric_type, description, collect)
+
+
+_caches: Dict[str, object] = {}
+
+
+def register_cache(name: str, cache) -> None:
+    """Export the hit/miss counters and size of a modules.cache cache."""
+    _caches[name] = cache
+
+
+def _cache_samples(field: str) -> Callable[[], Samples]:
+    def collect() -> Samples:
+        stats = {name: cache.stats() for name, cache in list(_caches.items())}
+        return [({'cache': name}, values[field]) for name, values in stats.items() if field in values]
+    return collect
+
+
+def resident_memory_bytes() -> Optional[int]:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        # Peak rather than current RSS: the best there is without /proc (KiB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == 'Darwin' else peak * 1024
+    except (OSError, AttributeError):
+        return None
+
+
+def _process_samples(value: Callable[[], Optional[float]]) -> Callable[[], Samples]:
+    def collect() -> Samples:
+        current = value()
+        return [] if current is None else [({}, current)]
+    return collect
+
+
+register_collector('cache_hits_total', 'counter', 'Cache lookups that found an entry', _cache_samples('hits'))
+register_collector('cache_misses_total', 'counter', 'Cache lookups that missed', _cache_samples('misses'))
+register_collector('cache_entries', 'gauge', 'Entries held by the cache', _cache_samples('items'))
+register_collector('cache_bytes', 'gauge', 'Bytes held by the cache', _cache_samples('bytes'))
+register_collector('process_resident_memory_bytes', 'gauge', 'Resident set size of this process',
+                   _process_samples(resident_memory_bytes))
+register_collector('process_cpu_seconds_total', 'counter', 'CPU time used by this process',
+                   _process_samples(time.process_time))
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _histogram_lines(hist: Histogram) -> Iterable[str]:
+    series = hist.children().items() if hist.labelnames else [((), hist)]
+    for values, child in series:
+        labels = dict(zip(hist.labelnames, values))
+        snapshot = child.snapshot()
+        for upper, count in snapshot['buckets']:
+            yield f"{hist.name}_bucket{_format_labels({**labels, 'le': _format_value(upper)})} {count}"
+        yield f"{hist.name}_sum{_format_labels(labels)} {_format_value(snapshot['sum'])}"
+        yield f"{hist.name}_count{_format_labels(labels)} {snapshot['count']}"
+
+
+def render_prometheus() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+    with _registry_lock:
+        histograms = list(_histograms.values())
+        gauges = list(_gauges.values())
+        collectors = list(_collectors.items())
+
+    lines = []
+    for hist in histograms:
+        lines += [f"# HELP {hist.name} {hist.description}", f"# TYPE {hist.name} histogram"]
+        lines.extend(_histogram_lines(hist))
+    for g in gauges:
+        lines += [f"# HELP {g.name} {g.description}", f"# TYPE {g.name} gauge", f"{g.name} {_format_value(g.value)}"]
+    for name, (metric_type, description, collect) in collectors:
+        samples = collect()
+        if not samples:
+            continue
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}"]
+        lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in samples)
+    return '\n'.join(lines) + '\n'
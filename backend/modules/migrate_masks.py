@@ -0,0 +1,108 @@
+import argparse
+import io
+import logging
+from typing import Any, Dict, Optional, Set, Tuple
+
+import numpy as np
+from PIL import Image
+
+from modules.closet import Closet, list_closet_user_ids, store_key
+from modules.cutouts import cutout_renditions, rle_encode
+from modules.image_store import ImageStore, get_image_store
+
+logger = logging.getLogger(__name__)
+
+MODEL_RESOLUTION = (768, 768)
+
+
+def needs_migration(item: Dict[str, Any]) -> bool:
+    return not str(item.get('clothes_mask', '')).endswith('.rle')
+
+
+def migrate_item(user_id: str, item: Dict[str, Any],
+                 store: ImageStore) -> Optional[Tuple[Dict[str, Any], Set[str]]]:
+    """Convert one item to a label map + on-demand cutouts.
+
+    Returns the updated row and the keys it no longer needs, or None if the
+    item is already migrated.
+    """
+    if not needs_migration(item):
+        return None
+
+    prefix = f"{user_id}/{item['id']}"
+    # Old masks are full-resolution palette PNGs whose indices are the classes
+    mask = Image.open(io.BytesIO(store.get(store_key(item['clothes_mask']))))
+    labels = np.array(mask.resize(MODEL_RESOLUTION, Image.NEAREST), dtype=np.uint8)
+    labels_key = store.save_bytes(prefix, 'labels', rle_encode(labels), 'rle')
+
+    original_renditions = item.get('renditions', {}).get('original')
+    if not original_renditions:
+        original = Image.open(io.BytesIO(store.get(store_key(item['image_path'])))).convert('RGB')
+        original_renditions = store.save_renditions(prefix, 'original', original)
+
+    renditions = {'original': original_renditions}
+    for name in item.get('masked_images', {}):
+        renditions[name] = cutout_renditions(prefix, name)
+    renditions['combined_masked'] = cutout_renditions(prefix, 'combined_masked')
+
+    migrated = dict(item)
+    migrated.update({
+        'image_path': original_renditions['full'],
+        'clothes_mask': labels_key,
+        'masked_images': {name: renditions[name]['full'] for name in item.get('masked_images', {})},
+        'combined_mask_image_path': renditions['combined_masked']['full'],
+        'renditions': renditions,
+    })
+    obsolete = Closet.referenced_keys(item) - Closet.referenced_keys(migrated)
+    return migrated, obsolete
+
+
+def migrate_closet(user_id: str, store: ImageStore, dry_run: bool = False) -> Dict[str, int]:
+    closet = Closet(user_id)
+    if dry_run:
+        # Converting an item writes its label map and renditions, so only count
+        return {'migrated': sum(needs_migration(item.to_dict()) for item in closet.get_all_items()),
+                'failed': 0, 'reclaimed_bytes': 0}
+    updates = []
+    obsolete: Set[str] = set()
+    failed = 0
+    for item in closet.get_all_items():
+        try:
+            result = migrate_item(user_id, item.to_dict(), store)
+        except Exception as e:
+            failed += 1
+            logger.error(f"Error migrating item {item.id} for user {user_id}: {str(e)}")
+            continue
+        if result is not None:
+            updates.append(result[0])
+            obsolete |= result[1]
+
+    reclaimed = 0
+    if updates:
+        closet.update_items(updates)
+        # Only drop the old files once the rows point at the new ones
+        reclaimed = store.delete(sorted(obsolete))
+    return {'migrated': len(updates), 'failed': failed, 'reclaimed_bytes': reclaimed}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replace stored masks and cutouts with RLE label maps and on-demand cutouts")
+    parser.add_argument('--user-id', help="Only migrate this user's closet")
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    store = get_image_store()
+    user_ids = [args.user_id] if args.user_id else list_closet_user_ids()
+    totals = {'migrated': 0, 'failed': 0, 'reclaimed_bytes': 0}
+    for user_id in user_ids:
+        report = migrate_closet(user_id, store, dry_run=args.dry_run)
+        logger.info(f"Closet {user_id}: {report}")
+        for key, value in report.items():
+            totals[key] += value
+    print(totals)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import math
+import threading
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import torch
+from PIL import Image
+
+# U2NET cloth segmentation: 768x768, bicubic, (x - 0.5) / 0.5
+SEGMENT_SIZE = 768
+SEGMENT_MEAN = (0.5, 0.5, 0.5)
+SEGMENT_STD = (0.5, 0.5, 0.5)
+# SigLIP image tower: 224x224, bicubic, (x - 0.5) / 0.5
+SIGLIP_SIZE = 224
+SIGLIP_MEAN = (0.5, 0.5, 0.5)
+SIGLIP_STD = (0.5, 0.5, 0.5)
+# FashionResnet (ImageNet-pretrained ResNet)
+ATTRIBUTE_SIZE = 224
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+def normalize_table(mean: Sequence[float], std: Sequence[float]) -> np.ndarray:
+    """(3, 256) float32 lookup from a uint8 channel value to its normalized value."""
+    # float32 throughout, so values match ToTensor() + Normalize() bit for bit
+    values = np.arange(256, dtype=np.float32) / np.float32(255)
+    return np.stack([(values - np.float32(m)) / np.float32(s) for m, s in zip(mean, std)])
+
+
+# Normalizing is one table lookup per channel instead of float math per pixel
+SEGMENT_TABLE = normalize_table(SEGMENT_MEAN, SEGMENT_STD)
+SIGLIP_TABLE = normalize_table(SIGLIP_MEAN, SIGLIP_STD)
+IMAGENET_TABLE = normalize_table(IMAGENET_MEAN, IMAGENET_STD)
+
+# Model input buffers are reused per thread, so steady-state preprocessing
+# allocates nothing. A returned tensor is only valid until the same thread
+# asks for that kind of input again.
+_buffers = threading.local()
+
+
+def _buffer(name: str, shape: Tuple[int, ...], dtype=np.float32) -> np.ndarray:
+    size = math.prod(shape)
+    buffer = getattr(_buffers, name, None)
+    if buffer is None or buffer.size < size or buffer.dtype != dtype:
+        buffer = np.empty(size, dtype=dtype)
+        setattr(_buffers, name, buffer)
+    return buffer[:size].reshape(shape)
+
+
+def normalize_into(out: np.ndarray, pixels: np.ndarray, table: np.ndarray) -> np.ndarray:
+    """Write (H, W, 3) uint8 ``pixels`` as normalized CHW float32 into ``out``."""
+    for channel in range(3):
+        np.take(table[channel], pixels[..., channel], out=out[channel])
+    return out
+
+
+def resize_rgb(image: Image.Image, size: int) -> np.ndarray:
+    """``image`` squashed to ``size`` x ``size`` (bicubic) as a uint8 RGB array."""
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return np.asarray(image.resize((size, size), Image.BICUBIC))
+
+
+def segment_inputs(images: List[Image.Image]) -> Tuple[List[np.ndarray], torch.Tensor]:
+    """Resized pixels and the (N, 3, 768, 768) segmentation batch for ``images``.
+
+    The pixels are kept because everything downstream (cutout classification,
+    colors) works on them, pixel-aligned with the label map.
+    """
+    batch = _buffer('segment', (len(images), 3, SEGMENT_SIZE, SEGMENT_SIZE))
+    pixels = []
+    for i, image in enumerate(images):
+        pixels.append(resize_rgb(image, SEGMENT_SIZE))
+        normalize_into(batch[i], pixels[-1], SEGMENT_TABLE)
+    return pixels, torch.from_numpy(batch)
+
+
+def cutout_inputs(pixels: np.ndarray, masks: Dict[str, np.ndarray], size: int = SIGLIP_SIZE,
+                  table: np.ndarray = SIGLIP_TABLE, background: int = 0, name: str = 'cutouts') -> torch.Tensor:
+    """(N, 3, size, size) batch of garment cutouts taken from one image's resized pixels.
+
+    ``masks`` are boolean and aligned with ``pixels``. The pixels are resized
+    and normalized once; each garment is then a blend of that with the
+    ``background`` value (0 matches a transparent cutout converted to RGB)
+    through its downscaled mask, so no full-resolution cutout is composed.
+    """
+    batch = _buffer(name, (len(masks), 3, size, size))
+    image = normalize_into(_buffer(f"{name}_image", (3, size, size)), resize_rgb(Image.fromarray(pixels), size), table)
+    fill = table[:, background, None, None]
+    alpha = _buffer(f"{name}_alpha", (len(masks), 1, size, size))
+    for i, mask in enumerate(masks.values()):
+        soft = Image.fromarray(mask.astype(np.uint8) * 255).resize((size, size), Image.BICUBIC)
+        np.multiply(np.asarray(soft), np.float32(1 / 255), out=alpha[i, 0])
+    # Normalizing is affine, so blending normalized values equals normalizing the blend
+    np.multiply(image - fill, alpha, out=batch)
+    batch += fill
+    return torch.from_numpy(batch)
+
+
+def image_inputs(images: List[Image.Image], size: int = SIGLIP_SIZE, table: np.ndarray = SIGLIP_TABLE,
+                 name: str = 'images') -> torch.Tensor:
+    """(N, 3, size, size) batch of whole images, e.g. cutouts that are already composed."""
+    batch = _buffer(name, (len(images), 3, size, size))
+    for i, image in enumerate(images):
+        normalize_into(batch[i], resize_rgb(image, size), table)
+    return torch.from_numpy(batch)
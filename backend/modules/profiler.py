@@ -0,0 +1,91 @@
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from config import env
+
+
+class StackSampler:
+    """Samples Python stacks on a background thread while a request (or a window) runs.
+
+    Output is in the folded format ``outer;inner;leaf <count>`` that
+    flamegraph.pl, speedscope and inferno read directly. With
+    ``all_threads=False`` only the threads spans report through
+    ``add_thread`` are sampled, i.e. the threads working on one request.
+    """
+
+    def __init__(self, name: str, interval: Optional[float] = None, all_threads: bool = False):
+        self.name = name
+        self.interval = interval or env.PROFILE_INTERVAL_SECONDS
+        self.all_threads = all_threads
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._threads: Counter = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_thread(self, thread_id: int) -> None:
+        with self._lock:
+            self._threads[thread_id] += 1
+
+    def remove_thread(self, thread_id: int) -> None:
+        with self._lock:
+            self._threads[thread_id] -= 1
+            if self._threads[thread_id] <= 0:
+                del self._threads[thread_id]
+
+    def start(self) -> 'StackSampler':
+        self._thread = threading.Thread(target=self._run, name=f"profiler-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + env.PROFILE_MAX_SECONDS
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            with self._lock:
+                wanted = None if self.all_threads else set(self._threads)
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (wanted is not None and thread_id not in wanted):
+                    continue
+                self.stacks[_fold(frame)] += 1
+            self.samples += 1
+
+    def output_path(self, filename: str) -> str:
+        directory = os.path.join(env.PROFILE_DIR, self.name)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, filename)
+
+    def folded(self) -> str:
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def write(self) -> str:
+        """Write the folded stacks to PROFILE_DIR/<name>/stacks.folded and return the path."""
+        path = self.output_path('stacks.folded')
+        with open(path, 'w') as f:
+            f.write(self.folded())
+        return path
+
+
+def _fold(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def profile_authorized(token: Optional[str]) -> bool:
+    """Profiling is off unless PROFILE_TOKEN is set, and then needs that token."""
+    return bool(env.PROFILE_TOKEN) and token is not None and hmac.compare_digest(token, env.PROFILE_TOKEN)
@@ -0,0 +1,255 @@
+import argparse
+import hashlib
+import logging
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from typing import Any, Dict, Iterable, List, Set
+
+import numpy as np
+import torch
+
+from config import env
+from modules.classify import (MODEL_NAME, SAVED_EMBEDDINGS_PATH, STYLES_PATH, classify_and_embed_inputs,
+                              load_labels, score_embeddings, top_labels)
+from modules.closet import Closet, list_closet_user_ids, store_key
+from modules.cutouts import class_mask, load_sources
+from modules.embeddings import EmbeddingIndex, EmbeddingRebuild
+from modules.image_store import ImageStore, get_image_store
+from modules.preprocess import SEGMENT_SIZE, cutout_inputs, resize_rgb
+from modules.runtime import configure_torch_runtime
+from modules.scheduler import BACKGROUND, inference_slot
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 256
+
+
+def label_fingerprint(reembed: bool = False) -> str:
+    """Identifies the label set, its text features and the model a run scores against."""
+    digest = hashlib.sha256(MODEL_NAME.encode())
+    for path in (STYLES_PATH, SAVED_EMBEDDINGS_PATH):
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    digest.update(b'reembed' if reembed else b'rescore')
+    return digest.hexdigest()[:16]
+
+
+class Checkpoint:
+    """Progress of one run, so an interrupted run picks up where it stopped.
+
+    Lives in ``DATA_DIR/reclassify/<fingerprint>/``: ``<user_id>.done`` lists
+    the ids of items already written back, one per line, and
+    ``<user_id>.complete`` marks a finished closet. A changed taxonomy or
+    model gets a new fingerprint, and so starts over.
+    """
+
+    def __init__(self, fingerprint: str):
+        self.directory = os.path.join(env.DATA_DIR, 'reclassify', fingerprint)
+
+    def reset(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def is_complete(self, user_id: str) -> bool:
+        return os.path.exists(os.path.join(self.directory, f"{user_id}.complete"))
+
+    def mark_complete(self, user_id: str) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        open(os.path.join(self.directory, f"{user_id}.complete"), 'w').close()
+
+    def done_items(self, user_id: str) -> Set[str]:
+        try:
+            with open(os.path.join(self.directory, f"{user_id}.done")) as f:
+                return {line.strip() for line in f if line.strip()}
+        except FileNotFoundError:
+            return set()
+
+    def mark_done(self, user_id: str, item_ids: Iterable[str]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, f"{user_id}.done"), 'a') as f:
+            f.write(''.join(f"{item_id}\n" for item_id in item_ids))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _chunks(items: List[Any], size: int) -> Iterable[List[Any]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def embed_items(user_id: str, items: List[Dict[str, Any]], store: ImageStore,
+                report: Dict[str, int]) -> Dict[str, Dict[str, np.ndarray]]:
+    """Re-run SigLIP on the garments of ``items``, cut from their stored originals and label maps.
+
+    Returns item id -> garment -> embedding; items whose sources can't be
+    read are counted as failed and left out.
+    """
+    inputs, keys = [], []
+    for item in items:
+        try:
+            original, labels = load_sources(os.path.dirname(store_key(item['clothes_mask'])), store)
+            # The label map is at model resolution, aligned with the resized original
+            pixels = resize_rgb(original, SEGMENT_SIZE)
+            masks = {name: class_mask(labels, name) for name in item['masked_images']}
+            # cutout_inputs reuses its buffer, so each item's batch is copied out
+            inputs.append(cutout_inputs(pixels, masks).clone())
+            keys.extend((item['id'], name) for name in masks)
+        except Exception as e:
+            report['failed'] += 1
+            logger.error(f"Error reading sources of item {item['id']} for user {user_id}: {str(e)}")
+    embedded: Dict[str, Dict[str, np.ndarray]] = {}
+    if not keys:
+        return embedded
+    # Offline work: waits behind anything interactive when run inside the server
+    with inference_slot(user_id, BACKGROUND, shed=False):
+        _, embeddings = classify_and_embed_inputs(torch.cat(inputs))
+    for (item_id, name), vector in zip(keys, embeddings):
+        embedded.setdefault(item_id, {})[name] = vector
+    return embedded
+
+
+def reclassify_closet(user_id: str, checkpoint: Checkpoint, batch_size: int = DEFAULT_BATCH_SIZE,
+                      reembed: bool = False, dry_run: bool = False) -> Dict[str, int]:
+    """Re-score every garment of a closet against the current labels and write changed rows back.
+
+    Garments with a stored embedding are scored from it; the rest (or all,
+    with ``reembed``) are embedded again from their stored sources first.
+    When every garment is embedded again (``reembed``, or stored embeddings
+    of another size than the labels'), the new embeddings go to an
+    EmbeddingRebuild that replaces the closet's file once the closet is done.
+    """
+    report = {'items': 0, 'rescored': 0, 'reembedded': 0, 'changed': 0, 'failed': 0}
+    closet = Closet(user_id)
+    store = get_image_store()
+    done = checkpoint.done_items(user_id)
+    items = [item.to_dict() for item in closet.get_all_items() if item.id not in done]
+
+    _, text_features = load_labels()
+    dim = next(iter(text_features.values())).shape[1]
+    index = EmbeddingIndex(user_id)
+    stored: Dict[tuple, np.ndarray] = {}
+    rebuild = None
+    index.refresh()
+    if index.dim is not None and index.dim != dim:
+        logger.warning(f"Stored embeddings of {user_id} are {index.dim}-d, the labels {dim}-d: re-embedding")
+        rebuild = EmbeddingRebuild(index)
+    elif reembed:
+        rebuild = EmbeddingRebuild(index)
+    else:
+        keys, vectors, _ = index.rows_since(0, active_only=True)
+        stored = dict(zip(keys, vectors))
+    if rebuild is not None and not done and not dry_run:
+        # Left over from a run whose checkpoint was reset
+        rebuild.discard()
+
+    for batch in _chunks(items, batch_size):
+        vectors: Dict[str, Dict[str, np.ndarray]] = {}
+        missing = []
+        for item in batch:
+            garments = list(item['masked_images'])
+            if all((item['id'], name) in stored for name in garments):
+                vectors[item['id']] = {name: stored[(item['id'], name)] for name in garments}
+            else:
+                missing.append(item)
+        report['rescored'] += sum(len(garments) for garments in vectors.values())
+
+        embedded = embed_items(user_id, missing, store, report) if missing else {}
+        if embedded and not dry_run:
+            for item_id, garments in embedded.items():
+                if rebuild is not None:
+                    rebuild.append(item_id, garments)
+                else:
+                    # Later records win, so the next run can score these without the model
+                    index.append(item_id, garments)
+        report['reembedded'] += sum(len(garments) for garments in embedded.values())
+        vectors.update(embedded)
+
+        keys = [(item_id, name) for item_id, garments in vectors.items() for name in garments]
+        if keys:
+            scores = score_embeddings(np.stack([vectors[item_id][name] for item_id, name in keys]))
+        else:
+            scores = []
+        labels: Dict[str, Dict[str, Any]] = {}
+        for (item_id, name), result in zip(keys, scores):
+            labels.setdefault(item_id, {})[name] = top_labels(result)
+
+        updates = []
+        for item in batch:
+            if item['id'] in labels and labels[item['id']] != item['classification_results']:
+                updates.append(dict(item, classification_results=labels[item['id']]))
+        report['items'] += len(vectors) + sum(1 for item in batch if not item['masked_images'])
+        report['changed'] += len(updates)
+        if dry_run:
+            continue
+        if updates:
+            # One journal append per batch rather than a snapshot rewrite per item
+            closet.update_items(updates)
+        checkpoint.mark_done(user_id, [item['id'] for item in batch
+                                       if item['id'] in vectors or not item['masked_images']])
+
+    if dry_run:
+        return report
+    if rebuild is not None:
+        # Items that failed keep their old rows if they still fit, for the next run to retry
+        rebuild.commit()
+    if not report['failed']:
+        checkpoint.mark_complete(user_id)
+    return report
+
+
+def _init_worker(workers: int) -> None:
+    logging.basicConfig(level=logging.INFO)
+    # Split the CPUs between the job's processes the way the server splits them between workers
+    env.WEB_CONCURRENCY = workers
+    configure_torch_runtime()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Re-score stored items after the style taxonomy, its text embeddings or the model change")
+    parser.add_argument('--user-id', help="Only reclassify this user's closet")
+    parser.add_argument('--workers', type=int, default=1, help="closets processed in parallel, one process each")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help="items scored and written back per closet update")
+    parser.add_argument('--reembed', action='store_true',
+                        help="run the vision model on every garment instead of reusing stored embeddings "
+                             "(needed after a model change)")
+    parser.add_argument('--restart', action='store_true', help="ignore the checkpoint of an earlier run")
+    parser.add_argument('--dry-run', action='store_true', help="count what would change without writing")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    checkpoint = Checkpoint(label_fingerprint(args.reembed))
+    if args.restart:
+        checkpoint.reset()
+    user_ids = [args.user_id] if args.user_id else list_closet_user_ids()
+    pending = [user_id for user_id in user_ids if not checkpoint.is_complete(user_id)]
+    logger.info(f"Reclassifying {len(pending)} closets ({len(user_ids) - len(pending)} already done), "
+                f"checkpoint in {checkpoint.directory}")
+
+    totals = {'closets': 0, 'items': 0, 'rescored': 0, 'reembedded': 0, 'changed': 0, 'failed': 0}
+    workers = max(1, min(args.workers, len(pending)))
+    # Spawned, not forked: torch's thread pools don't survive a fork
+    with ProcessPoolExecutor(workers, mp_context=get_context('spawn'), initializer=_init_worker,
+                             initargs=(workers,)) as pool:
+        futures = {pool.submit(reclassify_closet, user_id, checkpoint, args.batch_size, args.reembed,
+                               args.dry_run): user_id for user_id in pending}
+        for future in as_completed(futures):
+            user_id = futures[future]
+            try:
+                report = future.result()
+            except Exception as e:
+                logger.error(f"Error reclassifying closet {user_id}: {str(e)}")
+                totals['failed'] += 1
+                continue
+            logger.info(f"Closet {user_id}: {report}")
+            totals['closets'] += 1
+            for key, value in report.items():
+                totals[key] += value
+    logger.info(f"Reclassified {totals['closets']} closets: {totals}")
+
+
+if __name__ == '__main__':
+    main()
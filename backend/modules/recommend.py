@@ -0,0 +1,298 @@
+import ast
+import logging
+import threading
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import env
+from modules.cutouts import garment_class
+from modules.closet import cached_closet
+from modules.embeddings import get_embedding_index
+from modules.wear_log import get_wear_log
+
+logger = logging.getLogger(__name__)
+
+# Segmenter classes
+UPPER_BODY, LOWER_BODY, FULL_BODY = 1, 2, 3
+# Labels that describe what a garment is rather than its style; tops and
+# bottoms never agree on these, so they carry no compatibility signal
+IGNORED_LABEL_TYPES = {'category', 'subcategory'}
+# Embedded garments whose closet row hasn't shown up are retried for a while;
+# rows of items dropped as duplicates never show up
+MAX_PENDING = 1000
+# Share of indexed garments from deleted items that triggers a rebuild
+MAX_DEAD_FRACTION = 0.25
+
+
+class CompatibilityIndex:
+    """Precomputed top/bottom compatibility for one closet.
+
+    Compatibility of an upper and a lower garment is the cosine similarity of
+    their SigLIP embeddings plus RECOMMEND_LABEL_WEIGHT times the share of
+    style labels they agree on. The full upper x lower score matrix is kept
+    and only extended by the rows/columns of garments embedded since the last
+    update; each upper garment also keeps its RECOMMEND_TOP_K best lowers, so
+    a recommendation only has to rescore U * K candidate pairs.
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.embedding_index = get_embedding_index(user_id)
+        self._lock = threading.Lock()
+        self._labels_version = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self._seen = 0
+        self._generation = self.embedding_index.generation
+        self._rebuild = False
+        self._pending_keys: List[Tuple[str, str]] = []
+        self._pending_vectors = np.zeros((0, 0), dtype=np.float32)
+        self._slots: Dict[Tuple[str, str], Tuple[int, int]] = {}
+        self._keys: Dict[int, List[Tuple[str, str]]] = {cls: [] for cls in (UPPER_BODY, LOWER_BODY, FULL_BODY)}
+        self._vectors: Dict[int, Optional[np.ndarray]] = {UPPER_BODY: None, LOWER_BODY: None}
+        self._labels: Dict[int, List[Dict[str, str]]] = {UPPER_BODY: [], LOWER_BODY: []}
+        self._compat = np.zeros((0, 0), dtype=np.float32)
+        self._top_lowers = np.zeros((0, 0), dtype=np.int64)
+        self._top_scores = np.zeros((0, 0), dtype=np.float32)
+
+    def update(self, closet_df: pd.DataFrame, labels_version=None) -> None:
+        """Fold in garments embedded since the last update.
+
+        ``labels_version`` is the closet's Closet.labels_version(); when it
+        changes, rows may have new labels and the scores are rebuilt.
+        """
+        with self._lock:
+            keys, vectors, end = self.embedding_index.rows_since(self._seen)
+            relabeled = self._labels_version is not None and labels_version != self._labels_version
+            self._labels_version = labels_version
+            if (self._rebuild or relabeled or self.embedding_index.generation != self._generation
+                    or any(key in self._slots for key in keys) or len(set(keys)) < len(keys)):
+                # A garment was re-embedded or re-labeled (its old scores are
+                # stale everywhere), many items were deleted or the embeddings
+                # file was compacted: start over from the live rows
+                logger.info(f"Rebuilding compatibility index for user {self.user_id}")
+                self._reset()
+                keys, vectors, end = self.embedding_index.rows_since(0, active_only=True)
+            self._seen = end
+
+            # Embeddings are written just before their closet row, so rows of
+            # items not in the closet yet wait for a later update
+            if self._pending_keys:
+                keys = self._pending_keys + keys
+                vectors = np.concatenate([self._pending_vectors, vectors]) if len(vectors) else self._pending_vectors
+            if not keys:
+                return
+            live_item_ids = set(closet_df['id'])
+            ready = np.array([item_id in live_item_ids for item_id, _ in keys], dtype=bool)
+            waiting = np.flatnonzero(~ready)[-MAX_PENDING:]
+            self._pending_keys = [keys[row] for row in waiting]
+            self._pending_vectors = vectors[waiting]
+            if ready.any():
+                rows = np.flatnonzero(ready)
+                ready_keys = [keys[row] for row in rows]
+                self._add(ready_keys, vectors[rows],
+                          self._garment_labels(closet_df, {item_id for item_id, _ in ready_keys}))
+
+    def _garment_labels(self, closet_df: pd.DataFrame, item_ids: set) -> Dict[Tuple[str, str], Dict[str, str]]:
+        labels = {}
+        for _, row in closet_df[closet_df['id'].isin(item_ids)].iterrows():
+            results = row['classification_results']
+            if isinstance(results, str):
+                results = ast.literal_eval(results)
+            for garment, garment_labels in (results or {}).items():
+                labels[(row['id'], garment)] = {
+                    label_type: value for label_type, value in garment_labels.items()
+                    if value is not None and label_type not in IGNORED_LABEL_TYPES
+                }
+        return labels
+
+    def _add(self, keys, vectors: np.ndarray, labels) -> None:
+        new = {UPPER_BODY: [], LOWER_BODY: []}
+        for row, key in enumerate(keys):
+            cls = garment_class(key[1])
+            self._slots[key] = (cls, len(self._keys[cls]))
+            self._keys[cls].append(key)
+            if cls in new:
+                new[cls].append(row)
+                self._labels[cls].append(labels.get(key, {}))
+
+        old_uppers = 0 if self._vectors[UPPER_BODY] is None else len(self._vectors[UPPER_BODY])
+        old_lowers = 0 if self._vectors[LOWER_BODY] is None else len(self._vectors[LOWER_BODY])
+        for cls in new:
+            if new[cls]:
+                parts = [] if self._vectors[cls] is None else [self._vectors[cls]]
+                self._vectors[cls] = np.concatenate(parts + [vectors[new[cls]]])
+        if self._vectors[UPPER_BODY] is None or self._vectors[LOWER_BODY] is None:
+            return
+
+        # Extend the score matrix: rows for new uppers against old lowers, then
+        # columns for new lowers against every upper
+        compat = self._compat.reshape(old_uppers, old_lowers)
+        if len(self._vectors[UPPER_BODY]) > old_uppers:
+            compat = np.vstack([compat, self._scores(slice(old_uppers, None), slice(0, old_lowers))])
+        if len(self._vectors[LOWER_BODY]) > old_lowers:
+            compat = np.hstack([compat, self._scores(slice(0, None), slice(old_lowers, None))])
+        self._compat = compat
+        self._update_top_lowers(old_lowers)
+
+    def _scores(self, uppers: slice, lowers: slice) -> np.ndarray:
+        scores = self._vectors[UPPER_BODY][uppers] @ self._vectors[LOWER_BODY][lowers].T
+        upper_labels = self._labels[UPPER_BODY][uppers]
+        lower_labels = self._labels[LOWER_BODY][lowers]
+        if not any(upper_labels) or not any(lower_labels):
+            return scores
+
+        # Label agreement as two multi-hot products: matching (type, value)
+        # pairs over label types both garments have
+        vocabulary: Dict[Any, int] = {}
+        types: Dict[str, int] = {}
+        for garment_labels in upper_labels + lower_labels:
+            for label_type, value in garment_labels.items():
+                vocabulary.setdefault((label_type, value), len(vocabulary))
+                types.setdefault(label_type, len(types))
+
+        def encode(garments):
+            values = np.zeros((len(garments), len(vocabulary)), dtype=np.float32)
+            present = np.zeros((len(garments), len(types)), dtype=np.float32)
+            for row, garment_labels in enumerate(garments):
+                for label_type, value in garment_labels.items():
+                    values[row, vocabulary[(label_type, value)]] = 1
+                    present[row, types[label_type]] = 1
+            return values, present
+
+        upper_values, upper_types = encode(upper_labels)
+        lower_values, lower_types = encode(lower_labels)
+        agreement = (upper_values @ lower_values.T) / np.maximum(upper_types @ lower_types.T, 1)
+        return scores + env.RECOMMEND_LABEL_WEIGHT * agreement
+
+    def _update_top_lowers(self, old_lowers: int) -> None:
+        num_uppers, num_lowers = self._compat.shape
+        k = min(env.RECOMMEND_TOP_K, num_lowers)
+        known = len(self._top_lowers)
+        lowers, scores = [], []
+        if known:
+            # A kept list only competes with the lowers added since it was made
+            new_columns = np.broadcast_to(np.arange(old_lowers, num_lowers), (known, num_lowers - old_lowers))
+            top = self._top_k(np.hstack([self._top_lowers, new_columns]), k, 0)
+            lowers.append(top[0])
+            scores.append(top[1])
+        if num_uppers > known:
+            top = self._top_k(np.broadcast_to(np.arange(num_lowers), (num_uppers - known, num_lowers)), k, known)
+            lowers.append(top[0])
+            scores.append(top[1])
+        self._top_lowers = np.vstack(lowers)
+        self._top_scores = np.vstack(scores)
+
+    def _top_k(self, candidates: np.ndarray, k: int, row_offset: int) -> Tuple[np.ndarray, np.ndarray]:
+        rows = np.arange(row_offset, row_offset + len(candidates))[:, None]
+        scores = self._compat[rows, candidates]
+        if candidates.shape[1] <= k:
+            return np.array(candidates), scores
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        return np.take_along_axis(candidates, best, axis=1), np.take_along_axis(scores, best, axis=1)
+
+    def recommend(self, closet_df: pd.DataFrame, wear_stats: Dict[str, Dict[str, Any]],
+                  limit: int = 10, labels_version=None) -> List[Dict[str, Any]]:
+        """Best outfits for today: compatible pairs plus full-body garments.
+
+        Each garment's compatibility is adjusted by how often it is worn
+        (favorites) and how long ago it was last worn (novelty).
+        """
+        self.update(closet_df, labels_version)
+        live_item_ids = set(closet_df['id'])
+        with self._lock:
+            outfits = []
+            upper_weights = self._wear_weights(self._keys[UPPER_BODY], wear_stats, live_item_ids)
+            lower_weights = self._wear_weights(self._keys[LOWER_BODY], wear_stats, live_item_ids)
+            if len(self._top_lowers):
+                scores = self._top_scores + (upper_weights[:, None] + lower_weights[self._top_lowers]) / 2
+                candidates = min(scores.size, limit * env.RECOMMEND_TOP_K)
+                flat = np.argpartition(-scores.ravel(), candidates - 1)[:candidates]
+                for index in flat[np.argsort(-scores.ravel()[flat])]:
+                    upper, column = divmod(int(index), scores.shape[1])
+                    lower = int(self._top_lowers[upper, column])
+                    if not np.isfinite(scores[upper, column]):
+                        break
+                    outfits.append({
+                        'garments': [self._garment(UPPER_BODY, upper), self._garment(LOWER_BODY, lower)],
+                        'compatibility': round(float(self._top_scores[upper, column]), 4),
+                        'score': round(float(scores[upper, column]), 4),
+                    })
+
+            full_body_weights = self._wear_weights(self._keys[FULL_BODY], wear_stats, live_item_ids)
+            for position in np.flatnonzero(np.isfinite(full_body_weights)):
+                outfits.append({
+                    'garments': [self._garment(FULL_BODY, int(position))],
+                    'compatibility': env.RECOMMEND_FULL_BODY_COMPAT,
+                    'score': round(float(env.RECOMMEND_FULL_BODY_COMPAT + full_body_weights[position]), 4),
+                })
+
+            dead = sum(item_id not in live_item_ids for item_id, _ in self._slots)
+            if self._slots and dead > MAX_DEAD_FRACTION * len(self._slots):
+                self._rebuild = True
+
+        outfits.sort(key=lambda outfit: -outfit['score'])
+        # Don't fill the list with one favorite shirt
+        picked, uses = [], {}
+        for outfit in outfits:
+            item_ids = [garment['id'] for garment in outfit['garments']]
+            if any(uses.get(item_id, 0) >= env.RECOMMEND_MAX_ITEM_REPEATS for item_id in item_ids):
+                continue
+            for item_id in item_ids:
+                uses[item_id] = uses.get(item_id, 0) + 1
+            picked.append(outfit)
+            if len(picked) >= limit:
+                break
+        return picked
+
+    def _garment(self, cls: int, position: int) -> Dict[str, str]:
+        item_id, garment = self._keys[cls][position]
+        return {'id': item_id, 'garment': garment}
+
+    def _wear_weights(self, keys, wear_stats, live_item_ids: set) -> np.ndarray:
+        """Per-garment score bonus; -inf for garments of deleted items."""
+        today = date.today()
+        max_count = max((stats['count'] for stats in wear_stats.values()), default=0)
+        weights = np.empty(len(keys), dtype=np.float32)
+        for position, (item_id, _) in enumerate(keys):
+            if item_id not in live_item_ids:
+                weights[position] = -np.inf
+                continue
+            stats = wear_stats.get(item_id)
+            frequency = np.log1p(stats['count']) / np.log1p(max_count) if stats and max_count else 0.0
+            novelty = 1.0
+            if stats and stats.get('last_worn'):
+                days = (today - date.fromisoformat(stats['last_worn'])).days
+                novelty = min(max(days, 0), env.RECOMMEND_NOVELTY_DAYS) / env.RECOMMEND_NOVELTY_DAYS
+            weights[position] = env.RECOMMEND_WEAR_WEIGHT * frequency + env.RECOMMEND_NOVELTY_WEIGHT * novelty
+        return weights
+
+
+# Most recently used last; each holds a dense uppers x lowers matrix, so
+# bounded like the color index cache
+_indexes: Dict[str, CompatibilityIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_compatibility_index(user_id: str) -> CompatibilityIndex:
+    with _indexes_lock:
+        index = _indexes.pop(user_id, None)
+        if index is None:
+            index = CompatibilityIndex(user_id)
+        _indexes[user_id] = index
+        while len(_indexes) > env.RECOMMEND_INDEX_CACHE_MAX_ITEMS:
+            _indexes.pop(next(iter(_indexes)))
+        return index
+
+
+def recommend_outfits(user_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+    closet = cached_closet(user_id)
+    # Read before the frame: a refresh in between only causes an extra rebuild
+    labels_version = closet.labels_version()
+    wear_stats = get_wear_log(user_id).summary()
+    return get_compatibility_index(user_id).recommend(closet.df, wear_stats, limit=limit,
+                                                      labels_version=labels_version)
@@ -24,6 +24,8 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+from functools import lru_cache
+
 import torch
 from torch.nn import AdaptiveMaxPool2d
 
@@ -38,26 +40,61 @@ def gated_roi_pooling(input, rois, size=ROI_POOL_SIZE):
     :param size: size of the pooled regions (for instance (3,3)
     :param spatial_scale:
     :return:
+
+    All ROIs are pooled at once, with the same integer ROI bounds and adaptive
+    bin edges as slicing each ROI and running AdaptiveMaxPool2d on it, so the
+    results are identical to pooling one ROI at a time.
     """
     assert (rois.dim() == 2)
     assert (rois.size(1) == 5)
-    output = []
-    #rois = rois.data.float()
-    num_rois = rois.size(0)
+    height, width = input.shape[-2:]
 
-    #rois[:, 1:].mul_(spatial_scale)
     rois = rois.long()
-    for i in range(num_rois):
-        roi = rois[i]
-        im_idx = roi[0]
-        #im = input.narrow(0, im_idx, 1)[..., roi[2]:(roi[4] + 1), roi[1]:(roi[3] + 1)]
-        im = input[im_idx][..., roi[2]:(roi[4] + 1), roi[1]:(roi[3] + 1)]
-        mp = adaptive_max_pool(im, size)[0]
-        output.append(mp)
+    batch_idx = rois[:, 0]
+    # Inclusive integer bounds, clipped to the map like tensor slicing does
+    x1 = rois[:, 1].clamp(0, width)
+    y1 = rois[:, 2].clamp(0, height)
+    x2 = (rois[:, 3] + 1).clamp(max=width)
+    y2 = (rois[:, 4] + 1).clamp(max=height)
+    if bool(((x2 <= x1) | (y2 <= y1)).any()):
+        raise ValueError("gated_roi_pooling got an empty ROI")
+    if len(rois) == 1:
+        # Not worth the index bookkeeping for a lone ROI
+        im = input[batch_idx[0], :, y1[0]:y2[0], x1[0]:x2[0]]
+        return adaptive_max_pool(im, size)[0].reshape(input.shape[0], -1, ROI_POOL_SIZE[0], ROI_POOL_SIZE[1])
+
+    # Each bin is read as a fixed number of cells (clamped into the bin; a
+    # repeated cell doesn't change a max) and reduced, first along x, then
+    # along y. Indexing a channels-last view reads each cell's channels in one
+    # go, which is much cheaper here than torch.gather on NCHW.
+    num_rois, channels = len(rois), input.shape[1]
+    features = input.permute(0, 2, 3, 1)
+    col_idx = _bin_indices(x1, x2 - x1, size[1], width)
+    row_idx = _bin_indices(y1, y2 - y1, size[0], height)
+
+    rows = torch.arange(height, device=input.device)
+    cols = features[batch_idx[:, None, None], rows[None, :, None], col_idx[:, None, :]]
+    cols = cols.reshape(num_rois, height, size[1], -1, channels).amax(dim=3)
+    pooled = cols[torch.arange(num_rois, device=input.device)[:, None], row_idx]
+    pooled = pooled.reshape(num_rois, size[0], -1, size[1], channels).amax(dim=2)
+
+    return pooled.permute(0, 3, 1, 2).reshape(input.shape[0], -1, ROI_POOL_SIZE[0], ROI_POOL_SIZE[1])
 
-    pooled_features = torch.cat(output, 0)
+@lru_cache(maxsize=None)
+def _bin_span(bins, extent):
+    # Widest adaptive bin of any ROI that fits in the map
+    return max(-(-(i + 1) * length // bins) - i * length // bins
+               for length in range(1, extent + 1) for i in range(bins))
 
-    return pooled_features.view(input.shape[0], -1, ROI_POOL_SIZE[0], ROI_POOL_SIZE[1])
+def _bin_indices(start, length, bins, extent):
+    """(R, bins * span) cell indices covering AdaptiveMaxPool's bins of each ROI."""
+    i = torch.arange(bins, device=start.device)
+    # floor(i * L / bins) and ceil((i + 1) * L / bins), as in adaptive pooling
+    lo = start[:, None] + torch.div(i * length[:, None], bins, rounding_mode='floor')
+    hi = start[:, None] + torch.div((i + 1) * length[:, None] + bins - 1, bins, rounding_mode='floor')
+    offsets = torch.arange(_bin_span(bins, extent), device=start.device)
+    idx = torch.minimum(lo[:, :, None] + offsets, hi[:, :, None] - 1)
+    return idx.reshape(len(start), -1)
 
 def adaptive_max_pool(input, size):
-    return AdaptiveMaxPool2d(size[0], size[1])(input)
\ No newline at end of file
+    return AdaptiveMaxPool2d(size[0], size[1])(input)
@@ -0,0 +1,138 @@
+import fcntl
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import List, Optional
+
+import torch
+
+from config import env
+
+logger = logging.getLogger(__name__)
+
+# Held open for the life of the process: the lock on it is this worker's claim on a CPU slice
+_cpu_slot_file = None
+# torch.set_num_threads resizes the one intra-op pool every thread's ops run on
+_model_threads_lock = threading.Lock()
+
+
+def available_cpus() -> List[int]:
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        # No affinity API (macOS)
+        return list(range(os.cpu_count() or 1))
+
+
+def parse_cpu_list(spec: str) -> List[int]:
+    """'0-3,8,10-11' -> [0, 1, 2, 3, 8, 10, 11]"""
+    cpus = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return sorted(set(cpus))
+
+
+def _claim_cpu_slot(slots: int) -> Optional[int]:
+    """Index of a CPU slice no other live worker holds, via a lock file per slice."""
+    global _cpu_slot_file
+    run_dir = os.path.join(env.DATA_DIR, 'run')
+    os.makedirs(run_dir, exist_ok=True)
+    for slot in range(slots):
+        f = open(os.path.join(run_dir, f"cpu-slot-{slot}.lock"), 'a')
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            continue
+        # The lock goes away with the process, so a restarted worker can take the slot
+        _cpu_slot_file = f
+        return slot
+    return None
+
+
+def _pinned_cpus(cpus: List[int], workers: int) -> Optional[List[int]]:
+    if not env.CPU_AFFINITY:
+        return None
+    if env.CPU_AFFINITY != 'auto':
+        return parse_cpu_list(env.CPU_AFFINITY)
+    if workers <= 1:
+        return None
+    slot = _claim_cpu_slot(workers)
+    if slot is None:
+        logger.warning(f"All {workers} CPU slices are taken by other workers; not pinning this one")
+        return None
+    per_worker = max(1, len(cpus) // workers)
+    start = (slot * per_worker) % len(cpus)
+    return cpus[start:start + per_worker]
+
+
+def _pin_process(cpus: List[int]) -> None:
+    # sched_setaffinity applies to one thread; threads started later inherit it
+    try:
+        thread_ids = [int(tid) for tid in os.listdir('/proc/self/task')]
+    except OSError:
+        thread_ids = [0]
+    for thread_id in thread_ids:
+        try:
+            os.sched_setaffinity(thread_id, cpus)
+        except ProcessLookupError:
+            pass
+
+
+def configure_torch_runtime() -> None:
+    """Size torch's thread pools (and optionally pin the process) for this worker.
+
+    By default the host's CPUs are split evenly between the WEB_CONCURRENCY
+    workers, instead of every worker's intra-op pool spanning all of them.
+    Must run before the models do any work: torch only accepts an inter-op
+    thread count before its inter-op pool starts.
+    """
+    workers = max(1, env.WEB_CONCURRENCY)
+    cpus = available_cpus()
+    pinned = _pinned_cpus(cpus, workers)
+    if pinned:
+        _pin_process(pinned)
+        cpus = pinned
+
+    intra_op = env.TORCH_INTRA_OP_THREADS or max(1, len(cpus) // (1 if pinned else workers))
+    torch.set_num_threads(intra_op)
+    inter_op = env.TORCH_INTER_OP_THREADS or 1
+    try:
+        torch.set_num_interop_threads(inter_op)
+    except RuntimeError:
+        # Already set, or the pool already ran (e.g. configured twice in one process)
+        inter_op = torch.get_num_interop_threads()
+    logger.info(f"Torch runtime for pid {os.getpid()}: {intra_op} intra-op / {inter_op} inter-op threads, "
+                f"{workers} workers, CPUs {pinned if pinned else 'unpinned'}")
+
+
+def _per_model_threads() -> bool:
+    return any((env.TORCH_SEGMENT_THREADS, env.TORCH_CLASSIFY_THREADS, env.TORCH_ATTRIBUTE_THREADS))
+
+
+@contextmanager
+def model_threads(num_threads: int):
+    """Run a model pass with its own intra-op thread count (0 keeps the process setting).
+
+    The thread count is process-wide, so while any per-model count is
+    configured every model pass holds a process-wide lock for its duration:
+    passes in different inference slots then run one at a time, each with
+    its own count, and none sees another model's setting. Without per-model
+    counts nothing is changed or locked.
+    """
+    if not _per_model_threads():
+        yield
+        return
+    with _model_threads_lock:
+        previous = torch.get_num_threads()
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
+        try:
+            yield
+        finally:
+            torch.set_num_threads(previous)
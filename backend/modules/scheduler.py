@@ -0,0 +1,149 @@
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Optional
+
+from config import env
+from modules.metrics import histogram, register_collector
+
+# Priority classes, highest first. A queued interactive request always runs
+# before queued bulk work, and bulk before background reprocessing.
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+BACKGROUND = 'background'
+PRIORITIES = (INTERACTIVE, BULK, BACKGROUND)
+
+# Initial guess at how long one inference slot is held, until there are measurements
+INITIAL_SERVICE_SECONDS = 2.0
+SERVICE_TIME_SMOOTHING = 0.2
+
+queue_wait = histogram("inference_queue_wait_seconds", "Time spent queued for an inference slot",
+                       labelnames=("priority",))
+
+
+class SchedulerOverloaded(Exception):
+    """The inference queue is too deep to take more work; retry after ``retry_after`` seconds."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Inference queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class InferenceScheduler:
+    """Admission control in front of the models.
+
+    At most ``concurrency`` callers hold an inference slot at once. Waiting
+    callers are served by priority class, and within a class round-robin by
+    user, so one user's 50-image upload takes turns with everyone else's
+    single photos instead of running ahead of them. Callers that may be shed
+    get SchedulerOverloaded instead of a place in a queue that is already
+    ``queue_limit`` deep (or ``user_queue_limit`` deep for that user).
+    """
+
+    def __init__(self, concurrency: int, queue_limit: int, user_queue_limit: int):
+        self.concurrency = concurrency
+        self.queue_limit = queue_limit
+        self.user_queue_limit = user_queue_limit
+        self.running = 0
+        self.shed: Dict[str, int] = {priority: 0 for priority in PRIORITIES}
+        self._service_seconds = INITIAL_SERVICE_SECONDS
+        # priority -> user_id -> that user's waiters in arrival order; the
+        # first user in each OrderedDict is the next one served
+        self._queues: Dict[str, 'OrderedDict[str, Deque[object]]'] = {p: OrderedDict() for p in PRIORITIES}
+        self._condition = threading.Condition()
+
+    def queued(self, priority: Optional[str] = None) -> int:
+        priorities = PRIORITIES if priority is None else (priority,)
+        with self._condition:
+            return sum(len(waiters) for p in priorities for waiters in self._queues[p].values())
+
+    def _head(self) -> Optional[object]:
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            if queue:
+                return next(iter(queue.values()))[0]
+        return None
+
+    def _retry_after(self, ahead: int) -> int:
+        return max(1, math.ceil((ahead + 1) * self._service_seconds / self.concurrency))
+
+    def acquire(self, user_id: str, priority: str = INTERACTIVE, shed: bool = True) -> None:
+        if priority not in self._queues:
+            raise ValueError(f"Unknown priority {priority}")
+        started = time.perf_counter()
+        with self._condition:
+            if self.running < self.concurrency and self._head() is None:
+                self.running += 1
+                queue_wait.labels(priority).observe(0.0)
+                return
+            user_waiters = self._queues[priority].get(user_id)
+            if shed and (self.queued() >= self.queue_limit
+                         or (user_waiters is not None and len(user_waiters) >= self.user_queue_limit)):
+                self.shed[priority] += 1
+                raise SchedulerOverloaded(self._retry_after(self.queued()))
+
+            waiter = object()
+            self._queues[priority].setdefault(user_id, deque()).append(waiter)
+            try:
+                while self.running >= self.concurrency or self._head() is not waiter:
+                    self._condition.wait()
+            except BaseException:
+                self._dequeue(priority, user_id, waiter)
+                # The head of the queue may have changed
+                self._condition.notify_all()
+                raise
+            self._dequeue(priority, user_id, waiter)
+            self.running += 1
+        queue_wait.labels(priority).observe(time.perf_counter() - started)
+
+    def _dequeue(self, priority: str, user_id: str, waiter: object) -> None:
+        waiters = self._queues[priority][user_id]
+        waiters.remove(waiter)
+        if not waiters:
+            del self._queues[priority][user_id]
+        else:
+            # This user's turn is over: to the back of the round
+            self._queues[priority].move_to_end(user_id)
+
+    def release(self, held_seconds: float) -> None:
+        with self._condition:
+            self.running -= 1
+            self._service_seconds += SERVICE_TIME_SMOOTHING * (held_seconds - self._service_seconds)
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, user_id: str, priority: str = INTERACTIVE, shed: bool = True):
+        """Hold an inference slot for the block; raises SchedulerOverloaded when shed."""
+        self.acquire(user_id, priority, shed)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - started)
+
+
+_scheduler: Optional[InferenceScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> InferenceScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = InferenceScheduler(env.INFERENCE_CONCURRENCY, env.INFERENCE_QUEUE_LIMIT,
+                                            env.INFERENCE_USER_QUEUE_LIMIT)
+        return _scheduler
+
+
+def inference_slot(user_id: str, priority: str = INTERACTIVE, shed: bool = True):
+    return get_scheduler().slot(user_id, priority, shed)
+
+
+register_collector("inference_queue_depth", "gauge", "Callers queued for an inference slot",
+                   lambda: [({'priority': p}, get_scheduler().queued(p)) for p in PRIORITIES])
+register_collector("inference_running", "gauge", "Inference slots in use",
+                   lambda: [({}, get_scheduler().running)])
+register_collector("inference_shed_total", "counter", "Requests turned away because the inference queue was full",
+                   lambda: [({'priority': p}, count) for p, count in get_scheduler().shed.items()])
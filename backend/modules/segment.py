@@ -4,20 +4,35 @@ from PIL import Image
 import numpy as np
 import os
 import argparse
-from modules.segment_model import download_checkpoint, initialize_model, \
-    get_palette, LOCAL_CHECKPOINT_PATH, apply_transform
 from config import env
+from modules.segment_model import download_checkpoint, initialize_model, \
+    get_palette, LOCAL_CHECKPOINT_PATH
+from modules.image_store import get_image_store
+from modules.cutouts import class_mask, compose_cutout, cutout_renditions, rle_encode
+from modules.instances import split_instances
+from modules.preprocess import segment_inputs
+from modules.metrics import BATCH_SIZE_BUCKETS, histogram
+from modules.runtime import model_threads
+from modules.tracing import model_span
+
+batch_sizes = histogram("model_batch_size", "Inputs per model forward pass", BATCH_SIZE_BUCKETS, labelnames=("model",))
 
 
 class ClothSegmenter:
-    def __init__(self, device='cpu'):
-        checkpoint_path = download_checkpoint()
-        self.model = initialize_model(LOCAL_CHECKPOINT_PATH)
+    def __init__(self, device='cpu', model=None):
+        # A ready model can be passed in, e.g. a random-init U2NET for benchmarks
+        if model is None:
+            download_checkpoint()
+            model = initialize_model(LOCAL_CHECKPOINT_PATH)
+        self.model = model
         self.palette = get_palette(4)
         self.device = device
         self.image = None
         self.original_size = None
         self.output_arr = None
+        self.model_input = None
+        self.instance_arr = None
+        self.instance_names = []
         self.mask = None
         self.image_path_stem = None
         self.save_dir = None
@@ -25,71 +40,80 @@ class ClothSegmenter:
         self.original_image_path = None
         self.masked_image_paths = []
         self.combined_mask_image_path = None
+        self.masked_images = {}
+        self.renditions = {}
 
-    def create_save_dir(self, image_path):
-        self.image_path_stem = os.path.splitext(os.path.basename(image_path))[0]
-        self.save_dir = os.path.join(env.IMAGES_DIR, self.image_path_stem)
-        os.makedirs(self.save_dir, exist_ok=True)
-        self.mask_path = os.path.join(self.save_dir, f'mask.png')
-        self.original_image_path = os.path.join(self.save_dir, f'original.png')
+    def create_save_dir(self, save_name):
+        # save_dir is a key prefix in the image store, not necessarily a local directory
+        self.image_path_stem = save_name
+        self.save_dir = save_name
+        self.mask_path = None
+        self.original_image_path = None
         self.masked_image_paths = []
-        self.combined_mask_image_path = os.path.join(self.save_dir, f'combined_masked.png')
+        self.combined_mask_image_path = None
+        self.masked_images = {}
+        self.renditions = {}
 
-    def segment(self, image_path):
-        self.create_save_dir(image_path)
-        self.image = Image.open(image_path).convert('RGB')
+    def segment(self, image, save_name):
+        self.create_save_dir(save_name)
+        self.image = image if image.mode == 'RGB' else image.convert('RGB')
         self.original_size = self.image.size
         
-        resized_image = self.image.resize((768, 768), Image.BICUBIC)
-        image_tensor = apply_transform(resized_image)
-        image_tensor = torch.unsqueeze(image_tensor, 0)
-
-        with torch.no_grad():
+        # model_input is pixel-aligned with output_arr, for the stages that
+        # work per mask (classification inputs, colors)
+        pixels, image_tensor = segment_inputs([self.image])
+        self.model_input = pixels[0]
+        batch_sizes.labels("u2net").observe(len(image_tensor))
+
+        with torch.no_grad(), model_threads(env.TORCH_SEGMENT_THREADS), \
+                model_span('u2net.forward', batch=len(image_tensor)):
             output_tensor = self.model(image_tensor.to(self.device))
             output_tensor = F.log_softmax(output_tensor[0], dim=1)
             output_tensor = torch.max(output_tensor, dim=1, keepdim=True)[1]
             output_tensor = torch.squeeze(output_tensor, dim=0)
             self.output_arr = output_tensor.cpu().numpy()[0, :, :]
 
+        # One cutout per garment, even when several share a class (flat lays)
+        self.instance_arr, self.instance_names = split_instances(self.output_arr)
+
+        # Kept at model resolution; cutouts scale it to the image when composed
         self.mask = Image.fromarray(self.output_arr.astype(np.uint8), mode='P')
         self.mask.putpalette(self.palette)
-        self.mask = self.mask.resize(self.original_size, Image.BICUBIC)
 
         return self.mask
 
-    def save_results(self):
-        os.makedirs(self.save_dir, exist_ok=True)
-
-        classes_to_save = [cls for cls in range(1, 4) if np.any(self.output_arr == cls)]
+    def save_results(self, store=None):
+        store = store or get_image_store()
 
         self.masked_image_paths = []  # Reset the list
-        combined_mask = np.zeros_like(self.output_arr, dtype=np.uint8)
-
-        for cls in classes_to_save:
-            alpha_mask = (self.output_arr == cls).astype(np.uint8) * 255
-            alpha_mask_img = Image.fromarray(alpha_mask, mode='L')
-            alpha_mask_img = alpha_mask_img.resize(self.original_size, Image.BICUBIC)
-            
-            masked_image = Image.new('RGBA', self.image.size, (0, 0, 0, 0))
-            masked_image.paste(self.image.convert('RGBA'), (0, 0), alpha_mask_img)
-            
-            masked_image_path = os.path.join(self.save_dir, f'masked_{cls}.png')
-            self.masked_image_paths.append(masked_image_path)
-            masked_image.save(masked_image_path)
-
-            combined_mask |= (self.output_arr == cls)
-
-        # Create and save the combined masked image
-        combined_alpha_mask = combined_mask.astype(np.uint8) * 255
-        combined_alpha_mask_img = Image.fromarray(combined_alpha_mask, mode='L')
-        combined_alpha_mask_img = combined_alpha_mask_img.resize(self.original_size, Image.BICUBIC)
-
-        combined_masked_image = Image.new('RGBA', self.image.size, (0, 0, 0, 0))
-        combined_masked_image.paste(self.image.convert('RGBA'), (0, 0), combined_alpha_mask_img)
-        combined_masked_image.save(self.combined_mask_image_path)
-
-        self.mask.save(self.mask_path)
-        self.image.save(self.original_image_path)
+        self.renditions = {}
+        # Stored items get cutout keys that /static renders on request from the
+        # original and the label map, so nothing but those two is encoded here.
+        # Classification works on model_input and the masks, not on cutouts.
+        self.masked_images = {}
+        for name in self.instance_names:
+            self.renditions[name] = cutout_renditions(self.save_dir, name)
+            self.masked_images[name] = self.renditions[name]['full']
+            self.masked_image_paths.append(self.renditions[name]['full'])
+
+        self.renditions['combined_masked'] = cutout_renditions(self.save_dir, 'combined_masked')
+        self.combined_mask_image_path = self.renditions['combined_masked']['full']
+
+        self.renditions['original'] = store.save_renditions(self.save_dir, 'original', self.image)
+        self.original_image_path = self.renditions['original']['full']
+
+        # Instance label map at model resolution, run-length encoded (a few KB)
+        self.mask_path = store.save_bytes(self.save_dir, 'labels', rle_encode(self.instance_arr), 'rle')
+
+    def cutouts(self):
+        """In-memory RGBA cutout per garment of the last segmented image."""
+        rgba_image = self.image.convert('RGBA')
+        return {name: compose_cutout(rgba_image, class_mask(self.instance_arr, name))
+                for name in self.instance_names}
+
+    def garment_masks(self):
+        """Boolean mask per garment of the last segmented image, aligned with model_input."""
+        return {name: class_mask(self.instance_arr, name) for name in self.instance_names}
 
     def get_mask(self, class_id):
         if self.output_arr is None:
@@ -102,7 +126,8 @@ def main():
     args = parser.parse_args()
 
     segmenter = ClothSegmenter(device='cpu')
-    segmenter.segment(args.image_path)
+    image_stem = os.path.splitext(os.path.basename(args.image_path))[0]
+    segmenter.segment(Image.open(args.image_path), image_stem)
     segmenter.save_results()
     
     print(f'Results saved in {segmenter.save_dir}/')
@@ -0,0 +1,44 @@
+import base64
+import hashlib
+import hmac
+import time
+from typing import Optional
+from urllib.parse import quote
+
+from config import env
+
+# Derive a dedicated key so image signatures can never be confused with JWTs
+_SIGNING_KEY = hmac.new(env.JWT_SECRET.encode(), b"image-url-signing", hashlib.sha256).digest()
+
+
+def _signature(key: str, expires: int) -> str:
+    message = f"{expires}:{key.lstrip('/')}".encode()
+    digest = hmac.new(_SIGNING_KEY, message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def sign_image_key(key: str, now: Optional[float] = None) -> str:
+    """Return ``key`` with ``exp``/``sig`` query parameters appended.
+
+    Expiry is rounded up to IMAGE_URL_BUCKET_SECONDS so the same image gets
+    the same URL for a while and browser caches keep working.
+    """
+    now = time.time() if now is None else now
+    bucket = env.IMAGE_URL_BUCKET_SECONDS
+    expires = int((now + env.IMAGE_URL_TTL_SECONDS) // bucket + 1) * bucket
+    return f"{quote(key)}?exp={expires}&sig={_signature(key, expires)}"
+
+
+def verify_image_signature(key: str, expires: Optional[str], signature: Optional[str],
+                           now: Optional[float] = None) -> bool:
+    """Check a signed image URL using only the secret, no token or database."""
+    if not expires or not signature:
+        return False
+    try:
+        expires_at = int(expires)
+    except ValueError:
+        return False
+    now = time.time() if now is None else now
+    if expires_at < now:
+        return False
+    return hmac.compare_digest(_signature(key, expires_at), signature)
@@ -0,0 +1,200 @@
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from config import env
+
+logger = logging.getLogger(__name__)
+
+EXPORT_QUEUE_MAX_TRACES = 1000
+
+
+class Span:
+    __slots__ = ('name', 'span_id', 'parent_id', 'start_ns', 'end_ns', 'thread_id', 'attributes')
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.thread_id = threading.get_ident()
+        self.attributes = attributes
+
+
+class Trace:
+    """Spans of one sampled request (or job), exported together when the root span ends.
+
+    ``profile`` is the request's StackSampler when it was profiled; spans
+    report the threads they run on to it, so only this request's threads
+    are sampled.
+    """
+
+    def __init__(self, trace_id: Optional[str] = None, profile=None):
+        self.trace_id = trace_id or new_trace_id()
+        self.spans: List[Span] = []
+        self.profile = profile
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+
+_trace: ContextVar[Optional[Trace]] = ContextVar('trace', default=None)
+_parent: ContextVar[Optional[Span]] = ContextVar('parent_span', default=None)
+
+
+def new_trace_id() -> str:
+    return os.urandom(16).hex()
+
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+
+def should_sample() -> bool:
+    return env.TRACING_ENABLED and random.random() < env.TRACE_SAMPLE_RATE
+
+
+@contextmanager
+def start_trace(name: str, trace_id: Optional[str] = None, profile=None, **attributes):
+    """Root span of a new trace; exported on exit."""
+    trace = Trace(trace_id, profile)
+    trace_token = _trace.set(trace)
+    try:
+        with span(name, **attributes) as root:
+            yield root
+    finally:
+        _trace.reset(trace_token)
+        export(trace)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a stage as a child of the current span. A no-op outside a sampled trace."""
+    trace = _trace.get()
+    if trace is None:
+        yield None
+        return
+    parent = _parent.get()
+    current = Span(name, parent.span_id if parent else None, attributes)
+    token = _parent.set(current)
+    if trace.profile is not None:
+        trace.profile.add_thread(current.thread_id)
+    try:
+        yield current
+    except BaseException as e:
+        current.attributes['error'] = type(e).__name__
+        raise
+    finally:
+        if trace.profile is not None:
+            trace.profile.remove_thread(current.thread_id)
+        current.end_ns = time.time_ns()
+        _parent.reset(token)
+        trace.add(current)
+
+
+@contextmanager
+def model_span(name: str, **attributes):
+    """A span around a model forward pass.
+
+    Within a traced request the ops show up under ``name`` in torch.profiler
+    output, and a profiled request also gets a torch.profiler trace of the
+    pass written next to its stack samples.
+    """
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+    import torch
+    with span(name, **attributes) as current:
+        if trace.profile is not None and env.PROFILE_TORCH:
+            with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU],
+                                        record_shapes=True) as torch_profile:
+                with torch.profiler.record_function(name):
+                    yield
+            path = trace.profile.output_path(f"{name}.{current.span_id}.torch.json")
+            torch_profile.export_chrome_trace(path)
+            current.attributes['torch_profile'] = path
+        else:
+            with torch.profiler.record_function(name):
+                yield
+
+
+def _attribute_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def to_otlp(trace: Trace) -> Dict[str, Any]:
+    """The trace as an OTLP/JSON ExportTraceServiceRequest.
+
+    The same document is POSTed to a collector's /v1/traces and written as one
+    line of the export file, which the collector's otlpjsonfile receiver (or
+    any OTLP JSON tooling) can read back.
+    """
+    spans = [{
+        'traceId': trace.trace_id,
+        'spanId': s.span_id,
+        **({'parentSpanId': s.parent_id} if s.parent_id else {}),
+        'name': s.name,
+        'kind': 2 if s.parent_id is None else 1,
+        'startTimeUnixNano': str(s.start_ns),
+        'endTimeUnixNano': str(s.end_ns),
+        'attributes': [{'key': key, 'value': _attribute_value(value)}
+                       for key, value in {**s.attributes, 'thread.id': s.thread_id}.items()],
+    } for s in trace.spans]
+    return {'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': env.TRACE_SERVICE_NAME}}]},
+        'scopeSpans': [{'scope': {'name': __name__}, 'spans': spans}],
+    }]}
+
+
+_export_queue: 'queue.Queue[Trace]' = queue.Queue(EXPORT_QUEUE_MAX_TRACES)
+_export_thread: Optional[threading.Thread] = None
+_export_lock = threading.Lock()
+
+
+def export(trace: Trace) -> None:
+    """Hand a finished trace to the exporter thread; dropped if the exporter is behind."""
+    global _export_thread
+    with _export_lock:
+        if _export_thread is None:
+            _export_thread = threading.Thread(target=_export_worker, daemon=True)
+            _export_thread.start()
+    try:
+        _export_queue.put_nowait(trace)
+    except queue.Full:
+        logger.warning(f"Trace export queue full, dropping trace {trace.trace_id}")
+
+
+def _export_worker() -> None:
+    client = None
+    while True:
+        trace = _export_queue.get()
+        document = to_otlp(trace)
+        try:
+            if env.TRACE_EXPORT_PATH:
+                os.makedirs(os.path.dirname(env.TRACE_EXPORT_PATH) or '.', exist_ok=True)
+                with open(env.TRACE_EXPORT_PATH, 'a') as f:
+                    f.write(json.dumps(document) + '\n')
+            if env.TRACE_COLLECTOR_URL:
+                if client is None:
+                    import httpx
+                    client = httpx.Client(timeout=env.TRACE_EXPORT_TIMEOUT)
+                client.post(env.TRACE_COLLECTOR_URL, json=document).raise_for_status()
+        except Exception as e:
+            logger.warning(f"Could not export trace {trace.trace_id}: {e}")
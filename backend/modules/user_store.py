@@ -0,0 +1,138 @@
+import atexit
+import csv
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Optional, Set, Tuple
+
+from config import env
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    email TEXT NOT NULL,
+    name TEXT NOT NULL,
+    last_login TEXT NOT NULL
+)
+"""
+
+UPSERT = ('INSERT INTO users (id, email, name, last_login) VALUES (?, ?, ?, ?) '
+          'ON CONFLICT(id) DO UPDATE SET email = excluded.email, name = excluded.name, '
+          'last_login = MAX(users.last_login, excluded.last_login)')
+
+
+class UserStore:
+    """Keyed user records in SQLite.
+
+    New users are upserted immediately. Logins of users this process has
+    already seen only update their in-memory (email, name, last_login), which
+    a background thread upserts in one transaction every
+    USER_LOGIN_FLUSH_SECONDS, so a login burst costs a handful of small
+    writes instead of one per login.
+    WAL mode plus keyed upserts keep concurrent workers from losing updates.
+    """
+
+    def __init__(self, db_path: Optional[str] = None, legacy_csv_path: Optional[str] = None):
+        self.db_path = db_path or os.path.join(env.DATA_DIR, 'users.db')
+        self.legacy_csv_path = legacy_csv_path or os.path.join(env.DATA_DIR, 'users.csv')
+        self._local = threading.local()
+        self._known_ids: Set[str] = set()
+        # user_id -> (email, name, last_login) of the latest login not yet written
+        self._pending_logins: Dict[str, Tuple[str, str, str]] = {}
+        self._pending_lock = threading.Lock()
+        self._flush_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        with self._connection() as conn:
+            conn.execute(SCHEMA)
+        self._migrate_legacy_csv()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _migrate_legacy_csv(self) -> None:
+        if not os.path.exists(self.legacy_csv_path):
+            return
+        conn = self._connection()
+        if conn.execute('SELECT 1 FROM users LIMIT 1').fetchone():
+            return
+        with open(self.legacy_csv_path, newline='') as f:
+            rows = [(r['id'], r['email'], r['name'], r['last_login']) for r in csv.DictReader(f)]
+        with conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO users (id, email, name, last_login) VALUES (?, ?, ?, ?)', rows)
+        logger.info(f"Migrated {len(rows)} users from {self.legacy_csv_path}")
+
+    def upsert(self, user_id: str, email: str, name: str, last_login: str) -> None:
+        with self._connection() as conn:
+            conn.execute(UPSERT, (user_id, email, name, last_login))
+
+    def record_login(self, user_id: str, email: str, name: str) -> None:
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        if user_id in self._known_ids:
+            with self._pending_lock:
+                self._pending_logins[user_id] = (email, name, now)
+            self._ensure_flusher()
+            return
+        self.upsert(user_id, email, name, now)
+        self._known_ids.add(user_id)
+
+    def get(self, user_id: str) -> Optional[Dict[str, str]]:
+        row = self._connection().execute(
+            'SELECT id, email, name, last_login FROM users WHERE id = ?', (user_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('id', 'email', 'name', 'last_login'), row))
+
+    def flush(self) -> int:
+        with self._pending_lock:
+            pending, self._pending_logins = self._pending_logins, {}
+        if not pending:
+            return 0
+        with self._connection() as conn:
+            conn.executemany(UPSERT, [(user_id, *login) for user_id, login in pending.items()])
+        return len(pending)
+
+    def _ensure_flusher(self) -> None:
+        if self._flush_thread is not None:
+            return
+        with self._pending_lock:
+            if self._flush_thread is not None:
+                return
+            self._flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flush_thread.start()
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(env.USER_LOGIN_FLUSH_SECONDS):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.error(f"Error flushing last logins: {str(e)}")
+
+    def close(self) -> None:
+        self._stop.set()
+        self.flush()
+
+
+_user_store: Optional[UserStore] = None
+_user_store_lock = threading.Lock()
+
+
+def get_user_store() -> UserStore:
+    global _user_store
+    # Logins call this from threadpool threads; only one of them may migrate
+    with _user_store_lock:
+        if _user_store is None:
+            _user_store = UserStore()
+            atexit.register(_user_store.close)
+        return _user_store
@@ -0,0 +1,149 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import uuid
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional
+
+from PIL import Image
+
+from config import env
+from modules.classify import classify_and_embed_inputs
+from modules.closet import cached_closet, segment_garments
+from modules.cutouts import garment_class
+from modules.embeddings import get_embedding_index
+from modules.preprocess import cutout_inputs
+from modules.scheduler import inference_slot
+
+logger = logging.getLogger(__name__)
+
+
+class WearLog:
+    """Append-only log of wear events for one user.
+
+    Events are JSON lines in ``WEAR_LOGS_DIR/<user_id>.jsonl``. Per-item wear
+    counts and last-worn dates are folded in as new lines are read, so keeping
+    them current costs only the events appended since the last look.
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.path = os.path.join(env.WEAR_LOGS_DIR, f"{user_id}.jsonl")
+        self.counts: Dict[str, int] = {}
+        self.last_worn: Dict[str, str] = {}
+        self._offset = 0
+        self._lock = threading.Lock()
+
+    def record(self, events: List[Dict[str, Any]]) -> None:
+        if not events:
+            return
+        payload = ''.join(json.dumps(event) + '\n' for event in events)
+        with open(self.path, 'ab') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                f.write(payload.encode())
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        self.refresh()
+
+    def refresh(self) -> None:
+        with self._lock:
+            if not os.path.exists(self.path):
+                return
+            with open(self.path, 'rb') as f:
+                f.seek(self._offset)
+                data = f.read()
+            # A trailing partial line is picked up once its writer finishes
+            complete = data[:data.rfind(b'\n') + 1]
+            self._offset += len(complete)
+            for line in complete.splitlines():
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping corrupt wear log entry in {self.path}")
+                    continue
+                item_id = event['item_id']
+                self.counts[item_id] = self.counts.get(item_id, 0) + 1
+                if event['worn_on'] > self.last_worn.get(item_id, ''):
+                    self.last_worn[item_id] = event['worn_on']
+
+    def item_stats(self, item_id: str) -> Dict[str, Any]:
+        with self._lock:
+            return {'count': self.counts.get(item_id, 0), 'last_worn': self.last_worn.get(item_id)}
+
+    def summary(self, live_item_ids: Optional[set] = None) -> Dict[str, Dict[str, Any]]:
+        self.refresh()
+        with self._lock:
+            return {
+                item_id: {'count': count, 'last_worn': self.last_worn.get(item_id)}
+                for item_id, count in self.counts.items()
+                if live_item_ids is None or item_id in live_item_ids
+            }
+
+
+# Most recently used last; bounded like the color index cache
+_wear_logs: Dict[str, WearLog] = {}
+_wear_logs_lock = threading.Lock()
+
+
+def get_wear_log(user_id: str) -> WearLog:
+    with _wear_logs_lock:
+        wear_log = _wear_logs.pop(user_id, None) or WearLog(user_id)
+        _wear_logs[user_id] = wear_log
+        while len(_wear_logs) > env.WEAR_LOG_CACHE_MAX_ITEMS:
+            _wear_logs.pop(next(iter(_wear_logs)))
+        return wear_log
+
+
+def log_outfit(user_id: str, image: Image.Image, worn_on: Optional[date] = None) -> Dict[str, Any]:
+    """Match the garments in an outfit photo to closet items and log them as worn.
+
+    Nothing is added to the closet. Garments without a close enough match
+    (WEAR_MATCH_MIN_SIMILARITY) are reported back as unmatched, and so are
+    garments whose best match is an item a closer garment of the photo took.
+    """
+    worn_on = (worn_on or date.today()).isoformat()
+    with inference_slot(user_id):
+        pixels, masks = segment_garments(image)
+        if masks:
+            _, embeddings = classify_and_embed_inputs(cutout_inputs(pixels, masks))
+    names = list(masks)
+    if not names:
+        return {'worn_on': worn_on, 'matches': [], 'unmatched': []}
+
+    live_item_ids = set(cached_closet(user_id).df['id'])
+    candidates = get_embedding_index(user_id).match(
+        embeddings, [garment_class(name) for name in names], live_item_ids)
+
+    best: Dict[str, Dict[str, Any]] = {}
+    unmatched = []
+    for name, candidate in zip(names, candidates):
+        if candidate is None or candidate[2] < env.WEAR_MATCH_MIN_SIMILARITY:
+            unmatched.append({'photo_garment': name, 'similarity': round(candidate[2], 4) if candidate else None,
+                              'reason': 'no_match'})
+            continue
+        item_id, garment, similarity = candidate
+        match = {'item_id': item_id, 'garment': garment, 'photo_garment': name, 'similarity': round(similarity, 4)}
+        # Two garments in one photo can't both be the same item: the closer one wins
+        duplicate = match
+        if item_id not in best or similarity > best[item_id]['similarity']:
+            duplicate, best[item_id] = best.get(item_id), match
+        if duplicate is not None:
+            unmatched.append({'photo_garment': duplicate['photo_garment'], 'similarity': duplicate['similarity'],
+                              'reason': 'duplicate', 'item_id': item_id})
+
+    outfit_id = str(uuid.uuid4())
+    logged_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    wear_log = get_wear_log(user_id)
+    wear_log.record([
+        {**match, 'outfit_id': outfit_id, 'worn_on': worn_on, 'logged_at': logged_at}
+        for match in best.values()
+    ])
+
+    matches = [{**match, **wear_log.item_stats(match['item_id'])} for match in best.values()]
+    logger.info(f"Logged outfit {outfit_id} for user {user_id}: {len(matches)} matched, {len(unmatched)} unmatched")
+    return {'outfit_id': outfit_id, 'worn_on': worn_on, 'matches': matches, 'unmatched': unmatched}
@@ -1,28 +1,62 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, UploadFile, File, Form
+from starlette.concurrency import run_in_threadpool
 from modules.auth import get_current_user, User
-from modules.closet import Closet
-import shutil
-import os
+from modules.closet import Closet, cached_closet
+from models.models import Clothes
+from modules.bulk_import import ImportJob
+from modules.image_io import decode_image, ImageValidationError
+from modules.image_store import get_image_store, rendition_urls
+from modules.wear_log import get_wear_log, log_outfit
+from modules.recommend import recommend_outfits
+from modules.scheduler import SchedulerOverloaded
 import uuid
 import logging
-from typing import List, Dict
+from datetime import date
+from typing import List, Dict, Optional
 from collections import Counter
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+def _image_url(path) -> str:
+    # Paths are image store keys; the store turns them into signed/CDN URLs
+    if not isinstance(path, str) or not path:
+        return path
+    return get_image_store().url(path)
+
+def _too_busy(e: SchedulerOverloaded) -> HTTPException:
+    return HTTPException(status_code=429, detail="Too many photos are being processed, try again shortly",
+                         headers={"Retry-After": str(e.retry_after)})
+
+def _closet_items(user_id: str) -> List[Clothes]:
+    # Opening a closet takes its file lock and replays the journal, so this
+    # runs in the threadpool; the cached closet only replays what's new
+    return cached_closet(user_id).get_all_items()
+
+def _wear_stats(user_id: str) -> Dict[str, Dict]:
+    live_item_ids = set(cached_closet(user_id).df['id'])
+    return get_wear_log(user_id).summary(live_item_ids)
+
+def _item_response(item) -> Dict:
+    data = item.to_dict()
+    data["image_path"] = _image_url(item.image_path)
+    data["clothes_mask"] = _image_url(item.clothes_mask)
+    data["combined_mask_image_path"] = _image_url(item.combined_mask_image_path)
+    data["masked_images"] = {key: _image_url(path) for key, path in item.masked_images.items()}
+    data["urls"] = rendition_urls(item.renditions)
+    return data
+
 @router.get("/api/user/closet")
 async def get_closet(current_user: User = Depends(get_current_user)):
     try:
         logger.info(f"Fetching closet for user: {current_user.id}")
-        closet = Closet(current_user.id)
-        items = closet.get_all_items()
+        items = await run_in_threadpool(_closet_items, current_user.id)
         logger.info(f"Retrieved {len(items)} items for user: {current_user.id}")
         
         return {
             "message": "Closet retrieved successfully",
-            "items": [item.to_dict() for item in items],
+            "items": [_item_response(item) for item in items],
         }
     except Exception as e:
         logger.error(f"Error retrieving closet for user {current_user.id}: {str(e)}")
@@ -33,9 +67,15 @@ async def get_closet(current_user: User = Depends(get_current_user)):
 async def get_past_uploads(current_user: User = Depends(get_current_user)):
     try:
         logger.info(f"Fetching past uploads for user: {current_user.id}")
-        closet = Closet(current_user.id)
-        items = closet.get_all_items()
-        uploads = [{"id": item.id, "image_path": item.image_path} for item in items]
+        items = await run_in_threadpool(_closet_items, current_user.id)
+        uploads = [
+            {
+                "id": item.id,
+                "image_path": _image_url(item.image_path),
+                "urls": rendition_urls(item.renditions).get("original", {})
+            }
+            for item in items
+        ]
         logger.info(f"Retrieved {len(uploads)} uploads for user: {current_user.id}")
         
         return {
@@ -53,70 +93,129 @@ async def add_closet_items(
     current_user: User = Depends(get_current_user)
 ):
     try:
-        closet = Closet(current_user.id)
+        closet = await run_in_threadpool(Closet, current_user.id)
         added_items = []
         failed_items = []
 
-        for image in images:
+        for index, image in enumerate(images):
             item_id = str(uuid.uuid4())
-            temp_file = f"/tmp/{item_id}.jpg"
             try:
-                with open(temp_file, "wb") as buffer:
-                    shutil.copyfileobj(image.file, buffer)
-                
-                # Add the item to the closet
-                item = closet.add_item(temp_file, item_id)
+                # Decode straight from the spooled upload, no temp file copy. Decoding
+                # and the models are CPU-bound, so both run off the event loop.
+                decoded = await run_in_threadpool(decode_image, image.file)
+
+                # Only the first photo can be shed (429); once admitted, the rest of
+                # the upload queues, taking turns with other users' uploads
+                item = await run_in_threadpool(closet.add_item, decoded, item_id, shed=index == 0)
                 if item:
-                    added_items.append(item)
+                    added_items.append(_item_response(Clothes.from_dict(dict(item))))
                     logger.info(f"Added item to closet: {item['id']}")
                 else:
                     failed_items.append(image.filename)
                     logger.warning(f"Failed to add item: {image.filename}")
+            except ImageValidationError as e:
+                failed_items.append(image.filename)
+                logger.warning(f"Rejected file {image.filename}: {str(e)}")
+            except SchedulerOverloaded:
+                raise
             except Exception as e:
                 failed_items.append(image.filename)
                 logger.error(f"Error processing file {image.filename}: {str(e)}")
-            finally:
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
         
         return {
             "message": f"{len(added_items)} items added to closet successfully",
             "added_items": added_items,
             "failed_items": failed_items
         }
+    except SchedulerOverloaded as e:
+        logger.warning(f"Shed upload of {len(images)} photos for user {current_user.id}: {str(e)}")
+        raise _too_busy(e)
     except Exception as e:
         logger.error(f"Unexpected error in add_closet_items: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@router.post("/api/user/closet/import")
+async def import_closet_items(
+    background_tasks: BackgroundTasks,
+    files: List[UploadFile] = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        # Copying the spooled uploads to the job directory is blocking file I/O
+        job = await run_in_threadpool(ImportJob.create, current_user.id, [(f.filename, f.file) for f in files])
+        background_tasks.add_task(job.run)
+        logger.info(f"Started import job {job.job_id} for user: {current_user.id}")
+        return {
+            "message": "Import started",
+            "job": job.progress()
+        }
+    except Exception as e:
+        logger.error(f"Error starting import for user {current_user.id}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.get("/api/user/closet/import/{job_id}")
+async def get_import_progress(job_id: str, current_user: User = Depends(get_current_user)):
+    try:
+        job = ImportJob(current_user.id, job_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return {
+        "message": "Import progress retrieved successfully",
+        "job": job.progress()
+    }
+
+@router.post("/api/user/closet/import/{job_id}/resume")
+async def resume_import(
+    job_id: str,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        job = ImportJob(current_user.id, job_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    if not job.can_resume():
+        raise HTTPException(status_code=409, detail=f"Import job is {job.state['status']}")
+    background_tasks.add_task(job.run)
+    logger.info(f"Resumed import job {job_id} for user: {current_user.id}")
+    return {
+        "message": "Import resumed",
+        "job": job.progress()
+    }
+
 @router.delete("/api/user/closet/item/{item_id}")
 async def delete_closet_item(item_id: str, current_user: User = Depends(get_current_user)):
     try:
-        closet = Closet(current_user.id)
-        if closet.delete_item(item_id):
-            return {"message": "Item deleted successfully"}
-        else:
-            raise HTTPException(status_code=404, detail="Item not found")
+        # Takes the closet's exclusive lock and deletes files: not on the event loop
+        closet = await run_in_threadpool(Closet, current_user.id)
+        deleted = await run_in_threadpool(closet.delete_item, item_id)
     except Exception as e:
         logger.error(f"Error deleting item: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Item not found")
+    return {"message": "Item deleted successfully"}
 
 # New endpoint for retrieving closet items
 @router.get("/api/user/closet-items")
 async def get_closet_items(current_user: User = Depends(get_current_user)):
     try:
         logger.info(f"Fetching closet items for user: {current_user.id}")
-        closet = Closet(current_user.id)
-        items = closet.get_all_items()
+        items = await run_in_threadpool(_closet_items, current_user.id)
         logger.info(f"Retrieved {len(items)} items for user: {current_user.id}")
         
         closet_items = []
 
         for item in items:
+            urls = rendition_urls(item.renditions)
             for mask_key, mask_path in item.masked_images.items():
                 closet_item = {
                     "id": f"{item.id}-{mask_key}",
-                    "path": mask_path,
-                    "classification_results": item.classification_results[mask_key]
+                    "path": _image_url(mask_path),
+                    "urls": urls.get(mask_key, {}),
+                    "classification_results": item.classification_results[mask_key],
+                    "colors": item.colors.get(mask_key, []),
+                    "attributes": item.attributes.get(mask_key, {})
                 }
                 closet_items.append(closet_item)
         
@@ -134,8 +233,7 @@ async def get_closet_items(current_user: User = Depends(get_current_user)):
 async def get_closet_categories(current_user: User = Depends(get_current_user)):
     try:
         logger.info(f"Fetching closet categories for user: {current_user.id}")
-        closet = Closet(current_user.id)
-        items = closet.get_all_items()
+        items = await run_in_threadpool(_closet_items, current_user.id)
         
         category_counter = Counter()
 
@@ -161,3 +259,74 @@ async def get_closet_categories(current_user: User = Depends(get_current_user)):
         logger.error(f"Error retrieving closet categories for user {current_user.id}: {str(e)}")
         logger.exception("Detailed traceback:")
         raise HTTPException(status_code=500, detail=f"Error retrieving closet categories: {str(e)}")
+
+@router.get("/api/user/closet/colors")
+async def search_closet_colors(
+    color: str = Query(..., regex=r"^#?[0-9a-fA-F]{6}$"),
+    max_distance: float = Query(20.0, gt=0),
+    limit: int = Query(50, gt=0, le=500),
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        closet = await run_in_threadpool(cached_closet, current_user.id)
+        matches = await run_in_threadpool(closet.search_by_color, color, max_distance=max_distance, limit=limit)
+        logger.info(f"Color search {color} matched {len(matches)} items for user: {current_user.id}")
+        return {
+            "message": "Color search completed successfully",
+            "matches": matches
+        }
+    except Exception as e:
+        logger.error(f"Error searching closet colors for user {current_user.id}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.post("/api/user/closet/wear")
+async def log_worn_outfit(
+    image: UploadFile = File(...),
+    worn_on: Optional[date] = Form(None),
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        decoded = await run_in_threadpool(decode_image, image.file)
+    except ImageValidationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        # Segmentation and embedding are CPU-bound; keep them off the event loop
+        outfit = await run_in_threadpool(log_outfit, current_user.id, decoded, worn_on)
+        return {
+            "message": f"{len(outfit['matches'])} items logged as worn",
+            "outfit": outfit
+        }
+    except SchedulerOverloaded as e:
+        raise _too_busy(e)
+    except Exception as e:
+        logger.error(f"Error logging outfit for user {current_user.id}: {str(e)}")
+        logger.exception("Detailed traceback:")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.get("/api/user/closet/wear")
+async def get_wear_stats(current_user: User = Depends(get_current_user)):
+    try:
+        return {
+            "message": "Wear stats retrieved successfully",
+            "items": await run_in_threadpool(_wear_stats, current_user.id)
+        }
+    except Exception as e:
+        logger.error(f"Error retrieving wear stats for user {current_user.id}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.get("/api/user/closet/recommendations")
+async def get_outfit_recommendations(
+    limit: int = Query(10, gt=0, le=100),
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        # Loading the closet and scoring are blocking; keep them off the event loop
+        outfits = await run_in_threadpool(recommend_outfits, current_user.id, limit)
+        return {
+            "message": "Outfit recommendations retrieved successfully",
+            "outfits": outfits
+        }
+    except Exception as e:
+        logger.error(f"Error recommending outfits for user {current_user.id}: {str(e)}")
+        logger.exception("Detailed traceback:")
+        raise HTTPException(status_code=500, detail="Internal server error")
@@ -0,0 +1,28 @@
+from fastapi import APIRouter, Header, Response
+from modules.signing import verify_image_signature
+from urllib.parse import urlsplit, parse_qs, unquote
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+STATIC_PREFIX = "/static/"
+
+@router.get("/api/images/authorize")
+async def authorize_image(x_original_uri: str = Header(...)):
+    # auth_request target for a reverse proxy serving IMAGES_DIR itself, e.g. nginx:
+    #   location /static/ { auth_request /api/images/authorize; alias /app/data/images/; }
+    #   location = /api/images/authorize {
+    #       proxy_pass http://backend; proxy_set_header X-Original-URI $request_uri; }
+    # Only the URL signature is checked, so this never decodes a token or reads a closet.
+    uri = urlsplit(x_original_uri)
+    if not uri.path.startswith(STATIC_PREFIX):
+        return Response(status_code=403)
+    key = unquote(uri.path[len(STATIC_PREFIX):])
+    params = parse_qs(uri.query)
+    expires = params.get("exp", [None])[0]
+    signature = params.get("sig", [None])[0]
+    if verify_image_signature(key, expires, signature):
+        return Response(status_code=204)
+    return Response(status_code=403)
@@ -0,0 +1,33 @@
+import logging
+import time
+from typing import Optional
+
+import anyio
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from config import env
+from modules.profiler import StackSampler, profile_authorized
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+@router.post("/api/admin/profile", response_class=PlainTextResponse)
+async def profile_process(
+    seconds: float = Query(10.0, gt=0),
+    x_profile_token: Optional[str] = Header(None),
+):
+    # Samples every thread for a window, whatever requests or imports are running,
+    # and returns the folded stacks (also written to PROFILE_DIR/window-<ts>/)
+    if not profile_authorized(x_profile_token):
+        raise HTTPException(status_code=403, detail="Profiling is disabled or the token is wrong")
+    seconds = min(seconds, env.PROFILE_MAX_SECONDS)
+    sampler = StackSampler(f"window-{int(time.time())}", all_threads=True).start()
+    try:
+        await anyio.sleep(seconds)
+    finally:
+        sampler.stop()
+    path = await anyio.to_thread.run_sync(sampler.write)
+    logger.info(f"Profiled all threads for {seconds}s: {sampler.samples} samples written to {path}")
+    return PlainTextResponse(sampler.folded(), headers={"X-Profile-Path": path})
@@ -0,0 +1,47 @@
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# config creates its data directories on import, so point them at a scratch
+# directory before any test module imports it
+_root = tempfile.mkdtemp(prefix='closet-tests-')
+for _name, _sub in [('DATA_DIR', 'data'), ('CLOSETS_DIR', 'closets'), ('IMAGES_DIR', 'images'),
+                    ('IMPORTS_DIR', 'imports'), ('EMBEDDINGS_DIR', 'embeddings'), ('WEAR_LOGS_DIR', 'wear')]:
+    os.environ[_name] = os.path.join(_root, _sub) + '/'
+for _name, _value in [('GOOGLE_CLIENT_ID', 'test-client-id'), ('GOOGLE_CLIENT_SECRET', 'test-client-secret'),
+                      ('GOOGLE_REDIRECT_URI', 'http://localhost:3000'), ('JWT_SECRET', 'test-secret'),
+                      ('S3_ENDPOINT_URL', 'http://127.0.0.1:9000')]:
+    os.environ.setdefault(_name, _value)
+
+
+@pytest.fixture
+def user_id() -> str:
+    """A fresh user, so every test gets its own closet files."""
+    return f"test-{uuid.uuid4()}"
+
+
+@pytest.fixture
+def make_item():
+    """Factory for closet rows as the pipeline persists them."""
+    def make(item_id=None, image_hash=None, category='shirt'):
+        item_id = item_id or str(uuid.uuid4())
+        return {
+            'id': item_id,
+            'image_path': f"{item_id}/original.full.webp",
+            'clothes_mask': f"{item_id}/labels.rle",
+            'masked_images': {'masked_1': f"{item_id}/masked_1.full.cutout"},
+            'combined_mask_image_path': f"{item_id}/combined_masked.full.cutout",
+            'classification_results': {'masked_1': {'category': category}},
+            'image_hash': image_hash or uuid.uuid4().hex[:16],
+            'renditions': {},
+            'color': 'red',
+            'colors': {},
+            'attributes': {},
+        }
+    return make
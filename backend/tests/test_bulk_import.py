@@ -0,0 +1,114 @@
+import io
+import tarfile
+import zipfile
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from config import env
+from modules import bulk_import
+from modules.bulk_import import ImportJob, mark_interrupted_jobs
+from modules.closet import Closet
+from modules.image_io import ImageValidationError
+
+
+def png_bytes(seed: int) -> bytes:
+    # Distinct patterns, so the perceptual-hash dedup keeps every image
+    rng = np.random.default_rng(seed)
+    pixels = (rng.random((8, 8)) > 0.5).astype(np.uint8) * 255
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).resize((64, 64), Image.NEAREST).convert('RGB').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def fake_pipeline(monkeypatch, make_item):
+    """Stand in for segmentation/classification; records the ids it processed."""
+    processed = []
+
+    def process_item(self, image, item_id, image_hash=None, **kwargs):
+        processed.append(item_id)
+        return make_item(item_id, image_hash)
+
+    monkeypatch.setattr(Closet, 'process_item', process_item)
+    return processed
+
+
+def test_members_over_the_size_limit_are_not_read(monkeypatch, user_id):
+    monkeypatch.setattr(env, 'MAX_UPLOAD_BYTES', 2000)
+    small, big = png_bytes(0), b'\xff' * 5000
+    assert len(small) < 2000
+
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('small.png', small)
+        archive.writestr('big.jpg', big)
+    tar_buffer = io.BytesIO()
+    with tarfile.open(fileobj=tar_buffer, mode='w:gz') as archive:
+        for name, data in [('small.png', small), ('big.jpg', big)]:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+
+    job = ImportJob.create(user_id, [('photos.zip', io.BytesIO(zip_buffer.getvalue())),
+                                     ('photos.tar.gz', io.BytesIO(tar_buffer.getvalue())),
+                                     ('loose.jpg', io.BytesIO(big))])
+    members = dict(job.iter_members(skip=set()))
+    assert members['0000_photos.zip:small.png'] == small
+    assert members['0001_photos.tar.gz:small.png'] == small
+    for key in ('0000_photos.zip:big.jpg', '0001_photos.tar.gz:big.jpg', '0002_loose.jpg'):
+        assert isinstance(members[key], ImageValidationError)
+
+
+def test_bounded_read_stops_past_the_limit(monkeypatch):
+    monkeypatch.setattr(env, 'MAX_UPLOAD_BYTES', 100)
+    source = io.BytesIO(b'x' * 10_000)
+    assert isinstance(bulk_import._read_bounded(source), ImageValidationError)
+    assert source.tell() == 101
+    assert bulk_import._read_bounded(io.BytesIO(b'x' * 100)) == b'x' * 100
+
+
+def test_resume_retries_failed_members_and_skips_done(user_id, fake_pipeline):
+    job = ImportJob.create(user_id, [('a.png', io.BytesIO(png_bytes(1))),
+                                     ('b.png', io.BytesIO(b'not an image')),
+                                     ('c.png', io.BytesIO(png_bytes(2)))])
+    job.run()
+    assert job.state['status'] == 'completed'
+    assert job.state['added'] == 2
+    assert [failure['key'] for failure in job.state['failed']] == ['0001_b.png']
+    assert '0001_b.png' not in job.state['done']
+    assert len(fake_pipeline) == 2
+
+    # The failed member becomes readable (e.g. a transient error); a resume retries only it
+    with open(f"{job.sources_dir}/0001_b.png", 'wb') as f:
+        f.write(png_bytes(3))
+    job = ImportJob(user_id, job.job_id)
+    assert job.can_resume()
+    job.run()
+    assert job.state['added'] == 3
+    assert job.state['failed'] == []
+    assert job.state['processed'] == 3
+    assert len(fake_pipeline) == 3
+    assert len(Closet(user_id).get_all_items()) == 3
+
+
+def test_startup_only_flags_jobs_no_process_is_running(user_id):
+    job = ImportJob.create(user_id, [('a.png', io.BytesIO(png_bytes(4)))])
+    job.state['status'] = 'running'
+    job._save_state()
+
+    # Another worker's run of the job holds its lock
+    lock = job._try_lock()
+    assert lock is not None
+    try:
+        assert ImportJob(user_id, job.job_id).is_active()
+        mark_interrupted_jobs()
+        assert ImportJob(user_id, job.job_id).state['status'] == 'running'
+    finally:
+        lock.close()
+
+    mark_interrupted_jobs()
+    job = ImportJob(user_id, job.job_id)
+    assert job.state['status'] == 'interrupted'
+    assert job.can_resume()
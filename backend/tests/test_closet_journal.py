@@ -0,0 +1,94 @@
+import os
+import threading
+
+import pytest
+
+from config import env
+from modules.closet import Closet
+
+
+@pytest.fixture(autouse=True)
+def no_background_compaction(monkeypatch):
+    monkeypatch.setattr(env, 'CLOSET_JOURNAL_COMPACT_THRESHOLD', 10_000)
+
+
+def ids(closet: Closet) -> set:
+    return {item.id for item in closet.get_all_items()}
+
+
+def test_writes_from_another_instance_are_replayed(user_id, make_item):
+    first, second = Closet(user_id), Closet(user_id)
+    item = make_item()
+    first.add_items([item])
+
+    # The second instance replays the first one's add before applying its update
+    assert second.update_items([dict(item, color='blue')]) == 1
+    assert second.df.loc[second.df['id'] == item['id'], 'color'].item() == 'blue'
+    assert Closet(user_id).get_all_items()[0].color == 'blue'
+
+
+def test_compaction_folds_the_journal_into_the_snapshot(user_id, make_item):
+    closet = Closet(user_id)
+    kept, updated, deleted = make_item(), make_item(), make_item()
+    closet.add_items([kept, updated, deleted])
+    closet.update_items([dict(updated, classification_results={'masked_1': {'category': 'dress'}})])
+    assert closet.delete_item(deleted['id'])
+
+    closet.compact()
+    assert os.path.getsize(closet.journal_path) == 0
+    reloaded = Closet(user_id)
+    assert ids(reloaded) == {kept['id'], updated['id']}
+    results = {item.id: item.classification_results for item in reloaded.get_all_items()}
+    assert results[updated['id']] == {'masked_1': {'category': 'dress'}}
+
+
+def test_a_stale_instance_picks_up_a_compaction_by_another(user_id, make_item):
+    stale = Closet(user_id)
+    first = make_item()
+    stale.add_items([first])
+
+    other = Closet(user_id)
+    second = make_item()
+    other.add_items([second])
+    other.compact()
+
+    third = make_item()
+    stale.add_items([third])
+    assert ids(stale) == {first['id'], second['id'], third['id']}
+    assert ids(Closet(user_id)) == ids(stale)
+
+
+def test_a_torn_trailing_entry_is_ignored_and_overwritten(user_id, make_item):
+    closet = Closet(user_id)
+    first = make_item()
+    closet.add_items([first])
+    with open(closet.journal_path, 'ab') as f:
+        f.write(b'{"op": "add", "item": {"id": "tor')
+
+    assert ids(Closet(user_id)) == {first['id']}
+    second = make_item()
+    Closet(user_id).add_items([second])
+    assert ids(Closet(user_id)) == {first['id'], second['id']}
+
+
+def test_concurrent_writers_lose_nothing(user_id, make_item):
+    writers, items_per_writer = 4, 10
+
+    def write():
+        closet = Closet(user_id)
+        for _ in range(items_per_writer):
+            closet.add_items([make_item()])
+
+    threads = [threading.Thread(target=write) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(Closet(user_id).get_all_items()) == writers * items_per_writer
+
+
+def test_items_with_a_known_image_hash_are_not_added_twice(user_id, make_item):
+    first, second = Closet(user_id), Closet(user_id)
+    first.add_items([make_item(image_hash='aaaa')])
+    assert second.add_items([make_item(image_hash='aaaa')]) == []
+    assert len(Closet(user_id).get_all_items()) == 1
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from modules import closet as closet_module
+from modules.auth import User, get_current_user
+from modules.closet import Closet
+
+
+@pytest.fixture
+def client(user_id, monkeypatch):
+    from routes import closet as closet_routes
+
+    file_lock = closet_module.file_lock
+    locked_on_loop = []
+
+    def checked_file_lock(*args, **kwargs):
+        try:
+            asyncio.get_running_loop()
+            locked_on_loop.append(args)
+        except RuntimeError:
+            pass
+        return file_lock(*args, **kwargs)
+
+    monkeypatch.setattr(closet_module, 'file_lock', checked_file_lock)
+    app = FastAPI()
+    app.include_router(closet_routes.router)
+    app.dependency_overrides[get_current_user] = lambda: User(id=user_id, email='a@b.c', name='Test')
+    yield TestClient(app)
+    # The closet lock blocks; taking it on the event loop stalls every request of the worker
+    assert locked_on_loop == []
+
+
+def test_closet_reads_and_deletes_stay_off_the_event_loop(client, user_id, make_item):
+    kept, deleted = make_item(category='shirt'), make_item(category='dress')
+    Closet(user_id).add_items([kept, deleted])
+
+    for path in ('/api/user/closet', '/api/user/closet/uploads', '/api/user/closet-items',
+                 '/api/user/closet-categories', '/api/user/closet/colors?color=ff0000',
+                 '/api/user/closet/wear'):
+        assert client.get(path).status_code == 200, path
+
+    assert client.delete(f"/api/user/closet/item/{deleted['id']}").status_code == 200
+    assert client.delete(f"/api/user/closet/item/{deleted['id']}").status_code == 404
+    items = client.get('/api/user/closet').json()['items']
+    assert [item['id'] for item in items] == [kept['id']]
+    categories = client.get('/api/user/closet-categories').json()['categories']
+    assert categories == [{'name': 'shirt', 'count': 1}]
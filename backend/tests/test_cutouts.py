@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from modules.cutouts import class_mask, instance_label, rle_decode, rle_encode
+
+
+@pytest.mark.parametrize('labels', [
+    np.zeros((1, 1), dtype=np.uint8),
+    np.full((4, 7), 3, dtype=np.uint8),
+    np.arange(64, dtype=np.uint8).reshape(8, 8),
+    np.random.default_rng(0).integers(0, 12, size=(768, 768), dtype=np.uint8),
+    # Long runs crossing rows, as real label maps have
+    np.repeat(np.array([0, 1, 2, 0, 5], dtype=np.uint8), [1000, 20000, 300, 5000, 3620]).reshape(170, 176),
+])
+def test_rle_round_trip(labels):
+    decoded = rle_decode(rle_encode(labels))
+    assert decoded.dtype == np.uint8
+    assert decoded.shape == labels.shape
+    assert np.array_equal(decoded, labels)
+
+
+def test_rle_is_compact_for_label_maps():
+    labels = np.zeros((768, 768), dtype=np.uint8)
+    labels[100:400, 200:500] = 1
+    labels[400:700, 250:450] = 2
+    assert len(rle_encode(labels)) < 10_000
+
+
+def test_rle_decode_rejects_other_data():
+    with pytest.raises(ValueError):
+        rle_decode(b'\x89PNG\r\n\x1a\n' + b'\x00' * 16)
+
+
+def test_class_masks_cover_split_instances():
+    labels = np.zeros((4, 4), dtype=np.uint8)
+    labels[0] = instance_label(1, 1)
+    labels[1] = instance_label(1, 2)
+    labels[2] = instance_label(2, 1)
+    assert class_mask(labels, 'masked_1').sum() == 8
+    assert class_mask(labels, 'masked_1_2')[1].all() and class_mask(labels, 'masked_1_2').sum() == 4
+    assert class_mask(labels, 'combined_masked').sum() == 12
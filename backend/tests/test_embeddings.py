@@ -0,0 +1,147 @@
+import os
+import numpy as np
+import pytest
+
+from config import env
+from modules import embeddings, wear_log
+from modules.embeddings import EmbeddingIndex, EmbeddingRebuild, get_embedding_index
+
+
+def unit(seed: int, dim: int = 8) -> np.ndarray:
+    vector = np.random.default_rng(seed).normal(size=dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_match_finds_the_closest_garment_of_the_same_class(user_id):
+    index = EmbeddingIndex(user_id)
+    index.append('item-a', {'masked_1': unit(1), 'masked_2': unit(2)})
+    index.append('item-b', {'masked_1': unit(3)})
+
+    [top, bottom, full] = index.match(np.stack([unit(3), unit(2), unit(1)]), [1, 2, 3])
+    assert top[:2] == ('item-b', 'masked_1')
+    assert bottom[:2] == ('item-a', 'masked_2')
+    assert full is None
+
+
+def test_deleted_items_stop_matching_and_are_compacted_away(user_id):
+    writer, reader = EmbeddingIndex(user_id), EmbeddingIndex(user_id)
+    writer.append('item-a', {'masked_1': unit(1)})
+    writer.append('item-b', {'masked_1': unit(2)})
+    writer.append('item-b', {'masked_1': unit(3)})
+    assert reader.match(unit(2)[None], [1])[0][0] == 'item-a'  # item-b's first embedding was superseded
+    writer.delete('item-b')
+    assert reader.match(unit(3)[None], [1])[0][0] == 'item-a'
+    assert reader.dead_rows() == 3
+
+    size = os.path.getsize(writer.path)
+    assert writer.compact() == 3
+    assert os.path.getsize(writer.path) < size
+    # Another index on the file notices the rewrite and rereads it
+    generation = reader.generation
+    keys, vectors, end = reader.rows_since(0)
+    assert reader.generation == generation + 1
+    assert keys == [('item-a', 'masked_1')] and end == 1
+    assert np.allclose(vectors[0], unit(1), atol=1e-3)
+    assert reader.dead_rows() == 0
+
+
+def test_rows_since_never_returns_tombstones(user_id):
+    index = EmbeddingIndex(user_id)
+    index.append('item-a', {'masked_1': unit(1)})
+    index.delete('item-a')
+    keys, _, end = index.rows_since(0)
+    assert keys == [('item-a', 'masked_1')] and end == 2
+    assert index.rows_since(0, active_only=True)[0] == []
+
+
+def test_append_refuses_vectors_of_another_size(user_id):
+    index = EmbeddingIndex(user_id)
+    index.append('item-a', {'masked_1': unit(1, dim=8)})
+    with pytest.raises(ValueError):
+        index.append('item-b', {'masked_1': unit(2, dim=16)})
+    assert index.rows_since(0)[0] == [('item-a', 'masked_1')]
+
+
+def test_rebuild_of_another_size_replaces_the_file_atomically(user_id):
+    reader = EmbeddingIndex(user_id)
+    reader.append('item-a', {'masked_1': unit(1, dim=8)})
+    reader.append('item-b', {'masked_1': unit(2, dim=8)})
+    assert reader.rows_since(0)[2] == 2 and reader.dim == 8
+
+    rebuild = EmbeddingRebuild(reader)
+    rebuild.append('item-a', {'masked_1': unit(3, dim=16)})
+    # Until the commit the live file is untouched
+    assert reader.rows_since(0)[0] == [('item-a', 'masked_1'), ('item-b', 'masked_1')]
+    rebuild.commit()
+    assert not os.path.exists(rebuild.path)
+
+    # item-b's 8-d row can't be kept; it is left to be embedded again
+    keys, vectors, _ = reader.rows_since(0)
+    assert keys == [('item-a', 'masked_1')] and reader.dim == 16
+    assert np.allclose(vectors[0], unit(3, dim=16), atol=1e-3)
+    reader.append('item-b', {'masked_1': unit(4, dim=16)})
+    assert reader.match(unit(4, dim=16)[None], [1])[0][0] == 'item-b'
+
+
+def test_rebuild_keeps_rows_written_while_it_ran(user_id):
+    index = EmbeddingIndex(user_id)
+    index.append('item-a', {'masked_1': unit(1)})
+    index.append('item-b', {'masked_1': unit(2)})
+    rebuild = EmbeddingRebuild(index)
+    rebuild.append('item-a', {'masked_1': unit(3)})
+    rebuild.append('item-b', {'masked_1': unit(4)})
+    # Meanwhile an item is added and another deleted
+    index.append('item-c', {'masked_1': unit(5)})
+    index.delete('item-b')
+    rebuild.commit()
+
+    assert index.rows_since(0, active_only=True)[0] == [('item-a', 'masked_1'), ('item-c', 'masked_1')]
+    assert index.match(unit(3)[None], [1])[0][0] == 'item-a'
+    assert index.dead_rows() == 2  # item-b's rebuilt row and its tombstone
+
+
+def test_discarded_rebuild_leaves_the_file_alone(user_id):
+    index = EmbeddingIndex(user_id)
+    index.append('item-a', {'masked_1': unit(1)})
+    rebuild = EmbeddingRebuild(index)
+    rebuild.append('item-a', {'masked_1': unit(2)})
+    rebuild.discard()
+    rebuild.commit()
+    keys, vectors, _ = index.rows_since(0)
+    assert keys == [('item-a', 'masked_1')] and np.allclose(vectors[0], unit(1), atol=1e-3)
+
+
+def test_per_user_caches_are_bounded(monkeypatch):
+    monkeypatch.setattr(env, 'EMBEDDING_INDEX_CACHE_MAX_ITEMS', 3)
+    monkeypatch.setattr(env, 'WEAR_LOG_CACHE_MAX_ITEMS', 3)
+    monkeypatch.setattr(embeddings, '_indexes', {})
+    monkeypatch.setattr(wear_log, '_wear_logs', {})
+    first = get_embedding_index('user-0')
+    for user in range(1, 6):
+        get_embedding_index(f"user-{user}")
+        wear_log.get_wear_log(f"user-{user}")
+        # Recently used users stay cached
+        assert get_embedding_index('user-0') is first
+    assert len(embeddings._indexes) == 3 and len(wear_log._wear_logs) == 3
+    assert 'user-1' not in embeddings._indexes
+
+
+def test_closet_deletes_tombstone_embeddings_and_compaction_drops_them(monkeypatch, user_id, make_item):
+    from modules import closet as closet_module
+    from modules.closet import Closet
+
+    scheduled = []
+    monkeypatch.setattr(env, 'EMBEDDINGS_COMPACT_THRESHOLD', 2)
+    monkeypatch.setattr(closet_module, 'schedule_compaction', scheduled.append)
+    closet = Closet(user_id)
+    kept, deleted = make_item(), make_item()
+    closet.add_items([kept, deleted])
+    index = get_embedding_index(user_id)
+    index.append(kept['id'], {'masked_1': unit(1)})
+    index.append(deleted['id'], {'masked_1': unit(2)})
+
+    assert closet.delete_item(deleted['id'])
+    assert scheduled == [user_id]
+    closet.compact()
+    assert index.dead_rows() == 0
+    assert index.rows_since(0)[0] == [(kept['id'], 'masked_1')]
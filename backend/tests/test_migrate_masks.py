@@ -0,0 +1,62 @@
+import io
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from config import env
+from modules.closet import Closet
+from modules.cutouts import rle_decode
+from modules.image_store import get_image_store
+from modules.migrate_masks import migrate_closet
+
+
+def stored_files() -> set:
+    return {os.path.join(root, name) for root, _, names in os.walk(env.IMAGES_DIR) for name in names}
+
+
+def png(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def legacy_closet(user_id, make_item):
+    """A closet with one item in the old layout (palette PNG mask) and one already migrated."""
+    store = get_image_store()
+    legacy = make_item()
+    classes = np.zeros((96, 64), dtype=np.uint8)
+    classes[10:50, 8:56] = 1
+    mask = Image.fromarray(classes, mode='P')
+    legacy['clothes_mask'] = f"{legacy['id']}/mask.png"
+    legacy['image_path'] = f"{legacy['id']}/original.png"
+    store.put(legacy['clothes_mask'], png(mask), 'image/png')
+    store.put(legacy['image_path'], png(Image.new('RGB', (64, 96), 'red')), 'image/png')
+    Closet(user_id).add_items([legacy, make_item()])
+    return legacy
+
+
+def test_dry_run_writes_nothing(user_id, legacy_closet):
+    closet = Closet(user_id)
+    before = stored_files()
+    journal_size = os.path.getsize(closet.journal_path)
+
+    report = migrate_closet(user_id, get_image_store(), dry_run=True)
+    assert report == {'migrated': 1, 'failed': 0, 'reclaimed_bytes': 0}
+    assert stored_files() == before
+    assert os.path.getsize(closet.journal_path) == journal_size
+
+
+def test_migration_stores_a_label_map(user_id, legacy_closet):
+    store = get_image_store()
+    report = migrate_closet(user_id, store)
+    assert report['migrated'] == 1 and report['failed'] == 0
+
+    item = next(item for item in Closet(user_id).get_all_items() if item.id == legacy_closet['id'])
+    assert item.clothes_mask.endswith('.rle')
+    labels = rle_decode(store.get(item.clothes_mask))
+    assert labels.shape == (768, 768)
+    assert set(np.unique(labels)) == {0, 1}
+    assert migrate_closet(user_id, store)['migrated'] == 0
@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+import pytest
+
+from modules import reclassify
+from modules.closet import Closet
+from modules.embeddings import EmbeddingIndex
+from modules.reclassify import Checkpoint, reclassify_closet
+
+DIM = 16
+
+
+@pytest.fixture
+def new_model(monkeypatch):
+    """Labels and a vision model of DIM-d embeddings, without loading either."""
+    embedded = []
+
+    def embed_items(user_id, items, store, report):
+        embedded.extend(item['id'] for item in items)
+        return {item['id']: {name: np.ones(DIM, dtype=np.float32) for name in item['masked_images']}
+                for item in items}
+
+    monkeypatch.setattr(reclassify, 'load_labels', lambda: ({}, {'category': np.zeros((2, DIM))}))
+    monkeypatch.setattr(reclassify, 'embed_items', embed_items)
+    monkeypatch.setattr(reclassify, 'score_embeddings',
+                        lambda vectors: [{'category': [('dress', 0.9)]} for _ in vectors])
+    monkeypatch.setattr(reclassify, 'get_image_store', lambda: None)
+    return embedded
+
+
+@pytest.fixture
+def old_closet(user_id, make_item):
+    items = [make_item(), make_item()]
+    Closet(user_id).add_items(items)
+    index = EmbeddingIndex(user_id)
+    for item in items:
+        index.append(item['id'], {'masked_1': np.ones(8, dtype=np.float32)})
+    return items
+
+
+def test_embeddings_of_another_size_are_rebuilt_into_a_new_file(user_id, old_closet, new_model):
+    checkpoint = Checkpoint('test-rebuild')
+    report = reclassify_closet(user_id, checkpoint)
+
+    assert sorted(new_model) == sorted(item['id'] for item in old_closet)
+    assert report['reembedded'] == 2 and report['changed'] == 2
+    index = EmbeddingIndex(user_id)
+    keys, _, end = index.rows_since(0)
+    assert index.dim == DIM and end == 2
+    assert sorted(item_id for item_id, _ in keys) == sorted(item['id'] for item in old_closet)
+    assert not os.path.exists(index.rebuild_path)
+    assert checkpoint.is_complete(user_id)
+    assert all(item.classification_results['masked_1'] == {'category': 'dress'}
+               for item in Closet(user_id).get_all_items())
+
+
+def test_dry_run_leaves_the_embeddings_alone(user_id, old_closet, new_model):
+    path = EmbeddingIndex(user_id).path
+    size = os.path.getsize(path)
+    reclassify_closet(user_id, Checkpoint('test-dry-run'), dry_run=True)
+
+    index = EmbeddingIndex(user_id)
+    assert os.path.getsize(path) == size and not os.path.exists(index.rebuild_path)
+    assert index.rows_since(0)[2] == 2 and index.dim == 8
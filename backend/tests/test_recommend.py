@@ -0,0 +1,51 @@
+import numpy as np
+
+from config import env
+from modules import recommend
+from modules.closet import Closet, cached_closet
+from modules.embeddings import get_embedding_index
+from modules.recommend import LOWER_BODY, UPPER_BODY, get_compatibility_index, recommend_outfits
+
+
+def garment(item, name, labels):
+    item = dict(item, masked_images={name: f"{item['id']}/{name}.full.cutout"},
+                classification_results={name: labels})
+    return item
+
+
+def test_cached_closet_catches_up_with_other_writers(user_id, make_item):
+    cached = cached_closet(user_id)
+    assert cached_closet(user_id) is cached
+    item = make_item()
+    Closet(user_id).add_items([item])
+    assert set(cached_closet(user_id).df['id']) == {item['id']}
+
+
+def test_recommendations_follow_relabeled_items(user_id, make_item):
+    rng = np.random.default_rng(0)
+    top = garment(make_item(), 'masked_1', {'color': 'red'})
+    bottom = garment(make_item(), 'masked_2', {'color': 'blue'})
+    Closet(user_id).add_items([top, bottom])
+    index = get_embedding_index(user_id)
+    index.append(top['id'], {'masked_1': rng.normal(size=8)})
+    index.append(bottom['id'], {'masked_2': rng.normal(size=8)})
+
+    [outfit] = recommend_outfits(user_id)
+    assert [g['id'] for g in outfit['garments']] == [top['id'], bottom['id']]
+    compatibility = get_compatibility_index(user_id)
+    assert compatibility._labels[UPPER_BODY] == [{'color': 'red'}]
+
+    # Re-classification rewrites the rows; the cached scores must not keep the old labels
+    Closet(user_id).update_items([dict(top, classification_results={'masked_1': {'color': 'blue'}})])
+    [relabeled] = recommend_outfits(user_id)
+    assert compatibility._labels[UPPER_BODY] == [{'color': 'blue'}]
+    assert compatibility._labels[LOWER_BODY] == [{'color': 'blue'}]
+    assert relabeled['compatibility'] > outfit['compatibility']
+
+
+def test_compatibility_indexes_are_bounded(monkeypatch):
+    monkeypatch.setattr(env, 'RECOMMEND_INDEX_CACHE_MAX_ITEMS', 2)
+    monkeypatch.setattr(recommend, '_indexes', {})
+    for user in range(4):
+        get_compatibility_index(f"user-{user}")
+    assert list(recommend._indexes) == ['user-2', 'user-3']
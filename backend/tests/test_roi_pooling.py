@@ -0,0 +1,61 @@
+import pytest
+import torch
+from torch.nn import AdaptiveMaxPool2d
+
+from modules.roi_pooling import gated_roi_pooling
+
+SPATIAL_DIM = 7
+
+
+def loop_roi_pooling(input, rois, size=(3, 3)):
+    """Reference: slice and pool one ROI at a time, as the original implementation did."""
+    output = []
+    for roi in rois.long():
+        im = input[roi[0]][..., roi[2]:(roi[4] + 1), roi[1]:(roi[3] + 1)]
+        output.append(AdaptiveMaxPool2d(size[0], size[1])(im)[0])
+    return torch.cat(output, 0).view(input.shape[0], -1, size[0], size[1])
+
+
+def with_batch_ids(boxes: torch.Tensor) -> torch.Tensor:
+    batch_ids = torch.arange(len(boxes), dtype=boxes.dtype).unsqueeze(1)
+    return torch.cat((batch_ids, boxes), dim=1)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_matches_the_per_roi_loop_on_random_rois(seed):
+    generator = torch.Generator().manual_seed(seed)
+    batch_size = int(torch.randint(2, 17, (1,), generator=generator))
+    features = torch.randn(batch_size, 16, SPATIAL_DIM, SPATIAL_DIM, generator=generator)
+    # Drawn like FashionResnet's: a corner plus an offset, scaled to the feature map
+    corner = torch.rand(batch_size, 2, generator=generator)
+    boxes = torch.cat((corner, corner + torch.rand(batch_size, 2, generator=generator)), dim=1) * (SPATIAL_DIM - 1)
+    rois = with_batch_ids(boxes)
+    assert torch.equal(gated_roi_pooling(features, rois), loop_roi_pooling(features, rois))
+
+
+def test_matches_the_per_roi_loop_on_degenerate_rois():
+    boxes = torch.tensor([
+        [3, 3, 3, 3],      # a single cell
+        [0, 0, 6, 6],      # the whole map
+        [0, 2, 6, 2],      # one row
+        [4, 0, 4, 6],      # one column
+        [5, 5, 20, 20],    # running off the map
+        [0, 0, 1, 1],      # smaller than the pooled size
+        [6, 6, 6, 6],      # the last cell
+    ], dtype=torch.float32)
+    features = torch.randn(len(boxes), 8, SPATIAL_DIM, SPATIAL_DIM)
+    rois = with_batch_ids(boxes)
+    assert torch.equal(gated_roi_pooling(features, rois), loop_roi_pooling(features, rois))
+    # The single-ROI path as well
+    for row in range(len(boxes)):
+        single = with_batch_ids(boxes[row:row + 1])
+        assert torch.equal(gated_roi_pooling(features[row:row + 1], single),
+                           loop_roi_pooling(features[row:row + 1], single))
+
+
+@pytest.mark.parametrize('box', [[4, 4, 3, 6], [2, 5, 4, 4], [7, 0, 9, 3]])
+def test_empty_rois_are_rejected(box):
+    features = torch.randn(2, 8, SPATIAL_DIM, SPATIAL_DIM)
+    rois = with_batch_ids(torch.tensor([[0, 0, 6, 6], box], dtype=torch.float32))
+    with pytest.raises(ValueError):
+        gated_roi_pooling(features, rois)
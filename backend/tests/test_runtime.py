@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+import torch
+
+from config import env
+from modules.runtime import model_threads, parse_cpu_list
+
+
+def test_parse_cpu_list():
+    assert parse_cpu_list('0-3,8,10-11') == [0, 1, 2, 3, 8, 10, 11]
+    assert parse_cpu_list(' 2, 1-2 ,') == [1, 2]
+
+
+def test_model_threads_is_a_no_op_without_per_model_counts(monkeypatch):
+    for name in ('TORCH_SEGMENT_THREADS', 'TORCH_CLASSIFY_THREADS', 'TORCH_ATTRIBUTE_THREADS'):
+        monkeypatch.setattr(env, name, 0)
+    before = torch.get_num_threads()
+    with model_threads(0):
+        assert torch.get_num_threads() == before
+
+
+@pytest.fixture
+def per_model_counts(monkeypatch):
+    monkeypatch.setattr(env, 'TORCH_CLASSIFY_THREADS', 1)
+    previous = torch.get_num_threads()
+    torch.set_num_threads(2)
+    yield
+    torch.set_num_threads(previous)
+
+
+def test_model_threads_applies_and_restores_the_count(per_model_counts):
+    with model_threads(1):
+        assert torch.get_num_threads() == 1
+    assert torch.get_num_threads() == 2
+
+
+def test_model_passes_with_their_own_count_run_one_at_a_time(per_model_counts):
+    entered, release = threading.Event(), threading.Event()
+    seen = []
+
+    def first():
+        with model_threads(1):
+            entered.set()
+            release.wait(5)
+            seen.append(('first', torch.get_num_threads()))
+
+    def second():
+        # Keeps the process setting, so must not run under the first pass's count
+        with model_threads(0):
+            seen.append(('second', torch.get_num_threads()))
+
+    threads = [threading.Thread(target=first)]
+    threads[0].start()
+    assert entered.wait(5)
+    threads.append(threading.Thread(target=second))
+    threads[1].start()
+    threads[1].join(0.2)
+    assert threads[1].is_alive()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert seen == [('first', 1), ('second', 2)]
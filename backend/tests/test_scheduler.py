@@ -0,0 +1,104 @@
+import io
+import threading
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from modules import scheduler
+from modules.auth import User, get_current_user
+from modules.scheduler import BACKGROUND, BULK, INTERACTIVE, InferenceScheduler, SchedulerOverloaded
+
+
+def wait_until(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def test_waiters_are_served_by_priority_then_round_robin_by_user():
+    sched = InferenceScheduler(concurrency=1, queue_limit=100, user_queue_limit=100)
+    sched.acquire('holder')
+    served = []
+    threads = []
+
+    def request(name, user_id, priority):
+        with sched.slot(user_id, priority, shed=False):
+            served.append(name)
+
+    # Queued in this order while the only slot is held
+    for name, user_id, priority in [('background', 'd', BACKGROUND), ('bulk', 'd', BULK),
+                                    ('a1', 'a', INTERACTIVE), ('a2', 'a', INTERACTIVE),
+                                    ('a3', 'a', INTERACTIVE), ('b1', 'b', INTERACTIVE),
+                                    ('b2', 'b', INTERACTIVE), ('c1', 'c', INTERACTIVE)]:
+        queued = sched.queued()
+        thread = threading.Thread(target=request, args=(name, user_id, priority))
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda: sched.queued() == queued + 1)
+
+    sched.release(0.5)
+    for thread in threads:
+        thread.join(5)
+    assert served == ['a1', 'b1', 'c1', 'a2', 'b2', 'a3', 'bulk', 'background']
+    assert sched.running == 0 and sched.queued() == 0
+
+
+def test_full_queues_shed_with_a_retry_estimate():
+    sched = InferenceScheduler(concurrency=1, queue_limit=3, user_queue_limit=2)
+    sched.acquire('holder')
+    threads = [threading.Thread(target=sched.acquire, args=(user_id,)) for user_id in ('a', 'a', 'b')]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: sched.queued() == 3)
+
+    # This user already has user_queue_limit photos waiting
+    with pytest.raises(SchedulerOverloaded) as user_limit:
+        sched.acquire('a')
+    # The whole queue is queue_limit deep
+    with pytest.raises(SchedulerOverloaded) as queue_limit:
+        sched.acquire('c')
+    # With nothing measured yet, each caller ahead is assumed to hold the slot INITIAL_SERVICE_SECONDS
+    assert user_limit.value.retry_after == queue_limit.value.retry_after == 8
+    assert sched.shed[INTERACTIVE] == 2
+    # Work that must not be shed queues anyway
+    waiter = threading.Thread(target=sched.acquire, args=('c', BACKGROUND, False))
+    waiter.start()
+    wait_until(lambda: sched.queued(BACKGROUND) == 1)
+
+    # Each release hands the slot to the next waiter
+    for queued in (3, 2, 1, 0):
+        sched.release(0.0)
+        wait_until(lambda: sched.queued() == queued and sched.running == 1)
+    for thread in threads + [waiter]:
+        thread.join(5)
+    sched.release(0.0)
+    assert sched.running == 0
+
+
+@pytest.fixture
+def busy_scheduler(monkeypatch):
+    """The process-wide scheduler, with its only slot taken and no room to queue."""
+    busy = InferenceScheduler(concurrency=1, queue_limit=0, user_queue_limit=0)
+    busy.acquire('someone-else')
+    monkeypatch.setattr(scheduler, '_scheduler', busy)
+    return busy
+
+
+def test_uploads_get_429_with_retry_after_when_shed(busy_scheduler, user_id):
+    from routes import closet as closet_routes
+
+    app = FastAPI()
+    app.include_router(closet_routes.router)
+    app.dependency_overrides[get_current_user] = lambda: User(id=user_id, email='a@b.c', name='Test')
+    photo = io.BytesIO()
+    Image.new('RGB', (64, 64), 'red').save(photo, format='PNG')
+
+    response = TestClient(app).post('/api/user/closet/items',
+                                    files=[('images', ('shirt.png', photo.getvalue(), 'image/png'))])
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '2'
+    assert busy_scheduler.shed[INTERACTIVE] == 1
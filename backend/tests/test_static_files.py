@@ -0,0 +1,60 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from middleware import FileRangeResponse, ImageStaticFiles
+
+THUMBNAIL = 'thumb.0123456789abcdef.webp'
+
+
+@pytest.fixture
+def static(tmp_path):
+    files = ImageStaticFiles(directory=str(tmp_path))
+    app = FastAPI()
+    app.mount('/static', files, name='static')
+    return files, TestClient(app), tmp_path
+
+
+def test_hot_cache_misses_are_streamed_then_cached(static):
+    files, client, directory = static
+    (directory / THUMBNAIL).write_bytes(bytes(range(256)) * 4)
+
+    head = client.head(f'/static/{THUMBNAIL}')
+    assert head.status_code == 200 and head.headers['content-length'] == '1024'
+    assert len(files.hot_cache) == 0
+
+    first = client.get(f'/static/{THUMBNAIL}')
+    assert first.status_code == 200 and first.content == bytes(range(256)) * 4
+    assert first.headers['cache-control'].endswith('immutable')
+    assert len(files.hot_cache) == 1
+
+    second = client.get(f'/static/{THUMBNAIL}')
+    assert second.content == first.content and files.hot_cache.hits == 1
+
+
+def test_misses_are_not_read_on_the_event_loop(static, monkeypatch):
+    files, _, directory = static
+    (directory / THUMBNAIL).write_bytes(b'x' * 10)
+
+    def no_blocking_open(*args, **kwargs):
+        raise AssertionError("file_response read the file")
+
+    monkeypatch.setattr('builtins.open', no_blocking_open)
+    # file_response is synchronous, so it must leave the read to the response
+    response = files.file_response(str(directory / THUMBNAIL), (directory / THUMBNAIL).stat(),
+                                   {'type': 'http', 'method': 'GET', 'headers': []})
+    assert isinstance(response, FileRangeResponse) and response.on_read is not None
+
+
+def test_ranges_and_empty_files(static):
+    files, client, directory = static
+    (directory / THUMBNAIL).write_bytes(b'0123456789')
+    (directory / 'empty.webp').write_bytes(b'')
+
+    partial = client.get(f'/static/{THUMBNAIL}', headers={'Range': 'bytes=2-5'})
+    assert partial.status_code == 206 and partial.content == b'2345'
+    assert partial.headers['content-range'] == 'bytes 2-5/10'
+    assert len(files.hot_cache) == 0
+
+    empty = client.get('/static/empty.webp')
+    assert empty.status_code == 200 and empty.content == b''
@@ -0,0 +1,50 @@
+import asyncio
+
+from modules import auth, user_store
+from modules.user_store import UserStore
+
+
+def test_repeat_logins_keep_email_and_name_changes(tmp_path):
+    store = UserStore(str(tmp_path / 'users.db'), str(tmp_path / 'users.csv'))
+    store.record_login('u1', 'old@example.com', 'Old Name')
+    store.record_login('u1', 'new@example.com', 'New Name')
+    # Coalesced in memory until the flush
+    assert store.get('u1')['email'] == 'old@example.com'
+    assert store.flush() == 1
+    user = store.get('u1')
+    assert (user['email'], user['name']) == ('new@example.com', 'New Name')
+    store.close()
+
+
+def test_legacy_users_are_migrated_once(tmp_path):
+    (tmp_path / 'users.csv').write_text('id,email,name,last_login\n'
+                                       'u1,a@example.com,A,2024-01-01 00:00:00\n')
+    store = UserStore(str(tmp_path / 'users.db'), str(tmp_path / 'users.csv'))
+    assert store.get('u1')['name'] == 'A'
+    store.record_login('u1', 'a@example.com', 'A renamed')
+    # The existing row is kept, not duplicated or reset, by a second open
+    again = UserStore(str(tmp_path / 'users.db'), str(tmp_path / 'users.csv'))
+    assert again.get('u1')['name'] == 'A renamed'
+
+
+def test_google_logins_save_the_user_off_the_event_loop(monkeypatch):
+    class Client:
+        async def post(self, url, data):
+            return type('Response', (), {'json': lambda self: {'id_token': 'token'}})()
+
+    async def verify(token, client):
+        return {'sub': 'u1', 'email': 'a@example.com', 'name': 'A'}
+
+    def record_login(user_id, email, name):
+        try:
+            asyncio.get_running_loop()
+            saved.append('on the event loop')
+        except RuntimeError:
+            saved.append(user_id)
+
+    saved = []
+    monkeypatch.setattr(auth, 'get_http_client', Client)
+    monkeypatch.setattr(auth, 'verify_google_id_token', verify)
+    monkeypatch.setattr(user_store, '_user_store', type('Store', (), {'record_login': staticmethod(record_login)}))
+    user = asyncio.run(auth.auth_google(auth.GoogleToken(code='code')))
+    assert user.id == 'u1' and saved == ['u1']
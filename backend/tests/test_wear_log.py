@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from modules import wear_log
+from modules.closet import Closet
+from modules.embeddings import get_embedding_index
+
+
+def unit(seed: int, dim: int = 8) -> np.ndarray:
+    vector = np.random.default_rng(seed).normal(size=dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+@pytest.fixture
+def photo(monkeypatch):
+    """An outfit photo whose garments embed to the given vectors, without running the models."""
+    garments = {}
+    monkeypatch.setattr(wear_log, 'segment_garments', lambda image: (None, dict.fromkeys(garments)))
+    monkeypatch.setattr(wear_log, 'cutout_inputs', lambda pixels, masks: None)
+    monkeypatch.setattr(wear_log, 'classify_and_embed_inputs',
+                        lambda inputs: (None, np.stack(list(garments.values()))))
+    return garments
+
+
+def test_every_photographed_garment_is_reported(user_id, make_item, photo):
+    shirt, skirt = make_item(), make_item()
+    Closet(user_id).add_items([shirt, skirt])
+    index = get_embedding_index(user_id)
+    index.append(shirt['id'], {'masked_1': unit(1)})
+    index.append(skirt['id'], {'masked_2': unit(2)})
+
+    # Two tops in the photo resemble the same closet shirt; the closer one is it
+    photo['masked_1'] = unit(1) + 0.2 * unit(3)
+    photo['masked_1_2'] = unit(1)
+    photo['masked_2'] = unit(4)
+    outfit = wear_log.log_outfit(user_id, None)
+
+    assert [(m['item_id'], m['photo_garment']) for m in outfit['matches']] == [(shirt['id'], 'masked_1_2')]
+    unmatched = {entry['photo_garment']: entry for entry in outfit['unmatched']}
+    assert set(unmatched) == {'masked_1', 'masked_2'}
+    assert unmatched['masked_1']['reason'] == 'duplicate' and unmatched['masked_1']['item_id'] == shirt['id']
+    assert unmatched['masked_2']['reason'] == 'no_match'
+    assert wear_log.get_wear_log(user_id).item_stats(shirt['id'])['count'] == 1
+
+
+def test_deleted_items_are_not_matched(user_id, make_item, photo):
+    shirt = make_item()
+    closet = Closet(user_id)
+    closet.add_items([shirt])
+    get_embedding_index(user_id).append(shirt['id'], {'masked_1': unit(1)})
+    closet.delete_item(shirt['id'])
+
+    photo['masked_1'] = unit(1)
+    outfit = wear_log.log_outfit(user_id, None)
+    assert outfit['matches'] == [] and outfit['unmatched'][0]['reason'] == 'no_match'